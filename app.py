@@ -6,28 +6,25 @@ from bs4 import BeautifulSoup
 import re
 import sqlite3
 import tempfile
-import random
+import secrets
 from datetime import datetime
 from functools import wraps
-from fpdf import FPDF
 from flask import send_file
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from PIL import Image
-import fitz
-from pdf2docx import Converter
-import pdfplumber
-import pandas as pd
-from docx import Document
-import pytesseract
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    session, flash, send_file
+    session, flash, send_file, g, has_app_context, has_request_context
 )
+import click
+import threading
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from flask_mail import Mail, Message
 
-
-from openpyxl import Workbook
+# PDF / Office / OCR / QR libraries (fitz, pdf2docx, pdfplumber, pandas,
+# docx, pytesseract, reportlab, PIL, qrcode) are imported inside the
+# tools, export, upload and report code that uses them → dashboards
+# never pay their import time or memory. See bench_startup.py.
 from werkzeug.utils import secure_filename
 ADMIN_SECURITY_CODE = "GEC_KAIMUR_2025"
 
@@ -42,46 +39,491 @@ DEVELOPER_PASS = "dev123"
 
 UPLOAD_FOLDER = "static/profile_images"
 
+# SQLite connection pool (per gunicorn worker)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", "256"))
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+
+# 0 → import never touches the schema; deploys run `flask db upgrade`
+DB_AUTO_UPGRADE = os.environ.get("DB_AUTO_UPGRADE", "1") == "1"
+
+# One SQLite file per college (see SHARDS); off → everything in DB_NAME
+DB_SHARDS = os.environ.get("DB_SHARDS", "0") == "1"
+DB_SHARD_DIR = os.environ.get("DB_SHARD_DIR", "shards")
+
 # ---------------- FLASK ----------------
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+app.config["DB_POOL_SIZE"] = DB_POOL_SIZE
+app.config["DB_BUSY_TIMEOUT_MS"] = DB_BUSY_TIMEOUT_MS
+app.config["DB_STATEMENT_CACHE"] = DB_STATEMENT_CACHE
+app.config["DB_JOURNAL_MODE"] = DB_JOURNAL_MODE
+app.config["DB_SYNCHRONOUS"] = DB_SYNCHRONOUS
+app.config["DB_AUTO_UPGRADE"] = DB_AUTO_UPGRADE
+app.config["DB_SHARDS"] = DB_SHARDS
+app.config["DB_SHARD_DIR"] = DB_SHARD_DIR
 
 # Mail config (optional)
-app.config["MAIL_SERVER"] = "smtp.gmail.com"
-app.config["MAIL_PORT"] = 587
-app.config["MAIL_USE_TLS"] = True
+# local debugging server: MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=0
+# (python -m aiosmtpd -n -l localhost:1025)
+app.config["MAIL_SERVER"] = os.environ.get("MAIL_SERVER", "smtp.gmail.com")
+app.config["MAIL_PORT"] = int(os.environ.get("MAIL_PORT", "587"))
+app.config["MAIL_USE_TLS"] = os.environ.get("MAIL_USE_TLS", "1") == "1"
 app.config["MAIL_USERNAME"] = MAIL_USERNAME
 app.config["MAIL_PASSWORD"] = MAIL_PASSWORD
 
+# Outbox delivery (background, see send_email)
+app.config["MAIL_WORKERS"] = int(os.environ.get("MAIL_WORKERS", "2"))
+app.config["MAIL_BATCH_SIZE"] = int(os.environ.get("MAIL_BATCH_SIZE", "20"))
+app.config["MAIL_MAX_ATTEMPTS"] = int(os.environ.get("MAIL_MAX_ATTEMPTS", "5"))
+app.config["MAIL_RETRY_BASE"] = int(os.environ.get("MAIL_RETRY_BASE", "30"))
+app.config["MAIL_POLL_INTERVAL"] = int(os.environ.get("MAIL_POLL_INTERVAL", "10"))
+
+# Password hashing (see PASSWORDS). Spell the method the way werkzeug
+# writes it ("scrypt:N:r:p" / "pbkdf2:sha256:iterations"); rows hashed
+# with anything else are rehashed on their next login.
+# `flask password-cost` times a method on this machine.
+app.config["PASSWORD_METHOD"] = os.environ.get("PASSWORD_METHOD", "scrypt:16384:8:1")
+app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+app.config["PASSWORD_HASH_QUEUE"] = int(os.environ.get("PASSWORD_HASH_QUEUE", "16"))
+app.config["PASSWORD_HASH_WAIT"] = float(os.environ.get("PASSWORD_HASH_WAIT", "1.5"))
+app.config["PASSWORD_CACHE_TTL"] = int(os.environ.get("PASSWORD_CACHE_TTL", "900"))
+app.config["PASSWORD_CACHE_SIZE"] = int(os.environ.get("PASSWORD_CACHE_SIZE", "4096"))
+
+# Server-side sessions + per-worker user profile LRU (see SESSIONS)
+app.config["SESSION_TTL"] = int(os.environ.get("SESSION_TTL", str(7 * 24 * 3600)))
+app.config["SESSION_SWEEP_INTERVAL"] = int(os.environ.get("SESSION_SWEEP_INTERVAL", "600"))
+app.config["PROFILE_CACHE_SIZE"] = int(os.environ.get("PROFILE_CACHE_SIZE", "2048"))
+
 mail = Mail(app)
 
 
 # ---------------- DB ----------------
+class PooledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection handed out by ConnectionPool.
+    Routes still call conn.close(); for a pooled connection that is a
+    no-op and the connection goes back to the pool at teardown.
+    """
+    pooled = False
+
+    def close(self):
+        if not self.pooled:
+            super().close()
+
+    def really_close(self):
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Per-worker pool of WAL-mode SQLite connections.
+    Connections keep their prepared-statement cache between requests.
+    A forked worker (gunicorn --preload) starts with an empty pool.
+    """
+
+    def __init__(self, path, size=8, busy_timeout_ms=5000,
+                 statement_cache=256, journal_mode="WAL",
+                 synchronous="NORMAL"):
+        self.path = path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.statement_cache = statement_cache
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+
+    def connect(self, pooled=False):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+            factory=PooledConnection
+        )
+        conn.pooled = pooled
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    def acquire(self):
+        if os.getpid() != self._pid:
+            # forked worker → never reuse the parent's handles
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connect(pooled=True)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.really_close()
+            return
+
+        if os.getpid() != self._pid or self._idle.qsize() >= self.size:
+            conn.really_close()
+        else:
+            self._idle.put(conn)
+
+    def clear(self):
+        while True:
+            try:
+                self._idle.get_nowait().really_close()
+            except queue.Empty:
+                break
+
+
+_db_pools = {}
+_db_pool_lock = threading.Lock()
+
+
+def new_pool(path):
+    cfg = app.config
+    return ConnectionPool(
+        path,
+        size=cfg["DB_POOL_SIZE"],
+        busy_timeout_ms=cfg["DB_BUSY_TIMEOUT_MS"],
+        statement_cache=cfg["DB_STATEMENT_CACHE"],
+        journal_mode=cfg["DB_JOURNAL_MODE"],
+        synchronous=cfg["DB_SYNCHRONOUS"]
+    )
+
+
+def get_pool(college_id=None):
+    """
+    Pool of the main database, or of college_id's shard when DB_SHARDS is
+    on and that shard exists. Shards are only created by `flask
+    shard-split`; until then a college stays in the main database.
+    """
+    path = DB_NAME
+    if college_id is not None and app.config["DB_SHARDS"]:
+        path = shard_path(college_id)
+
+    pool = _db_pools.get(path)
+    if pool is None:
+        if path != DB_NAME and not os.path.exists(path):
+            return get_pool()
+        with _db_pool_lock:
+            pool = _db_pools.get(path)
+            if pool is None:
+                pool = _db_pools[path] = new_pool(path)
+    return pool
+
+
+def clear_pools():
+    with _db_pool_lock:
+        for pool in _db_pools.values():
+            pool.clear()
+        _db_pools.clear()
+
+
 def get_db():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
-def ensure_reg_unique():
-    conn = get_db()
-    conn.execute(
-        "CREATE UNIQUE INDEX IF NOT EXISTS idx_reg_college ON users(registration_no, college)"
+    # inside a request → one pooled connection per app context,
+    # from the shard of the session's college
+    if has_app_context():
+        if "db" not in g:
+            g.db_pool = get_pool(request_shard())
+            g.db = g.db_pool.acquire()
+        return g.db
+
+    # startup / background code → plain connection, close() really closes
+    return get_pool().connect()
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        g.pop("db_pool").release(conn)
+
+
+# ---------------- TENANCY ----------------
+# Every college is a tenant. Tenant tables carry college_id (colleges.id)
+# and each of their indexes leads with it, so a college's queries touch
+# only its own slice of the index however big the other colleges grow.
+# Request code scopes with college_scope(); writers stamp college_id.
+TENANT_TABLES = (
+    "users", "leaves", "attendance", "support_messages",
+    "beu_results", "qr_tokens"
+)
+
+
+def college_id_for(conn, name):
+    """colleges.id for a college name, None if it is not in the list."""
+    if not name:
+        return None
+    return conn.execute(
+        "SELECT MIN(id) FROM colleges WHERE name = ?", (name,)
+    ).fetchone()[0]
+
+
+def current_college_id():
+    """The session's college as an id, looked up once per session."""
+    if session.get("college_id") is None and session.get("college"):
+        # the college list lives in the main database, shards or not
+        pool = get_pool()
+        conn = pool.acquire()
+        try:
+            session["college_id"] = college_id_for(conn, session["college"])
+        finally:
+            pool.release(conn)
+    return session.get("college_id")
+
+
+def college_scope(alias=None):
+    """("<alias>.college_id = ?", [id]) for the session's college."""
+    column = f"{alias}.college_id" if alias else "college_id"
+    return f"{column} = ?", [current_college_id()]
+
+
+# ---------------- SHARDS ----------------
+# DB_SHARDS=1 gives each college its own SQLite file in DB_SHARD_DIR, so a
+# long write at one college (semester promotion, roll import) never holds
+# the writer lock for the others. DB_NAME stays the main database: the
+# college list, mail outbox and tool jobs live there, and with sharding
+# off so does everything else. Requests go to the shard of the session's
+# college; cross-college readers go through fan_out(). An existing
+# leave.db is split with `flask shard-split`, the only path that creates
+# shard files; `flask db upgrade` migrates the ones that exist.
+SHARD_FILE_RE = re.compile(r"college_(\d+)\.db$")
+SHARD_ID_SPAN = 10 ** 9     # shard of college k hands out users.id from k * SPAN
+
+# copied in full into every shard (joined by tenant queries)
+SHARD_SHARED_TABLES = ("colleges", "subjects")
+
+# rows that belong to one college, for shard-split (?1 = college_id)
+SHARD_TABLES = {
+    "users": "college_id = ?1",
+    "leaves": "college_id = ?1",
+    "attendance": "college_id = ?1",
+    "attendance_summary":
+        "student_id IN (SELECT id FROM src.users WHERE college_id = ?1)",
+    "support_messages": "college_id = ?1",
+    "support_conversations": "college_id = ?1",
+    "support_read_cursors":
+        "student_id IN (SELECT id FROM src.users WHERE college_id = ?1)",
+    "beu_results": "college_id = ?1",
+    "beu_fetch_jobs": "college_id = ?1",
+    "beu_raw_cache":
+        "registration_no IN (SELECT registration_no FROM src.users WHERE college_id = ?1)",
+    "semester_logs":
+        "admin_id IN (SELECT id FROM src.users WHERE college_id = ?1)",
+    "semester_log_items": """log_id IN (
+        SELECT l.id FROM src.semester_logs l
+        JOIN src.users u ON u.id = l.admin_id
+        WHERE u.college_id = ?1
+    )""",
+    "student_imports":
+        "admin_id IN (SELECT id FROM src.users WHERE college_id = ?1)",
+}
+
+
+def shard_path(college_id):
+    return os.path.join(app.config["DB_SHARD_DIR"], f"college_{int(college_id)}.db")
+
+
+def shard_ids():
+    """Colleges that have a shard file."""
+    folder = app.config["DB_SHARD_DIR"]
+    if not os.path.isdir(folder):
+        return []
+    return sorted(
+        int(m.group(1)) for m in map(SHARD_FILE_RE.match, os.listdir(folder)) if m
     )
-    conn.commit()
-    conn.close()
 
-def ensure_status_column():
-    conn = get_db()
-    cols = conn.execute("PRAGMA table_info(users)").fetchall()
-    names = [c[1] for c in cols]
 
-    if "status" not in names:
-        conn.execute("ALTER TABLE users ADD COLUMN status TEXT DEFAULT 'active'")
+def init_shard(college_id):
+    """Create a college's shard from the main schema, or bring it up to date."""
+    os.makedirs(app.config["DB_SHARD_DIR"], exist_ok=True)
+    conn = new_pool(shard_path(college_id)).connect()
+
+    try:
+        fresh = not table_columns(conn, "users")
+        conn.execute("ATTACH DATABASE ? AS main_db", (DB_NAME,))
+
+        if fresh:
+            # same tables, indexes and schema version as the main database
+            for (sql,) in conn.execute("""
+                SELECT sql FROM main_db.sqlite_master
+                WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+                ORDER BY type = 'index'
+            """).fetchall():
+                conn.execute(sql)
+            version = conn.execute("PRAGMA main_db.user_version").fetchone()[0]
+            conn.execute(f"PRAGMA user_version={int(version)}")
+
+        for table in SHARD_SHARED_TABLES:
+            cols = ", ".join(table_columns(conn, table))
+            if cols:
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO main.{table} ({cols})
+                    SELECT {cols} FROM main_db.{table}
+                """)
         conn.commit()
+        conn.execute("DETACH DATABASE main_db")
 
+        run_migrations(conn)
+
+        # new users get ids no other shard hands out (photos, tool jobs)
+        conn.execute("""
+            INSERT INTO sqlite_sequence (name, seq)
+            SELECT 'users', 0
+            WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name='users')
+        """)
+        conn.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name='users'",
+            (int(college_id) * SHARD_ID_SPAN,)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def request_shard():
+    """college_id whose shard serves this request; None → main database."""
+    if not app.config["DB_SHARDS"] or not has_request_context():
+        return None
+    return current_college_id()
+
+
+def fan_out(fn):
+    """
+    fn(conn) on every college's data → [(college_id, result), ...].
+    The main database comes first (college_id None): with sharding off it
+    is the only target, with it on it serves the colleges without a
+    shard and still holds the pre-split copy of the others, which
+    readers skip (see unsharded_rows).
+    """
+    targets = [None] + (shard_ids() if app.config["DB_SHARDS"] else [])
+    results = []
+    for college_id in targets:
+        pool = get_pool(college_id)
+        conn = pool.acquire()
+        try:
+            results.append((college_id, fn(conn)))
+        finally:
+            pool.release(conn)
+    return results
+
+
+def unsharded_rows(results):
+    """Rows from fan_out() results, minus main-database copies of sharded colleges."""
+    sharded = set(shard_ids()) if app.config["DB_SHARDS"] else set()
+    return [
+        row
+        for college_id, rows in results
+        for row in rows
+        if college_id is not None or row["college_id"] not in sharded
+    ]
+
+
+@app.cli.command("shard-split")
+@click.option("--force", is_flag=True, help="Rebuild shard files that already exist.")
+def shard_split_command(force):
+    """Copy each college's rows from the main database into its shard."""
+    conn = get_pool().connect()
+    college_ids = [r[0] for r in conn.execute("""
+        SELECT DISTINCT college_id FROM users
+        WHERE college_id IS NOT NULL
+        ORDER BY college_id
+    """)]
     conn.close()
-def ensure_semester_logs():
-    conn = get_db()
+
+    for college_id in college_ids:
+        path = shard_path(college_id)
+        if os.path.exists(path):
+            if not force:
+                print(f"college {college_id}: {path} exists, skipped (--force rebuilds)")
+                continue
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+        init_shard(college_id)
+        shard = new_pool(path).connect()
+        shard.execute("ATTACH DATABASE ? AS src", (DB_NAME,))
+        copied = {}
+        for table, where in SHARD_TABLES.items():
+            cols = ", ".join(table_columns(shard, table))
+            if not cols:
+                continue
+            copied[table] = shard.execute(f"""
+                INSERT OR REPLACE INTO main.{table} ({cols})
+                SELECT {cols} FROM src.{table} WHERE {where}
+            """, (college_id,)).rowcount
+        shard.commit()
+        shard.execute("DETACH DATABASE src")
+        shard.close()
+
+        print(f"college {college_id}: " + ", ".join(
+            f"{table} {n}" for table, n in copied.items() if n
+        ))
+
+    with _db_pool_lock:
+        for path in [p for p in _db_pools if p != DB_NAME]:
+            _db_pools.pop(path).clear()
+
+
+@app.cli.command("shard-report")
+def shard_report_command():
+    """Students, leaves and attendance rows per college, across shards."""
+    counts = {}
+    for college_id, kind, n in unsharded_rows(fan_out(lambda conn: conn.execute("""
+        SELECT college_id, 'students' AS kind, COUNT(*) FROM users
+        WHERE role='student' GROUP BY college_id
+        UNION ALL
+        SELECT college_id, 'leaves', COUNT(*) FROM leaves GROUP BY college_id
+        UNION ALL
+        SELECT college_id, 'attendance', COUNT(*) FROM attendance GROUP BY college_id
+    """).fetchall())):
+        counts.setdefault(college_id, {})[kind] = n
+
+    conn = get_pool().connect()
+    names = dict(conn.execute("SELECT id, name FROM colleges"))
+    conn.close()
+
+    for college_id, c in sorted(counts.items(), key=lambda x: x[0] or 0):
+        print(f"{college_id or '-':>6}  {names.get(college_id, '?')[:40]:40}  "
+              f"students {c.get('students', 0):7}  leaves {c.get('leaves', 0):8}  "
+              f"attendance {c.get('attendance', 0):9}")
+
+
+# ---------------- MIGRATIONS ----------------
+# Each step runs once per database, tracked in PRAGMA user_version.
+# Steps must be idempotent: older databases were patched by the
+# ad-hoc ensure_* calls before the version counter existed.
+
+def table_columns(conn, table):
+    return [c[1] for c in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def create_index(conn, name, table, cols, unique=False):
+    # skip silently on half-built schemas (app create_tables vs init_db.py)
+    existing = table_columns(conn, table)
+    if not existing or any(c not in existing for c in cols):
+        return
+    conn.execute(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} "
+        f"ON {table}({', '.join(cols)})"
+    )
+
+
+def ensure_status_column(conn):
+    if "status" not in table_columns(conn, "users"):
+        conn.execute("ALTER TABLE users ADD COLUMN status TEXT DEFAULT 'active'")
+
+
+def ensure_semester_logs(conn):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS semester_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -93,10 +535,9 @@ def ensure_semester_logs():
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    conn.commit()
-    conn.close()
-def ensure_beu_table():
-    conn = get_db()
+
+
+def ensure_beu_table(conn):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS beu_results (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -106,12 +547,636 @@ def ensure_beu_table():
             marks INTEGER
         )
     """)
-    conn.commit()
+
+
+def ensure_hot_indexes(conn):
+    # student_submit_token
+    create_index(conn, "idx_qr_display", "qr_tokens",
+                 ["display_token", "used", "expires_at"])
+    # student_dashboard (daily list) + subject-wise join / % subqueries
+    create_index(conn, "idx_att_student_date", "attendance",
+                 ["student_id", "date", "status"])
+    create_index(conn, "idx_att_student_subject", "attendance",
+                 ["student_id", "subject_id", "status"])
+    # login / forgot_password / register_admin
+    create_index(conn, "idx_users_email_college", "users",
+                 ["email", "college"])
+    # admin_attendance student list, attendance records
+    create_index(conn, "idx_users_dept_sem", "users",
+                 ["department", "semester"])
+    # subject lists for dashboards / attendance
+    create_index(conn, "idx_subjects_dept_sem", "subjects",
+                 ["department", "semester"])
+    # student_dashboard leaves
+    create_index(conn, "idx_leaves_student", "leaves",
+                 ["student_id", "applied_on"])
+
+
+def ensure_attendance_unique(conn):
+    if "subject_id" not in table_columns(conn, "attendance"):
+        return
+    # keep the latest mark when a form was double-submitted
+    conn.execute("""
+        DELETE FROM attendance
+        WHERE id NOT IN (
+            SELECT MAX(id)
+            FROM attendance
+            GROUP BY student_id, subject_id, date
+        )
+    """)
+    create_index(conn, "ux_att_student_subject_date", "attendance",
+                 ["student_id", "subject_id", "date"], unique=True)
+
+
+def ensure_qr_token_indexes(conn):
+    if not table_columns(conn, "qr_tokens"):
+        return
+    # tokens are short-lived; old rows used local time for expires_at,
+    # new ones use UTC like CURRENT_TIMESTAMP
+    conn.execute("DELETE FROM qr_tokens")
+    create_index(conn, "idx_qr_full", "qr_tokens", ["full_token"])
+    create_index(conn, "idx_qr_subject", "qr_tokens",
+                 ["subject_id", "used", "expires_at"])
+
+
+def ensure_qr_checkins(conn):
+    if not table_columns(conn, "qr_tokens"):
+        return
+    cols = table_columns(conn, "qr_tokens")
+    # NULL max_uses → one class token, any number of students until expiry
+    if "max_uses" not in cols:
+        conn.execute("ALTER TABLE qr_tokens ADD COLUMN max_uses INTEGER")
+    if "uses" not in cols:
+        conn.execute("ALTER TABLE qr_tokens ADD COLUMN uses INTEGER DEFAULT 0")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS qr_checkins (
+            token_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (token_id, student_id)
+        ) WITHOUT ROWID
+    """)
+
+
+def ensure_mail_outbox(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS mail_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            subject TEXT,
+            body TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            claimed_at DATETIME,
+            sent_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    create_index(conn, "idx_mail_status", "mail_outbox",
+                 ["status", "next_attempt_at"])
+
+
+def ensure_beu_jobs(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS beu_fetch_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            branch TEXT,
+            semester TEXT,
+            status TEXT DEFAULT 'running',
+            total INTEGER DEFAULT 0,
+            done INTEGER DEFAULT 0,
+            fetched INTEGER DEFAULT 0,
+            cached INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS beu_raw_cache (
+            registration_no TEXT NOT NULL,
+            semester TEXT NOT NULL,
+            html TEXT,
+            fetched_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (registration_no, semester)
+        )
+    """)
+    create_index(conn, "idx_beu_reg_sem", "beu_results",
+                 ["registration_no", "semester"])
+
+
+def ensure_tool_jobs(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tool_jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            action TEXT,
+            status TEXT DEFAULT 'queued',
+            output TEXT,
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )
+    """)
+    create_index(conn, "idx_tool_jobs_user", "tool_jobs",
+                 ["user_id", "status", "created_at"])
+
+
+def ensure_leave_stats(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    create_index(conn, "idx_leaves_student_status", "leaves",
+                 ["student_id", "status"])
+
+
+def ensure_leave_list_indexes(conn):
+    # newest-first walks for the paginated admin leave list
+    create_index(conn, "idx_leaves_applied", "leaves", ["applied_on"])
+    create_index(conn, "idx_leaves_status_applied", "leaves",
+                 ["status", "applied_on"])
+
+
+# per (student, subject, semester) counts straight from raw attendance
+ATTENDANCE_COUNTS_SQL = """
+    SELECT
+        student_id,
+        subject_id,
+        semester,
+        COUNT(*) AS total,
+        SUM(CASE WHEN status='Present' THEN 1 ELSE 0 END) AS present
+    FROM attendance
+"""
+
+
+def rebuild_attendance_summary(conn):
+    """Recompute attendance_summary from every attendance row."""
+    conn.execute("DELETE FROM attendance_summary")
+    conn.execute(f"""
+        INSERT INTO attendance_summary
+        (student_id, subject_id, semester, total, present)
+        {ATTENDANCE_COUNTS_SQL}
+        GROUP BY student_id, subject_id, semester
+    """)
+
+
+def ensure_attendance_summary(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_summary (
+            student_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            semester INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            present INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (student_id, subject_id, semester)
+        ) WITHOUT ROWID
+    """)
+    cols = table_columns(conn, "attendance")
+    if all(c in cols for c in ("subject_id", "semester")):
+        rebuild_attendance_summary(conn)
+
+
+def ensure_support_read_cursors(conn):
+    # one row per thread replaces the per-message seen flag
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS support_read_cursors (
+            student_id INTEGER PRIMARY KEY,
+            student_read_id INTEGER NOT NULL DEFAULT 0,
+            admin_read_id INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    create_index(conn, "idx_support_student", "support_messages",
+                 ["student_id"])
+    if "seen" in table_columns(conn, "support_messages"):
+        conn.execute("""
+            INSERT OR IGNORE INTO support_read_cursors
+            (student_id, student_read_id, admin_read_id)
+            SELECT
+                student_id,
+                COALESCE(MAX(CASE WHEN sender='admin' AND seen=1 THEN id END), 0),
+                COALESCE(MAX(CASE WHEN sender='student' AND seen=1 THEN id END), 0)
+            FROM support_messages
+            GROUP BY student_id
+        """)
+
+
+SUPPORT_PREVIEW_CHARS = 120
+
+
+def ensure_support_conversations(conn):
+    # one row per thread for the admin inbox, kept by post_support_message
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS support_conversations (
+            student_id INTEGER PRIMARY KEY,
+            college TEXT,
+            department TEXT,
+            last_message_id INTEGER NOT NULL,
+            last_message_at DATETIME,
+            last_preview TEXT,
+            last_sender TEXT,
+            unread_by_admin INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    create_index(conn, "idx_support_inbox", "support_conversations",
+                 ["college", "department", "last_message_id"])
+    # users from init_db.py have no college column
+    college = "u.college" if "college" in table_columns(conn, "users") else "NULL"
+    conn.execute(f"""
+        INSERT OR IGNORE INTO support_conversations
+        (student_id, college, department, last_message_id, last_message_at,
+         last_preview, last_sender, unread_by_admin)
+        SELECT
+            u.id,
+            {college},
+            u.department,
+            m.id,
+            m.created_at,
+            substr(m.message, 1, {SUPPORT_PREVIEW_CHARS}),
+            m.sender,
+            (
+                SELECT COUNT(*)
+                FROM support_messages x
+                WHERE x.student_id = u.id
+                  AND x.sender = 'student'
+                  AND x.id > COALESCE(rc.admin_read_id, 0)
+            )
+        FROM (
+            SELECT student_id, MAX(id) AS last_id
+            FROM support_messages
+            GROUP BY student_id
+        ) t
+        JOIN support_messages m ON m.id = t.last_id
+        JOIN users u ON u.id = t.student_id
+        LEFT JOIN support_read_cursors rc ON rc.student_id = t.student_id
+    """)
+
+
+def ensure_semester_log_items(conn):
+    # one row per student per semester action → bulk undo
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS semester_log_items (
+            log_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            old_semester INTEGER,
+            new_semester INTEGER,
+            old_status TEXT,
+            new_status TEXT,
+            PRIMARY KEY (log_id, student_id)
+        ) WITHOUT ROWID
+    """)
+    if "undone_at" not in table_columns(conn, "semester_logs"):
+        conn.execute("ALTER TABLE semester_logs ADD COLUMN undone_at DATETIME")
+    create_index(conn, "idx_semester_logs_admin", "semester_logs",
+                 ["admin_id", "undone_at"])
+
+
+def ensure_student_imports(conn):
+    cols = table_columns(conn, "users")
+    if "college" in cols:
+        # blank reg numbers are "none"; a reg number belongs to one
+        # student per college → the oldest account keeps it
+        conn.execute("""
+            UPDATE users SET registration_no = NULLIF(TRIM(registration_no), '')
+            WHERE registration_no IS NOT NULL
+        """)
+        cleared = conn.execute("""
+            UPDATE users SET registration_no = NULL
+            WHERE registration_no IS NOT NULL
+              AND id NOT IN (
+                  SELECT MIN(id) FROM users
+                  WHERE registration_no IS NOT NULL
+                  GROUP BY registration_no, college
+              )
+            RETURNING id
+        """).fetchall()
+        if cleared:
+            print("Duplicate registration_no cleared on users:",
+                  ", ".join(str(r[0]) for r in cleared))
+        create_index(conn, "idx_reg_college", "users",
+                     ["registration_no", "college"], unique=True)
+
+    # parsed roll lists waiting for the admin's confirm
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS student_imports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            college TEXT NOT NULL,
+            department TEXT NOT NULL,
+            semester INTEGER NOT NULL,
+            filename TEXT,
+            records TEXT NOT NULL,
+            duplicates INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def ensure_college_ids(conn):
+    if not table_columns(conn, "colleges") or "college" not in table_columns(conn, "users"):
+        return
+
+    for table in TENANT_TABLES + ("support_conversations", "beu_fetch_jobs"):
+        cols = table_columns(conn, table)
+        if cols and "college_id" not in cols:
+            conn.execute(
+                f"ALTER TABLE {table} ADD COLUMN college_id INTEGER REFERENCES colleges(id)"
+            )
+
+    # colleges typed in by hand that never made it into the list
+    conn.execute("""
+        INSERT INTO colleges (name)
+        SELECT DISTINCT college FROM users
+        WHERE college IS NOT NULL
+          AND college NOT IN (SELECT name FROM colleges WHERE name IS NOT NULL)
+    """)
+    conn.execute("""
+        UPDATE users SET college_id = (
+            SELECT MIN(c.id) FROM colleges c WHERE c.name = users.college
+        )
+    """)
+
+    for table in ("leaves", "attendance", "support_messages", "support_conversations"):
+        if table_columns(conn, table):
+            conn.execute(f"""
+                UPDATE {table} SET college_id = (
+                    SELECT u.college_id FROM users u WHERE u.id = {table}.student_id
+                )
+            """)
+    if table_columns(conn, "beu_fetch_jobs"):
+        conn.execute("""
+            UPDATE beu_fetch_jobs SET college_id = (
+                SELECT u.college_id FROM users u WHERE u.id = beu_fetch_jobs.admin_id
+            )
+        """)
+    if table_columns(conn, "beu_results"):
+        conn.execute("""
+            UPDATE beu_results SET college_id = (
+                SELECT u.college_id FROM users u
+                WHERE u.registration_no = beu_results.registration_no
+                  AND u.college_id IS NOT NULL
+                ORDER BY u.id
+                LIMIT 1
+            )
+        """)
+    if table_columns(conn, "qr_tokens"):
+        # tokens live for minutes; the old ones belong to no college
+        conn.execute("DELETE FROM qr_tokens")
+
+    # college-leading indexes replace the branch-only ones
+    conn.execute("DROP INDEX IF EXISTS idx_reg_college")
+    create_index(conn, "ux_users_college_reg", "users",
+                 ["college_id", "registration_no"], unique=True)
+    conn.execute("DROP INDEX IF EXISTS idx_users_dept_sem")
+    create_index(conn, "idx_users_college_dept", "users",
+                 ["college_id", "department", "semester"])
+    conn.execute("DROP INDEX IF EXISTS idx_leaves_applied")
+    conn.execute("DROP INDEX IF EXISTS idx_leaves_status_applied")
+    create_index(conn, "idx_leaves_college_applied", "leaves",
+                 ["college_id", "applied_on"])
+    create_index(conn, "idx_leaves_college_status_applied", "leaves",
+                 ["college_id", "status", "applied_on"])
+    create_index(conn, "idx_att_college_subject_date", "attendance",
+                 ["college_id", "subject_id", "date"])
+    create_index(conn, "idx_support_college_student", "support_messages",
+                 ["college_id", "student_id", "id"])
+    conn.execute("DROP INDEX IF EXISTS idx_support_inbox")
+    create_index(conn, "idx_support_inbox_college", "support_conversations",
+                 ["college_id", "department", "last_message_id"])
+    create_index(conn, "idx_beu_college_reg", "beu_results",
+                 ["college_id", "registration_no", "semester"])
+    conn.execute("DROP INDEX IF EXISTS idx_qr_subject")
+    create_index(conn, "idx_qr_college_subject", "qr_tokens",
+                 ["college_id", "subject_id", "used", "expires_at"])
+    create_index(conn, "idx_beu_jobs_college", "beu_fetch_jobs",
+                 ["college_id", "branch", "semester", "status"])
+
+
+def ensure_college_list(conn):
+    # older databases have colleges without UNIQUE(name), so every boot
+    # appended the default list again → keep the first row of each name
+    # (college_id always points at it, see college_id_for)
+    conn.execute("""
+        DELETE FROM colleges
+        WHERE id NOT IN (SELECT MIN(id) FROM colleges GROUP BY name)
+    """)
+    create_index(conn, "ux_colleges_name", "colleges", ["name"], unique=True)
+    insert_default_colleges(conn)
+
+
+def ensure_sessions(conn):
+    # server-side sessions (see SESSIONS); the cookie only carries the id
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    create_index(conn, "idx_sessions_expires", "sessions", ["expires_at"])
+
+
+MIGRATIONS = [
+    (1, ensure_status_column),
+    (2, ensure_semester_logs),
+    (3, ensure_beu_table),
+    (4, ensure_hot_indexes),
+    (5, ensure_attendance_unique),
+    (6, ensure_qr_token_indexes),
+    (7, ensure_qr_checkins),
+    (8, ensure_mail_outbox),
+    (9, ensure_beu_jobs),
+    (10, ensure_tool_jobs),
+    (11, ensure_leave_stats),
+    (12, ensure_leave_list_indexes),
+    (13, ensure_attendance_summary),
+    (14, ensure_support_read_cursors),
+    (15, ensure_support_conversations),
+    (16, ensure_semester_log_items),
+    (17, ensure_student_imports),
+    (18, ensure_college_ids),
+    (19, ensure_college_list),
+    (20, ensure_sessions),
+]
+
+
+def run_migrations(conn=None):
+    own = conn is None
+    if own:
+        conn = get_db()
+
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        step(conn)
+        # PRAGMA cannot take bound parameters
+        conn.execute(f"PRAGMA user_version={int(version)}")
+        conn.commit()
+        print(f"DB migration {version} applied: {step.__name__}")
+
+    if own:
+        conn.close()
+
+
+# ---------------- QUERY PLAN CHECK ----------------
+# Hot queries that must be answered from an index. Used by
+# `flask check-plans` after schema changes.
+HOT_QUERIES = {
+    "student_submit_token": ("""
+        SELECT id FROM qr_tokens
+        WHERE (display_token = ? OR full_token = ?)
+          AND college_id = ?
+          AND expires_at > CURRENT_TIMESTAMP
+          AND used = 0
+        ORDER BY expires_at DESC
+        LIMIT 1
+    """, ("1A2B3", "1A2B3", 1)),
+    "admin_issue_qr": ("""
+        SELECT id FROM qr_tokens
+        WHERE college_id = ?
+          AND subject_id = ?
+          AND used = 0
+          AND expires_at > ?
+        ORDER BY expires_at DESC
+        LIMIT 1
+    """, (1, 1, "2026-01-01 00:00:00")),
+    "student_dashboard_attendance": ("""
+        SELECT date, status
+        FROM attendance
+        WHERE student_id=?
+        ORDER BY date DESC
+    """, (1,)),
+    "student_dashboard_subjects": ("""
+        SELECT s.name, SUM(sm.total)
+        FROM subjects s
+        LEFT JOIN attendance_summary sm
+            ON sm.subject_id=s.id
+           AND sm.student_id=?
+        WHERE s.department=?
+          AND s.semester=?
+        GROUP BY s.id
+    """, (1, "CSE", 1)),
+    "attendance_percentage": ("""
+        SELECT COUNT(*)
+        FROM attendance a2
+        WHERE a2.student_id = ?
+          AND a2.subject_id = ?
+          AND a2.status = 'Present'
+    """, (1, 1)),
+    "admin_attendance_records": ("""
+        SELECT u.name, a.date, a.status
+        FROM attendance a
+        JOIN users u ON u.id = a.student_id
+        WHERE u.college_id = ?
+          AND u.department = ?
+          AND a.subject_id = ?
+    """, (1, "CSE", 1)),
+    "login": ("""
+        SELECT *
+        FROM users
+        WHERE email=? AND college=?
+    """, ("a@b.c", "X")),
+    "open_session": ("""
+        SELECT data, expires_at,
+               (SELECT version FROM cache_versions WHERE name='profiles')
+        FROM sessions
+        WHERE id = ? AND expires_at > ?
+    """, ("x", 0)),
+    "student_leaves": ("""
+        SELECT *
+        FROM leaves
+        WHERE student_id=?
+        ORDER BY applied_on DESC
+    """, (1,)),
+    "admin_leave_stats": ("""
+        SELECT l.status, COUNT(*)
+        FROM users u
+        JOIN leaves l ON l.student_id = u.id
+        WHERE u.college_id = ?
+          AND u.department IN (?, ?, ?)
+        GROUP BY l.status
+    """, (1, "CSE", "CSE (Network)", "CSE (Cybersecurity)")),
+    "admin_support_inbox": ("""
+        SELECT u.name, sc.unread_by_admin, sc.last_preview
+        FROM support_conversations sc
+        JOIN users u ON u.id = sc.student_id
+        WHERE sc.college_id = ?
+          AND sc.department IN (?, ?)
+        ORDER BY sc.last_message_id DESC
+    """, (1, "CSE", "CSE (Network)")),
+    "admin_leave_page": ("""
+        SELECT l.*, u.name
+        FROM leaves l
+        CROSS JOIN users u ON u.id = l.student_id
+        WHERE l.college_id = ?
+          AND u.department IN (?, ?)
+          AND l.status = ?
+          AND (l.applied_on, l.id) < (?, ?)
+        ORDER BY l.applied_on DESC, l.id DESC
+        LIMIT 26
+    """, (1, "CSE", "CSE (Network)", "Pending", "2026-01-01 00:00:00", 1)),
+    "admin_semester_students": ("""
+        SELECT id, name, roll_no
+        FROM users
+        WHERE role='student'
+          AND college_id = ?
+          AND semester = ?
+          AND department IN (?, ?)
+        ORDER BY roll_no
+    """, (1, 5, "CSE", "CSE (Network)")),
+    "admin_result_toppers": ("""
+        SELECT registration_no, SUM(marks) AS total
+        FROM beu_results
+        WHERE college_id = ?
+        GROUP BY registration_no
+        ORDER BY total DESC
+        LIMIT 10
+    """, (1,)),
+}
+
+
+def check_query_plans(conn):
+    """Return [(query name, plan line)] for every full table SCAN."""
+    bad = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[3]
+            if detail.startswith("SCAN"):
+                bad.append((name, detail))
+    return bad
+
+
+@app.cli.command("check-plans")
+def check_plans_command():
+    conn = get_db()
+    bad = check_query_plans(conn)
     conn.close()
+
+    for name, detail in bad:
+        print(f"FULL SCAN  {name}: {detail}")
+
+    if bad:
+        raise SystemExit(1)
+    print("All hot queries use an index")
+
+
 # ================= BEU FETCH MODULE =================
 # ================= BEU RESULT FETCH MODULE =================
+import json
 import requests
 from bs4 import BeautifulSoup
+from concurrent.futures import as_completed
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
 
 SEM_TEXT = {
     "1": "1st",
@@ -129,90 +1194,196 @@ ROMAN = {
     "5": "V", "6": "VI", "7": "VII", "8": "VIII"
 }
 
-def fetch_and_store_beu(reg, sem):
-
-    sem = str(sem)
-
-    url = (
-        "https://beu-bih.ac.in/result-one/"
+# BEU site access is shared by all batch jobs of a worker: one
+# keep-alive session, at most BEU_MAX_WORKERS requests in flight and
+# at least BEU_MIN_INTERVAL seconds between requests to the same host.
+BEU_RESULT_URL = os.environ.get("BEU_RESULT_URL", "https://beu-bih.ac.in/result-one/")
+BEU_MAX_WORKERS = int(os.environ.get("BEU_MAX_WORKERS", "4"))
+BEU_MIN_INTERVAL = float(os.environ.get("BEU_MIN_INTERVAL", "0.5"))
+BEU_RETRIES = int(os.environ.get("BEU_RETRIES", "3"))
+BEU_TIMEOUT = int(os.environ.get("BEU_TIMEOUT", "20"))
+# raw pages older than this are fetched again (revaluation / corrections);
+# 0 → always fetch
+BEU_CACHE_TTL = int(os.environ.get("BEU_CACHE_TTL", "86400"))
+
+
+class HostRateLimiter:
+    """Spaces out requests to each host by min_interval seconds."""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, 0))
+            self._next[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+beu_http = requests.Session()
+beu_http.mount("https://", HTTPAdapter(pool_maxsize=BEU_MAX_WORKERS))
+beu_http.mount("http://", HTTPAdapter(pool_maxsize=BEU_MAX_WORKERS))
+beu_limiter = HostRateLimiter(BEU_MIN_INTERVAL)
+
+
+def beu_result_url(sem):
+    return (
+        BEU_RESULT_URL +
         f"B.Tech.%20{sem}th%20Semester%20Examination,%202025"
         f"?exam_held=July%2F2025"
         f"&semester={sem}"
     )
 
-    try:
-        session_req = requests.Session()
-
-        # STEP 1 → open result page
-        page = session_req.get(url, timeout=20)
-
-        soup = BeautifulSoup(page.text, "html.parser")
 
-        # STEP 2 → prepare form data
-        data = {
-            "regNo": reg
-        }
-
-        # STEP 3 → submit registration number
-        result = session_req.post(url, data=data, timeout=20)
-
-        html = result.text
-
-        # DEBUG
-        print(html)
-
-        if "Student Name" not in html:
-            print("No result found")
-            return False
-
-        soup = BeautifulSoup(html, "html.parser")
+def beu_request(method, url, **kwargs):
+    error = None
+    for attempt in range(BEU_RETRIES):
+        beu_limiter.wait(url)
+        try:
+            resp = beu_http.request(method, url, timeout=BEU_TIMEOUT, **kwargs)
+            if resp.status_code < 500:
+                return resp
+            error = f"HTTP {resp.status_code}"
+        except requests.RequestException as e:
+            error = e
+        if attempt + 1 < BEU_RETRIES:
+            time.sleep(2 ** attempt)
+    raise RuntimeError(f"BEU request failed: {error}")
+
+
+def fetch_beu_html(reg, sem):
+    # None → BEU has no result for this registration number
+    html = beu_request("POST", beu_result_url(sem), data={"regNo": reg}).text
+    if "Student Name" not in html:
+        return None
+    return html
 
-        rows = soup.find_all("tr")
 
-        conn = get_db()
+def parse_beu_rows(html):
+    soup = BeautifulSoup(html, "html.parser")
+    rows = []
 
-        # old result delete
-        conn.execute("""
-            DELETE FROM beu_results
-            WHERE registration_no=? AND semester=?
-        """, (reg, sem))
+    for tr in soup.find_all("tr"):
+        cols = tr.find_all("td")
+        if len(cols) >= 3:
+            subject = cols[0].get_text(strip=True)
+            m = re.search(r"\d+", cols[-1].get_text(strip=True))
+            if m:
+                rows.append((subject, int(m.group())))
 
-        for tr in rows:
+    return rows
 
-            cols = tr.find_all("td")
 
-            if len(cols) >= 3:
+def store_beu_results(conn, results, raw=(), college_id=None):
+    """
+    results: {(reg, sem): [(subject, marks), ...]}
+    raw: [(reg, sem, html), ...] for beu_raw_cache
+    Replaces those students' rows of college_id in one transaction.
+    """
+    conn.executemany("""
+        DELETE FROM beu_results
+        WHERE college_id IS ? AND registration_no=? AND semester=?
+    """, [(college_id, reg, sem) for reg, sem in results])
+
+    conn.executemany("""
+        INSERT INTO beu_results
+        (college_id, registration_no, semester, subject, marks)
+        VALUES (?, ?, ?, ?, ?)
+    """, [
+        (college_id, reg, sem, subject, marks)
+        for (reg, sem), rows in results.items()
+        for subject, marks in rows
+    ])
+
+    conn.executemany("""
+        INSERT OR REPLACE INTO beu_raw_cache (registration_no, semester, html)
+        VALUES (?, ?, ?)
+    """, list(raw))
 
-                subject = cols[0].get_text(strip=True)
-                marks_text = cols[-1].get_text(strip=True)
+    conn.commit()
 
-                m = re.search(r"\d+", marks_text)
 
-                if m:
+def update_beu_job(conn, job_id, **fields):
+    sets = ", ".join(f"{k}=?" for k in fields)
+    conn.execute(f"UPDATE beu_fetch_jobs SET {sets} WHERE id=?", (*fields.values(), job_id))
+    conn.commit()
 
-                    marks = int(m.group())
 
-                    conn.execute("""
-                        INSERT INTO beu_results
-                        (registration_no, semester, subject, marks)
-                        VALUES (?, ?, ?, ?)
-                    """, (
-                        reg,
-                        sem,
-                        subject,
-                        marks
-                    ))
+def run_beu_job(job_id, regs, sem, college_id=None, refetch=False):
+    sem = str(sem)
+    conn = get_pool(college_id).connect()
 
-        conn.commit()
-        conn.close()
+    try:
+        # raw-response cache → no HTTP for students fetched within
+        # BEU_CACHE_TTL; refetch skips it
+        cached = {}
+        if not refetch and BEU_CACHE_TTL > 0:
+            since = sql_timestamp(utc_now() - timedelta(seconds=BEU_CACHE_TTL))
+            cached = {
+                row["registration_no"]: row["html"]
+                for row in conn.execute("""
+                    SELECT registration_no, html
+                    FROM beu_raw_cache
+                    WHERE semester = ?
+                      AND fetched_at >= ?
+                      AND registration_no IN (SELECT value FROM json_each(?))
+                """, (sem, since, json.dumps(regs)))
+            }
 
-        print("BEU Result fetched")
-        return True
+        results = {}
+        raw = []
+        for reg, html in cached.items():
+            results[(reg, sem)] = parse_beu_rows(html)
+
+        todo = [reg for reg in regs if reg not in cached]
+        done = len(cached)
+        fetched = failed = 0
+        update_beu_job(conn, job_id, done=done, cached=len(cached))
+
+        if todo:
+            try:
+                beu_request("GET", beu_result_url(sem))   # session cookies
+            except Exception as e:
+                print("BEU warm-up failed:", e)
+
+        with ThreadPoolExecutor(max_workers=BEU_MAX_WORKERS, thread_name_prefix="beu") as ex:
+            futures = {ex.submit(fetch_beu_html, reg, sem): reg for reg in todo}
+
+            for fut in as_completed(futures):
+                reg = futures[fut]
+                try:
+                    html = fut.result()
+                except Exception as e:
+                    print("BEU ERROR:", reg, e)
+                    html = None
+
+                rows = parse_beu_rows(html) if html else []
+                if rows:
+                    results[(reg, sem)] = rows
+                    raw.append((reg, sem, html))
+                    fetched += 1
+                else:
+                    failed += 1
+
+                done += 1
+                update_beu_job(conn, job_id, done=done, fetched=fetched, failed=failed)
+
+        store_beu_results(conn, results, raw, college_id)
+        update_beu_job(conn, job_id, status="done", finished_at=sql_timestamp(utc_now()))
 
     except Exception as e:
-        print("BEU ERROR:", e)
-        return False
-
+        print("BEU JOB ERROR:", e)
+        if conn.in_transaction:
+            conn.rollback()
+        update_beu_job(conn, job_id, status="failed", error=str(e),
+                       finished_at=sql_timestamp(utc_now()))
+    finally:
+        conn.close()
 
 
 def parse_beu_marks(html):
@@ -283,28 +1454,12 @@ def fix_users_unique_email():
     conn.commit()
     conn.close()
 
-def create_tables():
-    conn = get_db()
+def create_tables(conn=None):
+    own = conn is None
+    if own:
+        conn = get_db()
     c = conn.cursor()
 
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            email TEXT UNIQUE,
-            password TEXT,
-            role TEXT,
-            department TEXT,
-            semester TEXT,
-            roll_no TEXT,
-            registration_no TEXT,
-            parent_phone TEXT,
-            parent_email TEXT,
-            admin_branch TEXT,
-            photo TEXT DEFAULT '',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
     # ---------- COLLEGES ----------
     c.execute("""
         CREATE TABLE IF NOT EXISTS colleges (
@@ -342,6 +1497,7 @@ def create_tables():
             from_date TEXT,
             to_date TEXT,
             reason TEXT,
+            medical_file TEXT,
             status TEXT DEFAULT 'Pending',
             decision_reason TEXT,
             applied_on TEXT DEFAULT CURRENT_TIMESTAMP,
@@ -353,6 +1509,7 @@ def create_tables():
         CREATE TABLE IF NOT EXISTS attendance (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             student_id INTEGER,
+            subject_id INTEGER,
             date TEXT,
             status TEXT,
             semester TEXT,
@@ -394,11 +1551,42 @@ def create_tables():
             UNIQUE(email, college)
         )
     """)
-    
+
+    # tables the migrations build on (an empty file used to stop at
+    # migration 15); subjects rows come with the shipped leave.db
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            department TEXT NOT NULL,
+            semester INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS qr_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_token TEXT,
+            display_token TEXT,
+            subject_id INTEGER,
+            expires_at DATETIME,
+            used INTEGER DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS support_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            sender TEXT CHECK(sender IN ('student','admin')) NOT NULL,
+            message TEXT NOT NULL,
+            seen INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
 
     conn.commit()
-    conn.close()
-def insert_default_colleges():
+    if own:
+        conn.close()
+def insert_default_colleges(conn):
     colleges = [
 "SITAMARHI INSTITUTE OF TECHNOLOGY",
 "B. P. MANDAL COLLEGE OF ENGINEERING, MADHEPURA",
@@ -457,34 +1645,612 @@ def insert_default_colleges():
 "MOTI BABU INSTITUTE OF TECHNOLOGY"
     ]
 
-    conn = get_db()
-    for col in colleges:
-        conn.execute(
-            "INSERT OR IGNORE INTO colleges (name) VALUES (?)",
-            (col,)
-        )
-    conn.commit()
+    conn.executemany(
+        "INSERT OR IGNORE INTO colleges (name) VALUES (?)",
+        [(col,) for col in colleges]
+    )
+
+
+# ---------------- SCHEMA BOOTSTRAP ----------------
+# Schema work (create_tables, MIGRATIONS, default colleges) runs from
+# `flask db upgrade`. Importing the app only compares PRAGMA user_version
+# with the newest migration: on a current database a worker boot is one
+# read and never waits for the write lock. DB_AUTO_UPGRADE=1 (default)
+# still upgrades an outdated database on import, for `python app.py`.
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def upgrade_db(conn):
+    """Create the tables of an empty database, then apply pending migrations."""
+    if not table_columns(conn, "users"):
+        create_tables(conn)
+    run_migrations(conn)
+
+
+def bootstrap_db():
+    conn = get_pool().connect()
+    try:
+        version = schema_version(conn)
+        if version >= SCHEMA_VERSION:
+            return
+        if app.config["DB_AUTO_UPGRADE"]:
+            upgrade_db(conn)
+        else:
+            print(f"DB schema is at version {version}, the app expects "
+                  f"{SCHEMA_VERSION}: run `flask db upgrade`")
+    finally:
+        conn.close()
+
+
+@app.cli.group("db")
+def db_cli():
+    """Database schema commands."""
+
+
+@db_cli.command("upgrade")
+def db_upgrade_command():
+    """Create missing tables and apply pending migrations (and shards)."""
+    conn = get_pool().connect()
+    before = schema_version(conn)
+    upgrade_db(conn)
+    after = schema_version(conn)
     conn.close()
+    print(f"main database: version {before} → {after}")
+
+    if app.config["DB_SHARDS"]:
+        for college_id in shard_ids():
+            init_shard(college_id)
+        print(f"{len(shard_ids())} shards upgraded")
 
-# Run table creation ONLY if DB does NOT exist
-if not os.path.exists(DB_NAME):
-    create_tables()
 
-# 🔥 ENSURE NEW COLUMNS ALWAYS EXIST
-# 🔥 ENSURE NEW TABLES & COLUMNS
-ensure_status_column()
-ensure_semester_logs()
-ensure_beu_table()
-insert_default_colleges()
+@db_cli.command("version")
+def db_version_command():
+    """Schema version of the database vs the newest migration."""
+    conn = get_pool().connect()
+    version = schema_version(conn)
+    conn.close()
+    state = "current" if version >= SCHEMA_VERSION else "run `flask db upgrade`"
+    print(f"schema version {version} / {SCHEMA_VERSION} ({state})")
+
+
+bootstrap_db()
+
 # ---------------- UTIL ----------------
+# Mail goes through the mail_outbox table. send_email() only inserts a
+# row; a per-worker dispatcher thread claims pending rows and a small
+# thread pool delivers them, one SMTP connection per batch, retrying
+# with exponential backoff.
+_mail_wakeup = threading.Event()
+_mail_dispatcher_pid = None
+_mail_dispatcher_lock = threading.Lock()
+
+
 def send_email(to, subject, body):
     try:
-        msg = Message(subject, sender=MAIL_USERNAME, recipients=[to])
-        msg.body = body
-        mail.send(msg)
-        print("Email sent successfully")
+        # own connection → never commits the caller's pending writes
+        conn = get_pool().connect()
+        conn.execute("""
+            INSERT INTO mail_outbox (recipient, subject, body)
+            VALUES (?, ?, ?)
+        """, (to, subject, body))
+        conn.commit()
+        conn.close()
     except Exception as e:
-        print("Email error:", e)
+        print("Email queue error:", e)
+        return
+
+    start_mail_dispatcher()
+    _mail_wakeup.set()
+
+
+def claim_mail_batch(conn, limit):
+    # rows stuck in 'sending' for 10 minutes belong to a dead worker
+    conn.execute("BEGIN IMMEDIATE")
+    rows = conn.execute("""
+        UPDATE mail_outbox
+        SET status = 'sending',
+            attempts = attempts + 1,
+            claimed_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM mail_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP)
+               OR (status = 'sending' AND claimed_at < datetime('now', '-10 minutes'))
+            ORDER BY id
+            LIMIT ?
+        )
+        RETURNING id, recipient, subject, body, attempts
+    """, (limit,)).fetchall()
+    conn.commit()
+    return rows
+
+
+def deliver_mail_batch(rows):
+    results = []
+
+    with app.app_context():
+        try:
+            with mail.connect() as smtp:
+                for row in rows:
+                    try:
+                        msg = Message(
+                            row["subject"],
+                            sender=MAIL_USERNAME,
+                            recipients=[row["recipient"]]
+                        )
+                        msg.body = row["body"]
+                        smtp.send(msg)
+                        results.append((row, None))
+                    except Exception as e:
+                        results.append((row, str(e)))
+        except Exception as e:
+            # connect / login failed → whole batch retries
+            done = {r["id"] for r, _ in results}
+            results += [(row, str(e)) for row in rows if row["id"] not in done]
+
+    conn = get_pool().connect()
+    for row, error in results:
+        if error is None:
+            conn.execute("""
+                UPDATE mail_outbox
+                SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                WHERE id = ?
+            """, (row["id"],))
+        elif row["attempts"] >= app.config["MAIL_MAX_ATTEMPTS"]:
+            print("Email failed:", row["recipient"], error)
+            conn.execute("""
+                UPDATE mail_outbox
+                SET status = 'failed', last_error = ?
+                WHERE id = ?
+            """, (error, row["id"]))
+        else:
+            delay = app.config["MAIL_RETRY_BASE"] * 2 ** (row["attempts"] - 1)
+            conn.execute("""
+                UPDATE mail_outbox
+                SET status = 'pending',
+                    last_error = ?,
+                    next_attempt_at = datetime('now', ?)
+                WHERE id = ?
+            """, (error, f"+{int(delay)} seconds", row["id"]))
+    conn.commit()
+    conn.close()
+
+    return sum(1 for _, error in results if error is None)
+
+
+def deliver_pending_mail(executor=None):
+    """Deliver every message that is due; returns how many were sent."""
+    batch_size = app.config["MAIL_BATCH_SIZE"]
+    workers = app.config["MAIL_WORKERS"]
+    sent = 0
+
+    conn = get_pool().connect()
+    try:
+        while True:
+            rows = claim_mail_batch(conn, batch_size * workers)
+            if not rows:
+                return sent
+
+            batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+            if executor is None:
+                sent += sum(deliver_mail_batch(b) for b in batches)
+            else:
+                sent += sum(executor.map(deliver_mail_batch, batches))
+    finally:
+        conn.close()
+
+
+def _mail_dispatch_loop():
+    executor = ThreadPoolExecutor(
+        max_workers=app.config["MAIL_WORKERS"],
+        thread_name_prefix="mail"
+    )
+    while True:
+        _mail_wakeup.wait(app.config["MAIL_POLL_INTERVAL"])
+        _mail_wakeup.clear()
+        try:
+            deliver_pending_mail(executor)
+        except Exception as e:
+            print("Email dispatcher error:", e)
+
+
+def start_mail_dispatcher():
+    # one dispatcher per worker process, started on first use
+    global _mail_dispatcher_pid
+    if _mail_dispatcher_pid == os.getpid():
+        return
+    with _mail_dispatcher_lock:
+        if _mail_dispatcher_pid == os.getpid():
+            return
+        _mail_dispatcher_pid = os.getpid()
+        threading.Thread(
+            target=_mail_dispatch_loop, name="mail-dispatcher", daemon=True
+        ).start()
+
+
+@app.cli.command("send-mail")
+def send_mail_command():
+    """Deliver queued mail now (cron / after an SMTP outage)."""
+    print(f"{deliver_pending_mail()} message(s) sent")
+
+
+
+# ---------------- PASSWORDS ----------------
+# users.password holds a werkzeug hash ("scrypt:N:r:p$salt$hex").
+# Older rows still hold plaintext: they are compared in constant time
+# and rehashed on that login, as are hashes made with an older
+# PASSWORD_METHOD. "!" + anything never matches (imported accounts
+# until the student resets the password).
+#
+# The KDF runs on a small per-worker thread pool (scrypt releases the
+# GIL), so a 9 AM burst queues for PASSWORD_HASH_WORKERS slots instead
+# of every request thread hashing at once. At most PASSWORD_HASH_QUEUE
+# hashes may be queued or running; past that, or after waiting
+# PASSWORD_HASH_WAIT, the login is asked to retry right away instead of
+# holding a request thread while the backlog grows. A verified
+# password is remembered as an HMAC under a per-process key for
+# PASSWORD_CACHE_TTL, so logging in again from a second device skips
+# the KDF.
+import hmac
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeout
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_PREFIXES = ("scrypt:", "pbkdf2:")
+LOCKED_PASSWORD = "!"
+
+_hash_pool = None
+_hash_slots = None
+_hash_pool_pid = None
+_hash_pool_lock = threading.Lock()
+
+
+def get_hash_pool():
+    global _hash_pool, _hash_slots, _hash_pool_pid
+    with _hash_pool_lock:
+        if _hash_pool is None or _hash_pool_pid != os.getpid():
+            _hash_pool = ThreadPoolExecutor(
+                max_workers=app.config["PASSWORD_HASH_WORKERS"],
+                thread_name_prefix="pwhash"
+            )
+            _hash_slots = threading.BoundedSemaphore(
+                max(app.config["PASSWORD_HASH_QUEUE"], 1)
+            )
+            _hash_pool_pid = os.getpid()
+        return _hash_pool, _hash_slots
+
+
+def run_hash(fn, *args):
+    """Run fn on the hash pool; FutureTimeout if it is full or too slow."""
+    pool, slots = get_hash_pool()
+    if not slots.acquire(blocking=False):
+        raise FutureTimeout()
+
+    fut = pool.submit(fn, *args)
+    fut.add_done_callback(lambda _: slots.release())
+    try:
+        return fut.result(timeout=app.config["PASSWORD_HASH_WAIT"])
+    except FutureTimeout:
+        if fut.cancel():
+            raise
+        # already hashing → finishes within one KDF run
+        return fut.result()
+
+
+class LoginCache:
+    """user id → HMAC of the last verified (hash, password), LRU + TTL."""
+
+    def __init__(self):
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, stored, password):
+        msg = f"{stored}\0{password}".encode()
+        return hmac.new(self._key, msg, hashlib.sha256).digest()
+
+    def hit(self, user_id, stored, password):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if not entry:
+                return False
+            digest, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[user_id]
+                return False
+            self._entries.move_to_end(user_id)
+        # a changed users.password changes the digest → cache miss
+        return hmac.compare_digest(digest, self._digest(stored, password))
+
+    def put(self, user_id, stored, password):
+        ttl = app.config["PASSWORD_CACHE_TTL"]
+        if ttl <= 0:
+            return
+        digest = self._digest(stored, password)
+        with self._lock:
+            self._entries[user_id] = (digest, time.monotonic() + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > app.config["PASSWORD_CACHE_SIZE"]:
+                self._entries.popitem(last=False)
+
+    def drop(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+login_cache = LoginCache()
+
+
+def is_password_hash(stored):
+    return (stored or "").startswith(HASH_PREFIXES)
+
+
+def needs_rehash(stored):
+    return (stored or "").split("$", 1)[0] != app.config["PASSWORD_METHOD"]
+
+
+def hash_password(password):
+    return run_hash(generate_password_hash, password, app.config["PASSWORD_METHOD"])
+
+
+def check_password(user_id, stored, password):
+    stored = stored or ""
+    if not password or stored.startswith(LOCKED_PASSWORD):
+        return False
+
+    # legacy plaintext row
+    if not is_password_hash(stored):
+        return hmac.compare_digest(stored.encode(), password.encode())
+
+    if login_cache.hit(user_id, stored, password):
+        return True
+
+    ok = run_hash(check_password_hash, stored, password)
+    if ok:
+        login_cache.put(user_id, stored, password)
+    return ok
+
+
+def set_password(conn, user_id, password):
+    """Hash and store a new password (caller commits)."""
+    stored = hash_password(password)
+    conn.execute("UPDATE users SET password=? WHERE id=?", (stored, user_id))
+    login_cache.drop(user_id)
+    return stored
+
+
+def new_password():
+    return secrets.token_urlsafe(9)
+
+
+@app.cli.command("password-cost")
+@click.option("--method", default=None, help="defaults to PASSWORD_METHOD")
+@click.option("--runs", default=10)
+def password_cost_command(method, runs):
+    """Time one hash with a KDF setting and the logins/sec it allows."""
+    method = method or app.config["PASSWORD_METHOD"]
+    workers = min(app.config["PASSWORD_HASH_WORKERS"], os.cpu_count() or 1)
+
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        generate_password_hash("benchmark", method)
+        times.append(time.perf_counter() - t)
+    times.sort()
+    median = times[len(times) // 2]
+
+    print(f"{method}: median {median * 1000:.1f} ms, max {times[-1] * 1000:.1f} ms")
+    print(f"~{workers / median:.0f} uncached logins/sec per worker process "
+          f"({workers} hash thread(s) on {os.cpu_count()} CPU(s))")
+
+
+
+# ---------------- SESSIONS ----------------
+# Session data lives in the sessions table of the main database and the
+# cookie only carries a random id. Opening a session is one primary-key
+# read that also returns the "profiles" row of cache_versions; the row
+# is rewritten only when the session changed or half of SESSION_TTL
+# has passed. Static files get no session at all.
+#
+# current_profile() serves the logged-in user's users row from a
+# per-worker LRU tagged with that version. Paths that change users
+# (edit_user, upload_photo, semester actions, delete, import) call
+# invalidate_profiles() after they commit → every worker reloads on
+# its next request, and the dashboards never read users otherwise.
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+_sessions_swept_at = 0
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, expires_at=0, profile_version=None):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.expires_at = expires_at
+        self.profile_version = profile_version
+        self.old_sid = None
+        self.modified = False
+
+    def rotate(self):
+        """Same data under a fresh id (login → no session fixation)."""
+        self.old_sid = self.old_sid or self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class SqliteSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def open_session(self, app, request):
+        if request.path.startswith(app.static_url_path + "/"):
+            return self.make_null_session(app)
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return ServerSession()
+
+        pool = get_pool()
+        conn = pool.acquire()
+        try:
+            row = conn.execute("""
+                SELECT data, expires_at,
+                       (SELECT version FROM cache_versions WHERE name='profiles')
+                FROM sessions
+                WHERE id = ? AND expires_at > ?
+            """, (sid, time.time())).fetchone()
+        finally:
+            pool.release(conn)
+
+        if not row:
+            return ServerSession()
+        return ServerSession(self.serializer.loads(row[0]), sid, row[1], row[2] or 0)
+
+    def save_session(self, app, session, response):
+        if not isinstance(session, ServerSession):
+            return
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+        ttl = app.config["SESSION_TTL"]
+
+        # logout (session.clear()) → drop the row and the cookie
+        if not session:
+            if session.modified:
+                self._write("DELETE FROM sessions WHERE id IN (?, ?)",
+                            (session.sid, session.old_sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        response.vary.add("Cookie")
+        if not (session.modified or session.expires_at - now < ttl / 2):
+            return
+
+        self._write("""
+            INSERT OR REPLACE INTO sessions (id, user_id, data, expires_at)
+            VALUES (?, ?, ?, ?)
+        """, (
+            session.sid, session.get("user_id"),
+            self.serializer.dumps(dict(session)), now + ttl
+        ), session.old_sid, now)
+
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def _write(self, sql, params, old_sid=None, now=None):
+        global _sessions_swept_at
+        pool = get_pool()
+        conn = pool.acquire()
+        try:
+            conn.execute(sql, params)
+            if old_sid:
+                conn.execute("DELETE FROM sessions WHERE id=?", (old_sid,))
+            if now and now - _sessions_swept_at > app.config["SESSION_SWEEP_INTERVAL"]:
+                _sessions_swept_at = now
+                conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+            conn.commit()
+        finally:
+            pool.release(conn)
+
+
+app.session_interface = SqliteSessionInterface()
+
+
+class ProfileCache:
+    """user id → (profiles version, users row without password), LRU."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if not entry or entry[0] != version:
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id, version, profile):
+        with self._lock:
+            self._entries[user_id] = (version, profile)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > app.config["PROFILE_CACHE_SIZE"]:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+profile_cache = ProfileCache()
+
+
+def profile_version():
+    # normally read along with the session row; a session created
+    # during this request (login) reads it here once
+    if session.profile_version is None:
+        pool = get_pool()
+        conn = pool.acquire()
+        try:
+            session.profile_version = cache_version(conn, "profiles")
+        finally:
+            pool.release(conn)
+    return session.profile_version
+
+
+def user_profile(row):
+    return {k: row[k] for k in row.keys() if k != "password"}
+
+
+def current_profile():
+    """The logged-in user's users row (no password), or None."""
+    uid = session.get("user_id")
+    if not uid:
+        return None
+
+    version = profile_version()
+    profile = profile_cache.get(uid, version)
+    if profile is None:
+        row = get_db().execute("SELECT * FROM users WHERE id=?", (uid,)).fetchone()
+        if not row:
+            return None
+        profile = user_profile(row)
+        profile_cache.put(uid, version, profile)
+    return dict(profile)
+
+
+def invalidate_profiles():
+    # after the users change commits; sessions (and so the version)
+    # always live in the main database, also with DB_SHARDS on
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        bump_cache_version(conn, "profiles")
+        conn.commit()
+    finally:
+        pool.release(conn)
 
 
 
@@ -509,7 +2275,6 @@ def login_required(role=None):
             return fn(*args, **kwargs)
         return wrapper
     return decorator
-import secrets
 import string
 from datetime import datetime, timedelta
 
@@ -517,6 +2282,7 @@ def generate_tokens():
     full_token = secrets.token_urlsafe(16)
 
     display_token = (
+        secrets.choice(string.digits) +
         secrets.choice(string.ascii_uppercase) +
         secrets.choice(string.digits) +
         secrets.choice(string.ascii_uppercase) +
@@ -534,7 +2300,15 @@ def select_college():
             flash("Please select college","danger")
             return redirect(url_for("select_college"))
 
+        # only names from the list; request data never adds a college
+        college_id = college_id_for(conn, college)
+        if college_id is None:
+            conn.close()
+            flash("Please select college","danger")
+            return redirect(url_for("select_college"))
+
         session["college"] = college
+        session["college_id"] = college_id
         conn.close()
         return redirect(url_for("login"))
 
@@ -613,11 +2387,28 @@ def login():
             """
             SELECT *
             FROM users
-            WHERE email=? AND password=? AND college=?
+            WHERE email=? AND college=?
             """,
-            (email, password, college)
+            (email, college)
         ).fetchone()
 
+        try:
+            if user and not check_password(user["id"], user["password"], password):
+                user = None
+        except FutureTimeout:
+            conn.close()
+            flash("Too many logins right now, please try again in a moment.", "warning")
+            return render_template("login.html"), 503
+
+        # 🔐 plaintext / old-cost row → hash it now
+        if user and needs_rehash(user["password"]):
+            try:
+                stored = set_password(conn, user["id"], password)
+                conn.commit()
+                login_cache.put(user["id"], stored, password)
+            except FutureTimeout:
+                pass   # retried on the next login
+
         conn.close()
 
         # ❌ INVALID LOGIN
@@ -631,11 +2422,14 @@ def login():
             )
 
         # ✅ SESSION SET
+        session.rotate()
+        profile_cache.put(user["id"], profile_version(), user_profile(user))
         session["user_id"] = user["id"]
         session["user_role"] = user["role"]
         session["user_name"] = user["name"]
         session["user_photo"] = user["photo"]
         session["college"] = user["college"]
+        session["college_id"] = user["college_id"]
 
         # ✅ SUCCESS POPUP
         session["login_success"] = True
@@ -684,11 +2478,13 @@ def forgot_password():
             flash("Email not found in this college!", "danger")
             return redirect(url_for("forgot_password"))
 
-        new_pass = "pass" + str(random.randint(1000,9999))
-        conn.execute(
-            "UPDATE users SET password=? WHERE id=?",
-            (new_pass, user["id"])
-        )
+        new_pass = new_password()
+        try:
+            set_password(conn, user["id"], new_pass)
+        except FutureTimeout:
+            conn.close()
+            flash("Server busy, please try again in a moment.", "warning")
+            return redirect(url_for("forgot_password"))
         conn.commit()
         conn.close()
 
@@ -704,20 +2500,7 @@ def forgot_password():
 
 # ================= PROCESS TOOL =================
 
-# ================= PDF & IMAGE TOOLS =================
-
-# =========================================================
-# PDF & IMAGE TOOLS IMPORTS
-# =========================================================
-
-from PIL import Image
-import fitz
-import os
-from pdf2docx import Converter
-import pdfplumber
-import pandas as pd
-import pytesseract
-from docx import Document
+# ================= PDF & IMAGE TOOLS =================
 
 UPLOAD_FOLDER = "uploads"
 
@@ -736,28 +2519,45 @@ def tools():
 
 
 # =========================================================
-# PROCESS TOOL
+# TOOL JOBS
 # =========================================================
+# Every upload gets its own scratch directory under TOOL_JOB_DIR, so
+# two users never overwrite each other's output. Heavy actions run in
+# a per-worker process pool; the browser polls the job page and then
+# downloads. Scratch dirs and job rows are removed after TOOL_JOB_TTL.
 
-@app.route("/upload-tool", methods=["POST"])
-@login_required()
-def upload_tool():
-
-    file = request.files.get("file")
-    action = request.form.get("action")
-
-    if not file:
+import uuid
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+TOOL_JOB_DIR = os.environ.get("TOOL_JOB_DIR", "tool_jobs")
+TOOL_JOB_TTL = int(os.environ.get("TOOL_JOB_TTL", "3600"))
+TOOL_PROCESSES = int(os.environ.get("TOOL_PROCESSES", "2"))
+TOOL_MAX_JOBS_PER_USER = int(os.environ.get("TOOL_MAX_JOBS_PER_USER", "2"))
+
+TOOL_ACTIONS = {
+    "resize_image", "resize_pdf", "pdf_word", "pdf_excel", "ocr",
+    "edit_pdf_text", "image_excel", "image_word", "image_pdf",
+    "pdf_image", "compress_image", "rotate_pdf"
+}
 
-        flash("No file selected", "danger")
+# CPU-bound → process pool + admission control
+HEAVY_TOOL_ACTIONS = {
+    "pdf_word", "pdf_excel", "ocr", "edit_pdf_text",
+    "image_excel", "image_word"
+}
 
-        return redirect("/tools")
+os.makedirs(TOOL_JOB_DIR, exist_ok=True)
 
-    filepath = os.path.join(
-        UPLOAD_FOLDER,
-        file.filename
-    )
 
-    file.save(filepath)
+def run_tool(action, filepath, out_dir, params):
+    """
+    Run one tool action on filepath, writing into out_dir.
+    Returns (output filename, text); text is only set for OCR.
+    Libraries are imported per action, so a light action inline in
+    the web worker does not load the OCR / Office stack.
+    """
 
     # =================================================
     # IMAGE RESIZE
@@ -765,26 +2565,17 @@ def upload_tool():
 
     if action == "resize_image":
 
-        width = int(
-            request.form.get("width", 800)
-        )
-
-        height = int(
-            request.form.get("height", 800)
-        )
+        from PIL import Image
 
-        output = "static/output.jpg"
+        output = os.path.join(out_dir, "output.jpg")
 
         img = Image.open(filepath)
 
-        img = img.resize((width, height))
+        img = img.resize((params["width"], params["height"]))
 
         img.save(output)
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "output.jpg", None
 
     # =================================================
     # PDF RESIZE
@@ -792,7 +2583,9 @@ def upload_tool():
 
     elif action == "resize_pdf":
 
-        output = "static/output.pdf"
+        import fitz
+
+        output = os.path.join(out_dir, "output.pdf")
 
         pdf = fitz.open(filepath)
 
@@ -804,10 +2597,7 @@ def upload_tool():
 
         pdf.save(output)
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "output.pdf", None
 
     # =================================================
     # PDF TO WORD
@@ -815,7 +2605,9 @@ def upload_tool():
 
     elif action == "pdf_word":
 
-        output = "static/output.docx"
+        from pdf2docx import Converter
+
+        output = os.path.join(out_dir, "output.docx")
 
         cv = Converter(filepath)
 
@@ -823,10 +2615,7 @@ def upload_tool():
 
         cv.close()
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "output.docx", None
 
     # =================================================
     # PDF TO EXCEL
@@ -834,7 +2623,10 @@ def upload_tool():
 
     elif action == "pdf_excel":
 
-        output = "static/output.xlsx"
+        import pdfplumber
+        import pandas as pd
+
+        output = os.path.join(out_dir, "output.xlsx")
 
         data = []
 
@@ -857,10 +2649,7 @@ def upload_tool():
             index=False
         )
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "output.xlsx", None
 
     # =================================================
     # IMAGE TO TEXT OCR
@@ -868,14 +2657,17 @@ def upload_tool():
 
     elif action == "ocr":
 
+        from PIL import Image
+        import pytesseract
+
         img = Image.open(filepath)
 
         text = pytesseract.image_to_string(img)
 
-        return render_template(
-            "ocr_result.html",
-            text=text
-        )
+        with open(os.path.join(out_dir, "ocr.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+
+        return "ocr.txt", text
 
     # =================================================
     # PDF TEXT EDIT
@@ -883,10 +2675,12 @@ def upload_tool():
 
     elif action == "edit_pdf_text":
 
-        old_text = request.form.get("old_text")
-        new_text = request.form.get("new_text")
+        import fitz
+
+        old_text = params.get("old_text")
+        new_text = params.get("new_text")
 
-        output = "static/edited.pdf"
+        output = os.path.join(out_dir, "edited.pdf")
 
         pdf = fitz.open(filepath)
 
@@ -911,10 +2705,7 @@ def upload_tool():
 
         pdf.save(output)
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "edited.pdf", None
 
     # =================================================
     # IMAGE TO EXCEL
@@ -922,7 +2713,11 @@ def upload_tool():
 
     elif action == "image_excel":
 
-        output = "static/output.xlsx"
+        from PIL import Image
+        import pytesseract
+        import pandas as pd
+
+        output = os.path.join(out_dir, "output.xlsx")
 
         img = Image.open(filepath)
 
@@ -940,10 +2735,7 @@ def upload_tool():
             index=False
         )
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "output.xlsx", None
 
     # =================================================
     # IMAGE TO WORD
@@ -951,7 +2743,11 @@ def upload_tool():
 
     elif action == "image_word":
 
-        output = "static/output.docx"
+        from PIL import Image
+        import pytesseract
+        from docx import Document
+
+        output = os.path.join(out_dir, "output.docx")
 
         img = Image.open(filepath)
 
@@ -963,10 +2759,7 @@ def upload_tool():
 
         doc.save(output)
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "output.docx", None
 
     # =================================================
     # IMAGE TO PDF
@@ -974,7 +2767,9 @@ def upload_tool():
 
     elif action == "image_pdf":
 
-        output = "static/output.pdf"
+        from PIL import Image
+
+        output = os.path.join(out_dir, "output.pdf")
 
         img = Image.open(filepath)
 
@@ -984,10 +2779,7 @@ def upload_tool():
 
         img.save(output)
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "output.pdf", None
 
     # =================================================
     # PDF TO IMAGE
@@ -995,20 +2787,19 @@ def upload_tool():
 
     elif action == "pdf_image":
 
+        import fitz
+
         pdf = fitz.open(filepath)
 
         page = pdf[0]
 
         pix = page.get_pixmap()
 
-        output = "static/page1.png"
+        output = os.path.join(out_dir, "page1.png")
 
         pix.save(output)
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "page1.png", None
 
     # =================================================
     # COMPRESS IMAGE
@@ -1016,7 +2807,9 @@ def upload_tool():
 
     elif action == "compress_image":
 
-        output = "static/compressed.jpg"
+        from PIL import Image
+
+        output = os.path.join(out_dir, "compressed.jpg")
 
         img = Image.open(filepath)
 
@@ -1026,10 +2819,7 @@ def upload_tool():
             quality=40
         )
 
-        return send_file(
-            output,
-            as_attachment=True
-        )
+        return "compressed.jpg", None
 
     # =================================================
     # ROTATE PDF
@@ -1037,7 +2827,9 @@ def upload_tool():
 
     elif action == "rotate_pdf":
 
-        output = "static/rotated.pdf"
+        import fitz
+
+        output = os.path.join(out_dir, "rotated.pdf")
 
         pdf = fitz.open(filepath)
 
@@ -1047,18 +2839,239 @@ def upload_tool():
 
         pdf.save(output)
 
+        return "rotated.pdf", None
+
+    raise ValueError(f"Unknown tool action: {action}")
+
+
+def run_tool_job(job_id, action, filepath, out_dir, params):
+    # runs inside the process pool
+    conn = get_pool().connect()
+    conn.execute("UPDATE tool_jobs SET status='running' WHERE id=?", (job_id,))
+    conn.commit()
+    conn.close()
+
+    try:
+        output, _ = run_tool(action, filepath, out_dir, params)
+    except Exception as e:
+        # library exceptions (e.g. TesseractNotFoundError) may not
+        # unpickle in the parent and would break the whole pool
+        raise RuntimeError(str(e)) from None
+    return output
+
+
+def finish_tool_job(job_id, future):
+    conn = get_pool().connect()
+    try:
+        output = future.result()
+        conn.execute("""
+            UPDATE tool_jobs
+            SET status='done', output=?, finished_at=CURRENT_TIMESTAMP
+            WHERE id=?
+        """, (output, job_id))
+    except Exception as e:
+        print("TOOL JOB ERROR:", job_id, e)
+        conn.execute("""
+            UPDATE tool_jobs
+            SET status='failed', error=?, finished_at=CURRENT_TIMESTAMP
+            WHERE id=?
+        """, (str(e), job_id))
+    conn.commit()
+    conn.close()
+
+
+_tool_pool = None
+_tool_pool_pid = None
+_tool_pool_lock = threading.Lock()
+
+
+def get_tool_pool(reset=False):
+    global _tool_pool, _tool_pool_pid
+    with _tool_pool_lock:
+        if reset or _tool_pool is None or _tool_pool_pid != os.getpid():
+            _tool_pool = ProcessPoolExecutor(max_workers=TOOL_PROCESSES)
+            _tool_pool_pid = os.getpid()
+        return _tool_pool
+
+
+def submit_tool_job(*args):
+    try:
+        return get_tool_pool().submit(run_tool_job, *args)
+    except BrokenProcessPool:
+        # a child was killed (OOM etc.) → start a fresh pool
+        return get_tool_pool(reset=True).submit(run_tool_job, *args)
+
+
+def cleanup_tool_jobs():
+    cutoff = time.time() - TOOL_JOB_TTL
+
+    for name in os.listdir(TOOL_JOB_DIR):
+        path = os.path.join(TOOL_JOB_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+    conn = get_pool().connect()
+    conn.execute(
+        "DELETE FROM tool_jobs WHERE created_at < datetime('now', ?)",
+        (f"-{TOOL_JOB_TTL} seconds",)
+    )
+    conn.commit()
+    conn.close()
+
+
+def tool_job_dir(job_id):
+    return os.path.join(TOOL_JOB_DIR, job_id)
+
+
+# =========================================================
+# PROCESS TOOL
+# =========================================================
+
+@app.route("/upload-tool", methods=["POST"])
+@login_required()
+def upload_tool():
+
+    file = request.files.get("file")
+    action = request.form.get("action")
+
+    if not file:
+
+        flash("No file selected", "danger")
+
+        return redirect("/tools")
+
+    if action not in TOOL_ACTIONS:
+
+        flash("Invalid action", "danger")
+
+        return redirect("/tools")
+
+    cleanup_tool_jobs()
+
+    job_id = uuid.uuid4().hex
+    out_dir = tool_job_dir(job_id)
+    os.makedirs(out_dir)
+
+    filepath = os.path.join(
+        out_dir,
+        "input_" + (secure_filename(file.filename) or "upload")
+    )
+
+    file.save(filepath)
+
+    params = {
+        "width": int(request.form.get("width") or 800),
+        "height": int(request.form.get("height") or 800),
+        "old_text": request.form.get("old_text"),
+        "new_text": request.form.get("new_text")
+    }
+
+    # quick actions → answer in the same request
+    if action not in HEAVY_TOOL_ACTIONS:
+
+        output, _ = run_tool(action, filepath, out_dir, params)
+
         return send_file(
-            output,
+            os.path.join(out_dir, output),
             as_attachment=True
         )
 
-    # =================================================
-    # INVALID ACTION
-    # =================================================
+    # heavy actions → admission control, then the process pool
+    # (tool jobs live in the main database, like their workers)
+    conn = get_pool().connect()
+    cur = conn.execute("""
+        INSERT INTO tool_jobs (id, user_id, action, status)
+        SELECT ?, ?, ?, 'queued'
+        WHERE (
+            SELECT COUNT(*) FROM tool_jobs
+            WHERE user_id = ?
+              AND status IN ('queued', 'running')
+              AND created_at > datetime('now', '-1 hour')
+        ) < ?
+    """, (job_id, session["user_id"], action,
+          session["user_id"], TOOL_MAX_JOBS_PER_USER))
+    conn.commit()
+    conn.close()
+
+    if cur.rowcount == 0:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        flash(
+            f"You already have {TOOL_MAX_JOBS_PER_USER} conversions running, "
+            "please wait for them to finish",
+            "warning"
+        )
+        return redirect("/tools")
+
+    future = submit_tool_job(job_id, action, filepath, out_dir, params)
+    future.add_done_callback(lambda f: finish_tool_job(job_id, f))
+
+    return redirect(url_for("tool_job_page", job_id=job_id))
+
+
+def load_tool_job(job_id):
+    conn = get_pool().connect()
+    job = conn.execute("""
+        SELECT id, action, status, output, error
+        FROM tool_jobs
+        WHERE id = ? AND user_id = ?
+    """, (job_id, session["user_id"])).fetchone()
+    conn.close()
+    return job
 
-    flash("Invalid action", "danger")
 
-    return redirect("/tools")
+@app.route("/tools/jobs/<job_id>")
+@login_required()
+def tool_job_page(job_id):
+
+    job = load_tool_job(job_id)
+
+    if not job:
+        flash("Job not found or expired", "danger")
+        return redirect("/tools")
+
+    return render_template("tool_job.html", job=job)
+
+
+@app.route("/tools/jobs/<job_id>/status")
+@login_required()
+def tool_job_status(job_id):
+
+    job = load_tool_job(job_id)
+
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    data = dict(job)
+    if job["status"] == "done":
+        data["download"] = url_for("tool_job_download", job_id=job_id)
+
+    return jsonify(data)
+
+
+@app.route("/tools/jobs/<job_id>/download")
+@login_required()
+def tool_job_download(job_id):
+
+    job = load_tool_job(job_id)
+
+    if not job or job["status"] != "done":
+        flash("File not ready", "danger")
+        return redirect("/tools")
+
+    path = os.path.join(tool_job_dir(job_id), job["output"])
+
+    if not os.path.exists(path):
+        flash("File expired, please convert again", "danger")
+        return redirect("/tools")
+
+    if job["action"] == "ocr":
+        with open(path, encoding="utf-8") as f:
+            return render_template("ocr_result.html", text=f.read())
+
+    return send_file(path, as_attachment=True)
 
 # ---------------- REGISTRATION ----------------
 @app.route("/register/student", methods=["GET", "POST"])
@@ -1066,6 +3079,12 @@ def register_student():
     if request.method == "POST":
         college = session.get("college")
 
+        try:
+            password = hash_password(request.form.get("password", ""))
+        except FutureTimeout:
+            flash("Server busy, please try again in a moment.", "warning")
+            return redirect(url_for("register_student"))
+
         conn = get_db()
         try:
             conn.execute("""
@@ -1073,20 +3092,21 @@ def register_student():
                     name, email, password, role,
                     department, semester, roll_no,
                     registration_no, parent_phone, parent_email,
-                    college
+                    college, college_id
                 )
-                VALUES (?, ?, ?, 'student', ?, ?, ?, ?, ?, ?, ?)
+                VALUES (?, ?, ?, 'student', ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 request.form.get("name"),
                 request.form.get("email","").lower(),
-                request.form.get("password"),
+                password,
                 request.form.get("department"),
                 request.form.get("semester"),
                 request.form.get("roll_no"),
                 request.form.get("registration_no"),
                 request.form.get("parent_phone"),
                 request.form.get("parent_email"),
-                college
+                college,
+                current_college_id()
             ))
             conn.commit()
             flash("Student Registered!", "success")
@@ -1112,63 +3132,273 @@ def register_admin():
         security_code = request.form.get("security_code", "")
         college = session.get("college")   # ✅ selected college
 
-        # 🔐 SECURITY CODE CHECK
-        if security_code != ADMIN_SECURITY_CODE:
-            flash("❌ Invalid Admin Security Code", "danger")
-            return redirect(url_for("register_admin"))
+        # 🔐 SECURITY CODE CHECK
+        if security_code != ADMIN_SECURITY_CODE:
+            flash("❌ Invalid Admin Security Code", "danger")
+            return redirect(url_for("register_admin"))
+
+        conn = get_db()
+
+        # ✅ check same email in same college
+        existing = conn.execute(
+            "SELECT id FROM users WHERE email=? AND college=?",
+            (email, college)
+        ).fetchone()
+
+        if existing:
+            conn.close()
+            flash("Admin already registered in this college!", "danger")
+            return redirect(url_for("register_admin"))
+
+        try:
+            password = hash_password(password)
+        except FutureTimeout:
+            conn.close()
+            flash("Server busy, please try again in a moment.", "warning")
+            return redirect(url_for("register_admin"))
+
+        # ✅ correct insert
+        conn.execute("""
+            INSERT INTO users
+            (name, email, password, role, admin_branch, college, college_id)
+            VALUES (?, ?, ?, 'admin', ?, ?, ?)
+        """, (name, email, password, branch, college, current_college_id()))
+
+        conn.commit()
+        conn.close()
+
+        flash("✅ Admin Registered Successfully!", "success")
+        return redirect(url_for("login"))
+
+    return render_template("register_admin.html")
+
+
+
+# ---------------- STUDENT PROFILE / UPLOAD PHOTO ----------------
+@app.route("/student/profile")
+@login_required(role="student")
+def student_profile():
+    return render_template("student_profile.html", user=current_profile())
+
+
+from io import BytesIO
+from flask import jsonify, make_response
+from datetime import datetime, timedelta, timezone
+
+# ---------------- QR TOKENS ----------------
+# One live token per subject is kept in memory with its PNG, so the
+# admin dashboard (polls every 5s) does not write a row and render an
+# image on every refresh. Rows expire after QR_TOKEN_TTL seconds and
+# are deleted by a background sweeper.
+QR_TOKEN_TTL = int(os.environ.get("QR_TOKEN_TTL", "120"))
+QR_SWEEP_INTERVAL = int(os.environ.get("QR_SWEEP_INTERVAL", "300"))
+
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+
+def sql_timestamp(dt):
+    # same format as SQLite CURRENT_TIMESTAMP (UTC)
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def render_qr_png(data):
+    import qrcode
+
+    buf = BytesIO()
+    qrcode.make(data).save(buf)
+    return buf.getvalue()
+
+
+class QRTokenCache:
+    """Live QR token per (college, subject), dropped once it expires."""
+
+    def __init__(self):
+        self._by_subject = {}
+        self._by_token = {}
+        self._lock = threading.Lock()
+
+    def get(self, college_id, subject_id):
+        with self._lock:
+            entry = self._by_subject.get((college_id, subject_id))
+            if entry and entry["expires_at"] <= utc_now():
+                self._drop(entry)
+                return None
+            return entry
+
+    def get_by_token(self, full_token):
+        with self._lock:
+            entry = self._by_token.get(full_token)
+            if entry and entry["expires_at"] <= utc_now():
+                self._drop(entry)
+                return None
+            return entry
+
+    def put(self, entry):
+        key = (entry["college_id"], entry["subject_id"])
+        with self._lock:
+            old = self._by_subject.get(key)
+            if old:
+                self._drop(old)
+            self._by_subject[key] = entry
+            self._by_token[entry["full_token"]] = entry
+
+    def evict_expired(self):
+        now = utc_now()
+        with self._lock:
+            for entry in list(self._by_subject.values()):
+                if entry["expires_at"] <= now:
+                    self._drop(entry)
+
+    def _drop(self, entry):
+        self._by_subject.pop((entry["college_id"], entry["subject_id"]), None)
+        self._by_token.pop(entry["full_token"], None)
+
+
+qr_cache = QRTokenCache()
+
+
+def qr_entry_from_row(row):
+    return {
+        "id": row["id"],
+        "college_id": row["college_id"],
+        "subject_id": row["subject_id"],
+        "full_token": row["full_token"],
+        "display_token": row["display_token"],
+        "expires_at": datetime.strptime(
+            row["expires_at"], "%Y-%m-%d %H:%M:%S"
+        ).replace(tzinfo=timezone.utc),
+        "png": render_qr_png(row["full_token"])
+    }
+
+
+def issue_qr_token(conn, college_id, subject_id):
+    start_qr_sweeper()
+
+    entry = qr_cache.get(college_id, subject_id)
+    if entry:
+        row = conn.execute(
+            "SELECT used FROM qr_tokens WHERE id = ?", (entry["id"],)
+        ).fetchone()
+        if row and not row["used"]:
+            return entry
+
+    # live token issued by another worker
+    row = conn.execute("""
+        SELECT id, college_id, subject_id, full_token, display_token, expires_at
+        FROM qr_tokens
+        WHERE college_id = ?
+          AND subject_id = ?
+          AND used = 0
+          AND expires_at > ?
+        ORDER BY expires_at DESC
+        LIMIT 1
+    """, (college_id, subject_id, sql_timestamp(utc_now()))).fetchone()
+
+    if not row:
+        full_token, display_token = generate_tokens()
+        expires_at = sql_timestamp(utc_now() + timedelta(seconds=QR_TOKEN_TTL))
+
+        cur = conn.execute("""
+            INSERT INTO qr_tokens
+            (full_token, display_token, college_id, subject_id, expires_at, used)
+            VALUES (?, ?, ?, ?, ?, 0)
+        """, (full_token, display_token, college_id, subject_id, expires_at))
+        conn.commit()
+
+        row = {
+            "id": cur.lastrowid,
+            "college_id": college_id,
+            "subject_id": subject_id,
+            "full_token": full_token,
+            "display_token": display_token,
+            "expires_at": expires_at
+        }
+
+    entry = qr_entry_from_row(row)
+    qr_cache.put(entry)
+    return entry
+
+
+def qr_token_response(subject_id):
+    conn = get_db()
+
+    # only subjects of the admin's own branch get a token
+    subject = conn.execute(
+        "SELECT department FROM subjects WHERE id=?", (subject_id,)
+    ).fetchone()
+    if not subject:
+        conn.close()
+        return jsonify({"error": "Subject not found"}), 404
+    if dept_key(subject["department"]) != dept_key(session.get("admin_branch") or ""):
+        conn.close()
+        return jsonify({"error": "Select a subject of your branch"}), 403
+
+    entry = issue_qr_token(conn, current_college_id(), subject_id)
+    conn.close()
+
+    expires_in = max(0, int((entry["expires_at"] - utc_now()).total_seconds()))
 
-        conn = get_db()
+    return jsonify({
+        "success": True,
+        "qr": url_for("qr_image", token=entry["full_token"]),
+        "token": entry["display_token"],
+        "display_token": entry["display_token"],
+        "expires": entry["expires_at"].astimezone().strftime("%H:%M:%S"),
+        "expires_in": expires_in
+    })
 
-        # ✅ check same email in same college
-        existing = conn.execute(
-            "SELECT id FROM users WHERE email=? AND college=?",
-            (email, college)
-        ).fetchone()
 
-        if existing:
-            conn.close()
-            flash("Admin already registered in this college!", "danger")
-            return redirect(url_for("register_admin"))
+def sweep_expired_qr_tokens():
+    qr_cache.evict_expired()
 
-        # ✅ correct insert
+    def sweep(conn):
+        conn.execute(
+            "DELETE FROM qr_tokens WHERE expires_at < ?",
+            (sql_timestamp(utc_now()),)
+        )
         conn.execute("""
-            INSERT INTO users
-            (name, email, password, role, admin_branch, college)
-            VALUES (?, ?, ?, 'admin', ?, ?)
-        """, (name, email, password, branch, college))
-
+            DELETE FROM qr_checkins
+            WHERE token_id NOT IN (SELECT id FROM qr_tokens)
+        """)
         conn.commit()
-        conn.close()
 
-        flash("✅ Admin Registered Successfully!", "success")
-        return redirect(url_for("login"))
+    fan_out(sweep)
 
-    return render_template("register_admin.html")
 
+def _qr_sweep_loop():
+    while True:
+        time.sleep(QR_SWEEP_INTERVAL)
+        try:
+            sweep_expired_qr_tokens()
+        except Exception as e:
+            print("QR SWEEP ERROR:", e)
 
 
-# ---------------- STUDENT PROFILE / UPLOAD PHOTO ----------------
-@app.route("/student/profile")
-@login_required(role="student")
-def student_profile():
-    conn = get_db()
-    user = conn.execute("SELECT * FROM users WHERE id=?", (session["user_id"],)).fetchone()
-    conn.close()
-    return render_template("student_profile.html", user=user)
+_qr_sweeper_pid = None
+_qr_sweeper_lock = threading.Lock()
 
 
-import qrcode
-import uuid
-import os
-from io import BytesIO
-from flask import jsonify
-from datetime import datetime, timedelta
+def start_qr_sweeper():
+    # one sweeper thread per worker process, started on first use
+    global _qr_sweeper_pid
+    if _qr_sweeper_pid == os.getpid():
+        return
+    with _qr_sweeper_lock:
+        if _qr_sweeper_pid == os.getpid():
+            return
+        _qr_sweeper_pid = os.getpid()
+        threading.Thread(
+            target=_qr_sweep_loop, name="qr-sweeper", daemon=True
+        ).start()
+
 
 @app.route("/generate-qr", methods=["POST"])
 @login_required(role="admin")
 def generate_qr():
 
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
 
     subject_id = data.get("subject_id")
 
@@ -1177,38 +3407,51 @@ def generate_qr():
             "error": "Subject missing"
         }), 400
 
-    token = str(uuid.uuid4())[:8]
-
-    expires_at = (
-        datetime.now() + timedelta(minutes=2)
-    ).strftime("%H:%M:%S")
-
-    os.makedirs("static/qr", exist_ok=True)
+    try:
+        subject_id = int(subject_id)
+    except (TypeError, ValueError):
+        return jsonify({
+            "error": "Invalid subject"
+        }), 400
 
-    filename = f"{token}.png"
+    return qr_token_response(subject_id)
 
-    filepath = os.path.join(
-        "static/qr",
-        filename
-    )
 
-    qr_data = f"{subject_id}:{token}"
+@app.route("/admin/qr/<token>.png")
+@login_required(role="admin")
+def qr_image(token):
 
-    img = qrcode.make(qr_data)
+    college_id = current_college_id()
+    entry = qr_cache.get_by_token(token)
+    if entry and entry["college_id"] != college_id:
+        entry = None
 
-    img.save(filepath)
+    if not entry:
+        # issued by another worker → render from the DB row
+        conn = get_db()
+        row = conn.execute("""
+            SELECT id, college_id, subject_id, full_token, display_token, expires_at
+            FROM qr_tokens
+            WHERE full_token = ?
+              AND college_id = ?
+              AND expires_at > ?
+        """, (token, college_id, sql_timestamp(utc_now()))).fetchone()
+        conn.close()
 
-    return jsonify({
+        if not row:
+            return "QR expired", 404
 
-        "success": True,
+        entry = qr_entry_from_row(row)
 
-        "qr": f"/static/qr/{filename}",
+    max_age = max(0, int((entry["expires_at"] - utc_now()).total_seconds()))
 
-        "token": token,
+    response = make_response(entry["png"])
+    response.mimetype = "image/png"
+    response.headers["Cache-Control"] = f"private, max-age={max_age}"
+    response.set_etag(token)
+    return response.make_conditional(request)
 
-        "expires": expires_at
 
-    })
 @app.route("/student/upload-photo", methods=["POST"])
 @login_required(role="student")
 def upload_photo():
@@ -1240,6 +3483,8 @@ def upload_photo():
     )
     conn.commit()
     conn.close()
+    invalidate_profiles()
+    session["user_photo"] = filename
 
     flash("Profile photo updated!", "success")
     return redirect(url_for("student_profile"))
@@ -1253,11 +3498,7 @@ def student_dashboard():
     conn = get_db()
     sid = session["user_id"]
 
-    student = conn.execute("""
-        SELECT department, semester
-        FROM users
-        WHERE id = ?
-    """, (sid,)).fetchone()
+    student = current_profile()
 
     raw_department = student["department"]
     semester = student["semester"]
@@ -1295,14 +3536,12 @@ def student_dashboard():
     subject_attendance = conn.execute("""
         SELECT
             s.name AS subject,
-            COUNT(a.id) AS total_classes,
-            COALESCE(
-                SUM(CASE WHEN a.status='Present' THEN 1 ELSE 0 END),0
-            ) AS present_days
+            COALESCE(SUM(sm.total),0) AS total_classes,
+            COALESCE(SUM(sm.present),0) AS present_days
         FROM subjects s
-        LEFT JOIN attendance a
-            ON a.subject_id=s.id
-           AND a.student_id=?
+        LEFT JOIN attendance_summary sm
+            ON sm.subject_id=s.id
+           AND sm.student_id=?
         WHERE s.department=?
           AND s.semester=?
         GROUP BY s.id
@@ -1422,28 +3661,32 @@ def fetch_result():
 def admin_result():
 
     conn = get_db()
+    scope, params = college_scope()
 
-    subject_high = conn.execute("""
+    subject_high = conn.execute(f"""
         SELECT subject, MAX(marks) as high_marks
         FROM beu_results
+        WHERE {scope}
         GROUP BY subject
         ORDER BY subject
-    """).fetchall()
+    """, params).fetchall()
 
-    toppers = conn.execute("""
+    toppers = conn.execute(f"""
         SELECT registration_no, SUM(marks) as total
         FROM beu_results
+        WHERE {scope}
         GROUP BY registration_no
         ORDER BY total DESC
         LIMIT 10
-    """).fetchall()
+    """, params).fetchall()
 
     conn.close()
 
     return render_template(
         "admin_result.html",
         subject_high=subject_high,
-        toppers=toppers
+        toppers=toppers,
+        job_id=request.args.get("job", type=int)
     )
 
 
@@ -1454,35 +3697,71 @@ def admin_result():
 def admin_result_fetch():
 
     sem = request.form.get("semester")
+    refetch = bool(request.form.get("refetch"))
     branch = session.get("admin_branch")
+    college_id = current_college_id()
 
     conn = get_db()
 
-    # 🔥 flexible match
-    students = conn.execute("""
+    # same branch + semester already running → just show its progress
+    running = conn.execute("""
+        SELECT id FROM beu_fetch_jobs
+        WHERE college_id=? AND branch=? AND semester=? AND status='running'
+          AND created_at > datetime('now', '-1 hour')
+    """, (college_id, branch, sem)).fetchone()
+
+    if running:
+        conn.close()
+        flash("Result fetch already running", "info")
+        return redirect(url_for("admin_result", job=running["id"]))
+
+    # every department spelling of the branch ('CSE', 'CSE (Network)', …)
+    names = dept_names(branch or "")
+    students = conn.execute(f"""
         SELECT registration_no
         FROM users
         WHERE role='student'
+        AND college_id=?
         AND semester=?
-        AND department LIKE ?
-    """, (sem, f"%{branch}%")).fetchall()
+        AND department IN ({in_params(names)})
+        AND registration_no IS NOT NULL
+    """, [college_id, sem] + names).fetchall()
 
-    print("DEBUG students found:", len(students))
+    regs = [s["registration_no"] for s in students]
 
-    count = 0
+    cur = conn.execute("""
+        INSERT INTO beu_fetch_jobs (admin_id, college_id, branch, semester, total)
+        VALUES (?, ?, ?, ?, ?)
+    """, (session["user_id"], college_id, branch, sem, len(regs)))
+    job_id = cur.lastrowid
+    conn.commit()
+    conn.close()
+
+    threading.Thread(
+        target=run_beu_job, args=(job_id, regs, sem, college_id, refetch),
+        name=f"beu-job-{job_id}", daemon=True
+    ).start()
+
+    flash(f"Fetching results for {len(regs)} students in background", "success")
+    return redirect(url_for("admin_result", job=job_id))
 
-    for s in students:
-        reg = s["registration_no"]
-        ok = fetch_and_store_beu(reg, sem)
-        if ok:
-            count += 1
-        else:
-            print("FAILED:", reg)
 
+@app.route("/admin/result/fetch/<int:job_id>")
+@login_required(role="admin")
+def admin_result_fetch_status(job_id):
+
+    conn = get_db()
+    job = conn.execute("""
+        SELECT id, semester, status, total, done, fetched, cached, failed, error
+        FROM beu_fetch_jobs
+        WHERE id=? AND college_id=?
+    """, (job_id, current_college_id())).fetchone()
     conn.close()
 
-    flash(f"{count} students result fetched", "success")
-    return redirect(url_for("admin_result"))
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(dict(job))
 
 
 @app.route("/leave/apply", methods=["GET", "POST"])
@@ -1533,8 +3812,8 @@ def apply_leave():
 
         conn.execute("""
             INSERT INTO leaves
-            (student_id, from_date, to_date, reason, medical_file)
-            VALUES (?, ?, ?, ?, ?)
+            (student_id, college_id, from_date, to_date, reason, medical_file)
+            VALUES (?1, (SELECT college_id FROM users WHERE id = ?1), ?2, ?3, ?4, ?5)
         """, (
             session["user_id"],
             from_date,
@@ -1542,13 +3821,10 @@ def apply_leave():
             reason,
             medical_filename
         ))
+        invalidate_leave_stats(conn)
 
         # ---------------- FETCH PARENT EMAIL ----------------
-        parent = conn.execute("""
-            SELECT name, parent_email
-            FROM users
-            WHERE id = ?
-        """, (session["user_id"],)).fetchone()
+        parent = current_profile()
 
         conn.commit()
         conn.close()
@@ -1590,11 +3866,7 @@ def student_subject_attendance():
     student_id = session["user_id"]
 
     # ---------- STUDENT INFO ----------
-    student = conn.execute("""
-        SELECT department, semester
-        FROM users
-        WHERE id = ?
-    """, (student_id,)).fetchone()
+    student = current_profile()
 
     if not student:
         conn.close()
@@ -1616,19 +3888,15 @@ def student_subject_attendance():
         SELECT
             s.id AS subject_id,
             s.name AS subject,
-            COUNT(a.id) AS total_classes,
-            COALESCE(
-                SUM(CASE WHEN a.status='Present' THEN 1 ELSE 0 END),
-                0
-            ) AS present_days
+            COALESCE(sm.total, 0) AS total_classes,
+            COALESCE(sm.present, 0) AS present_days
         FROM subjects s
-        LEFT JOIN attendance a
-            ON a.subject_id = s.id
-           AND a.student_id = ?
-           AND a.semester = ?
+        LEFT JOIN attendance_summary sm
+            ON sm.subject_id = s.id
+           AND sm.student_id = ?
+           AND sm.semester = ?
         WHERE s.department = ?
           AND s.semester = ?
-        GROUP BY s.id
         ORDER BY s.name
     """, (
         student_id,
@@ -1641,48 +3909,137 @@ def student_subject_attendance():
     return data
 
 
-# ---------------- ADMIN DASHBOARD / LEAVE UPDATE / SUPPORT ----------------
-@app.route("/admin/dashboard")
-@login_required(role="admin")
-def admin_dashboard():
-    conn = get_db()
+# ---------------- LEAVE STATS ----------------
+# Admin dashboard counts per (college, department key), from one grouped pass over
+# users JOIN leaves on exact department names (indexed, unlike the old
+# LIKE '%branch%'). Cached per worker against the "leaves" row of
+# cache_versions, which every path that changes the counts bumps inside
+# its own transaction → all workers drop the stale entry together.
+leave_stats_cache = {}
+leave_stats_lock = threading.Lock()
 
-    # 🔐 Admin branch (login time pe set hota hai)
-    raw_branch = session.get("admin_branch", "") or ""
 
-    # 🔁 NORMALIZE branch for subjects table
-    SUBJECT_DEPT_MAP = {
-        "CSE": "CSE",
-        "CSE (Network)": "CSE",
-        "CSE (Cyber Security)": "CSE",
+def dept_key(department):
+    """'CSE (Network)' → 'CSE', via SUBJECT_DEPT_MAP."""
+    return SUBJECT_DEPT_MAP.get(department, department)
 
-        "Civil": "Civil",
-        "Civil Engineering": "Civil",
 
-        "Mechanical": "Mechanical",
-        "Mechanical Engineering": "Mechanical",
-        "ME": "Mechanical",
+def dept_names(department):
+    """Every users.department value that shares the department's key."""
+    key = dept_key(department)
+    return sorted({key} | {d for d, k in SUBJECT_DEPT_MAP.items() if k == key})
 
-        "Electrical": "EE",
-        "EE": "EE",
 
-        "Electronics": "ECE",
-        "ECE": "ECE"
-    }
+def in_params(values):
+    return ", ".join("?" * len(values))
 
-    subject_dept = SUBJECT_DEPT_MAP.get(raw_branch, raw_branch)
 
-    # 🔔 Unread Support Messages Count (branch-wise)
-    unread_count = conn.execute("""
-        SELECT COUNT(*)
-        FROM support_messages sm
-        JOIN users u ON sm.student_id = u.id
-        WHERE sm.seen = 0
-          AND u.department LIKE ?
-    """, (f"%{raw_branch}%",)).fetchone()[0]
+def cache_version(conn, name):
+    row = conn.execute(
+        "SELECT version FROM cache_versions WHERE name=?", (name,)
+    ).fetchone()
+    return row[0] if row else 0
 
-    # 📄 Leave Applications (branch-wise)
-    leaves = conn.execute("""
+
+def bump_cache_version(conn, name):
+    # caller commits → the version moves with the data it describes
+    conn.execute("""
+        INSERT INTO cache_versions (name, version) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1
+    """, (name,))
+
+
+def invalidate_leave_stats(conn):
+    bump_cache_version(conn, "leaves")
+
+
+def leave_stats(conn, college_id, department):
+    key = (college_id, dept_key(department))
+
+    # read the version first: a write racing the count below only
+    # leaves an entry that the next request sees as outdated
+    version = cache_version(conn, "leaves")
+
+    with leave_stats_lock:
+        cached = leave_stats_cache.get(key)
+    if cached and cached[0] == version:
+        return dict(cached[1])
+
+    names = dept_names(department)
+    stats = {"total": 0, "approved": 0, "pending": 0, "rejected": 0}
+
+    for status, count in conn.execute(f"""
+        SELECT l.status, COUNT(*)
+        FROM users u
+        JOIN leaves l ON l.student_id = u.id
+        WHERE u.college_id = ?
+          AND u.department IN ({in_params(names)})
+        GROUP BY l.status
+    """, [college_id] + names):
+        stats["total"] += count
+        if status and status.lower() in stats:
+            stats[status.lower()] += count
+
+    with leave_stats_lock:
+        leave_stats_cache[key] = (version, stats)
+
+    return dict(stats)
+
+
+# ---------------- LEAVE LIST ----------------
+# Keyset pagination on (applied_on, id): a page starts right after the
+# last row of the previous one, so every page costs about the same no
+# matter how many semesters of leaves the branch has piled up.
+LEAVE_PAGE_SIZE = int(os.environ.get("LEAVE_PAGE_SIZE", "25"))
+LEAVE_STATUSES = ("Pending", "Approved", "Rejected")
+
+
+def leave_cursor(row):
+    return f"{row['applied_on']}|{row['id']}"
+
+
+def parse_leave_cursor(cursor):
+    try:
+        applied_on, lid = cursor.rsplit("|", 1)
+        return applied_on, int(lid)
+    except (AttributeError, ValueError):
+        return None
+
+
+def leave_filters(args):
+    """(status, semester) from the query string, ignoring junk values."""
+    status = args.get("status")
+    if status not in LEAVE_STATUSES:
+        status = None
+    semester = args.get("semester", type=int)
+    return status, semester
+
+
+def leave_page(conn, college_id, department, status=None, semester=None,
+               cursor=None, limit=LEAVE_PAGE_SIZE):
+    """One page of the branch's leaves, newest first → (rows, next cursor)."""
+    names = dept_names(department)
+    where = ["l.college_id = ?", f"u.department IN ({in_params(names)})"]
+    params = [college_id] + names
+
+    if status:
+        where.append("l.status = ?")
+        params.append(status)
+
+    if semester:
+        where.append("u.semester = ?")
+        params.append(semester)
+
+    after = parse_leave_cursor(cursor)
+    if after:
+        where.append("(l.applied_on, l.id) < (?, ?)")
+        params.extend(after)
+
+    # CROSS JOIN pins leaves as the outer loop: walk the college's slice
+    # of idx_leaves_college_applied (or idx_leaves_college_status_applied)
+    # newest-first and stop at LIMIT, instead of collecting the whole
+    # branch and sorting it
+    rows = conn.execute(f"""
         SELECT
             l.*,
             u.name,
@@ -1691,44 +4048,44 @@ def admin_dashboard():
             u.semester,
             u.department
         FROM leaves l
-        JOIN users u ON l.student_id = u.id
-        WHERE u.department LIKE ?
-        ORDER BY l.applied_on DESC
-    """, (f"%{raw_branch}%",)).fetchall()
-
-    # 📊 Leave Statistics
-    stats = {
-        "total": conn.execute("""
-            SELECT COUNT(*)
-            FROM leaves l
-            JOIN users u ON l.student_id = u.id
-            WHERE u.department LIKE ?
-        """, (f"%{raw_branch}%",)).fetchone()[0],
-
-        "approved": conn.execute("""
-            SELECT COUNT(*)
-            FROM leaves l
-            JOIN users u ON l.student_id = u.id
-            WHERE l.status='Approved'
-              AND u.department LIKE ?
-        """, (f"%{raw_branch}%",)).fetchone()[0],
-
-        "pending": conn.execute("""
-            SELECT COUNT(*)
-            FROM leaves l
-            JOIN users u ON l.student_id = u.id
-            WHERE l.status='Pending'
-              AND u.department LIKE ?
-        """, (f"%{raw_branch}%",)).fetchone()[0],
-
-        "rejected": conn.execute("""
-            SELECT COUNT(*)
-            FROM leaves l
-            JOIN users u ON l.student_id = u.id
-            WHERE l.status='Rejected'
-              AND u.department LIKE ?
-        """, (f"%{raw_branch}%",)).fetchone()[0],
-    }
+        CROSS JOIN users u ON u.id = l.student_id
+        WHERE {" AND ".join(where)}
+        ORDER BY l.applied_on DESC, l.id DESC
+        LIMIT ?
+    """, params + [limit + 1]).fetchall()
+
+    next_cursor = leave_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# ---------------- ADMIN DASHBOARD / LEAVE UPDATE / SUPPORT ----------------
+@app.route("/admin/dashboard")
+@login_required(role="admin")
+def admin_dashboard():
+    conn = get_db()
+
+    # 🔐 Admin branch (login time pe set hota hai)
+    raw_branch = session.get("admin_branch", "") or ""
+
+    # 🔁 NORMALIZE branch for subjects table
+    subject_dept = dept_key(raw_branch)
+    branch_names = dept_names(raw_branch)
+    college_id = current_college_id()
+
+    # 🔔 Unread Support Messages Count (branch-wise)
+    unread_count = conn.execute(f"""
+        SELECT COALESCE(SUM(unread_by_admin), 0)
+        FROM support_conversations
+        WHERE college_id = ?
+          AND department IN ({in_params(branch_names)})
+    """, [college_id] + branch_names).fetchone()[0]
+
+    # 📄 Leave Applications (branch-wise, first page → rest via JSON)
+    status, semester = leave_filters(request.args)
+    leaves, next_cursor = leave_page(conn, college_id, raw_branch, status, semester)
+
+    # 📊 Leave Statistics (one pass, cached)
+    stats = leave_stats(conn, college_id, raw_branch)
 
     # 📚 ✅ SUBJECT LIST (FOR QR CODE)  🔥🔥
     subjects = conn.execute("""
@@ -1745,57 +4102,60 @@ def admin_dashboard():
         leaves=leaves,
         stats=stats,
         unread_count=unread_count,
-        subjects=subjects   # ✅ VERY IMPORTANT FOR QR
+        subjects=subjects,   # ✅ VERY IMPORTANT FOR QR
+        next_cursor=next_cursor,
+        leave_status=status,
+        leave_semester=semester,
+        leave_statuses=LEAVE_STATUSES
     )
 
-import qrcode
-import base64
-import random
-import string
-from io import BytesIO
-from datetime import datetime, timedelta
-from flask import jsonify
 
-@app.route("/admin/generate-qr/<int:subject_id>")
+@app.route("/admin/leaves")
 @login_required(role="admin")
-def admin_generate_qr(subject_id):
+def admin_leaves_json():
 
-    now = datetime.now()
-    expires_at = now + timedelta(minutes=2)
+    conn = get_db()
 
-    # 🔐 FULL TOKEN (QR ke andar)
-    full_token = secrets.token_urlsafe(16)
+    status, semester = leave_filters(request.args)
 
-    # 👁️ DISPLAY TOKEN (5 char)
-    display_token = (
-        secrets.choice(string.digits) +
-        secrets.choice(string.ascii_uppercase) +
-        secrets.choice(string.digits) +
-        secrets.choice(string.ascii_uppercase) +
-        secrets.choice(string.digits)
+    rows, next_cursor = leave_page(
+        conn,
+        current_college_id(),
+        session.get("admin_branch", "") or "",
+        status,
+        semester,
+        request.args.get("cursor")
     )
 
-    conn = get_db()
-    conn.execute("""
-        INSERT INTO qr_tokens (full_token, display_token, subject_id, expires_at, used)
-        VALUES (?, ?, ?, ?, 0)
-    """, (full_token, display_token, subject_id, expires_at))
-    conn.commit()
     conn.close()
 
-    # 📷 QR IMAGE
-    qr = qrcode.make(full_token)
-    buf = BytesIO()
-    qr.save(buf)
-    img_base64 = base64.b64encode(buf.getvalue()).decode()
-
     return jsonify({
-        "qr": img_base64,
-        "display_token": display_token,
-        "expires": expires_at.strftime("%H:%M:%S")
+        "leaves": [
+            {
+                "id": r["id"],
+                "name": r["name"],
+                "department": r["department"],
+                "semester": r["semester"],
+                "reason": r["reason"],
+                "from_date": r["from_date"],
+                "to_date": r["to_date"],
+                "status": r["status"],
+                "applied_on": r["applied_on"],
+                "medical_url": url_for(
+                    "static", filename="medical/" + r["medical_file"]
+                ) if r["medical_file"] else None,
+                "update_url": url_for("admin_update_leave", lid=r["id"])
+            }
+            for r in rows
+        ],
+        "next": next_cursor
     })
 
+@app.route("/admin/generate-qr/<int:subject_id>")
+@login_required(role="admin")
+def admin_generate_qr(subject_id):
 
+    return qr_token_response(subject_id)
 
 
 @app.route("/admin/update-leave/<int:lid>/update", methods=["POST"])
@@ -1806,10 +4166,12 @@ def admin_update_leave(lid):
 
     conn = get_db()
 
+    scope, params = college_scope()
     conn.execute(
-        "UPDATE leaves SET status=? WHERE id=?",
-        (status, lid)
+        f"UPDATE leaves SET status=? WHERE id=? AND {scope}",
+        [status, lid] + params
     )
+    invalidate_leave_stats(conn)
 
     conn.commit()
     conn.close()
@@ -1818,43 +4180,280 @@ def admin_update_leave(lid):
 
     return redirect(url_for("admin_dashboard"))
 
+def check_in_with_token(conn, token, student_id, college_id):
+    """
+    Consume one use of a live QR token and mark the student present.
+    The token UPDATE ... RETURNING, the per-token dedupe row and the
+    attendance upsert commit in one write transaction, so a burst of
+    scans on the projected code never races on a SELECT-then-UPDATE.
+    Returns (result, subject_id); result is "ok", "duplicate" or "invalid".
+    """
+    if conn.in_transaction:
+        conn.commit()
+
+    # take the write lock up front (waits up to busy_timeout)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # scanner fills in the full token, students type the display token
+        qr = conn.execute("""
+            UPDATE qr_tokens
+            SET uses = uses + 1,
+                used = CASE
+                    WHEN max_uses IS NOT NULL AND uses + 1 >= max_uses THEN 1
+                    ELSE 0
+                END
+            WHERE id = (
+                SELECT id FROM qr_tokens
+                WHERE (display_token = ? OR full_token = ?)
+                  AND college_id = ?
+                  AND expires_at > CURRENT_TIMESTAMP
+                  AND used = 0
+                ORDER BY expires_at DESC
+                LIMIT 1
+            )
+            RETURNING id, subject_id
+        """, (token, token, college_id)).fetchone()
+
+        if not qr:
+            conn.rollback()
+            return "invalid", None
+
+        subject = conn.execute(
+            "SELECT semester FROM subjects WHERE id = ?",
+            (qr["subject_id"],)
+        ).fetchone()
+
+        if not subject:
+            conn.rollback()
+            return "invalid", None
+
+        try:
+            conn.execute("""
+                INSERT INTO qr_checkins (token_id, student_id)
+                VALUES (?, ?)
+            """, (qr["id"], student_id))
+        except sqlite3.IntegrityError:
+            # same student scanning again → give the use back
+            conn.rollback()
+            return "duplicate", qr["subject_id"]
+
+        save_attendance(conn, [(
+            student_id,
+            qr["subject_id"],
+            subject["semester"],
+            datetime.now().strftime("%Y-%m-%d"),
+            "Present"
+        )])
+        return "ok", qr["subject_id"]
+
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+
+CHECKIN_MESSAGES = {
+    "ok": ("✅ Attendance marked successfully", "success", 200),
+    "duplicate": ("ℹ️ Attendance already marked for this class", "info", 409),
+    "invalid": ("❌ Invalid or Expired Token", "danger", 400),
+}
+
+
 @app.route("/student/submit-token", methods=["POST"])
 @login_required(role="student")
 def student_submit_token():
 
-    token_input = request.form.get("token")
+    # html5-qrcode scanner posts JSON, the manual form posts a form
+    if request.is_json:
+        token_input = (request.get_json(silent=True) or {}).get("token")
+    else:
+        token_input = request.form.get("token")
+
+    token_input = (token_input or "").strip()
     student_id = session["user_id"]
 
     conn = get_db()
+    result, _ = check_in_with_token(conn, token_input, student_id, current_college_id())
+    conn.close()
 
-    qr = conn.execute("""
-        SELECT * FROM qr_tokens
-        WHERE display_token = ?
-          AND expires_at > CURRENT_TIMESTAMP
-          AND used = 0
-    """, (token_input,)).fetchone()
+    message, category, code = CHECKIN_MESSAGES[result]
 
-    if not qr:
-        conn.close()
-        flash("❌ Invalid or Expired Token", "danger")
-        return redirect(url_for("student_dashboard"))
+    if request.is_json:
+        return jsonify({
+            "success": result == "ok",
+            "result": result,
+            "message": message
+        }), code
 
-    # ✅ Mark attendance
-    conn.execute("""
-        INSERT INTO attendance (student_id, subject_id, date, status)
-        VALUES (?, ?, DATE('now'), 'Present')
-    """, (student_id, qr["subject_id"]))
+    flash(message, category)
+    return redirect(url_for("student_dashboard"))
 
-    # 🔒 Token mark as used
-    conn.execute("""
-        UPDATE qr_tokens SET used = 1 WHERE id = ?
-    """, (qr["id"],))
+# ---------------- SEMESTER ENGINE ----------------
+# Each action is one INSERT ... SELECT into semester_log_items (old and
+# new values per student) plus one UPDATE over a temp table of target
+# ids, inside a single write transaction. Undo replays the items back.
+
+# action → (new semester, new status) as SQL over the users row
+SEMESTER_ACTIONS = {
+    "promote": ("semester + 1", "status"),
+    "reset": ("MAX(1, semester - 1)", "status"),
+    "yearback": ("semester", "status"),
+    "passout": ("semester", "'passout'"),
+}
 
-    conn.commit()
-    conn.close()
 
-    flash("✅ Attendance marked successfully", "success")
-    return redirect(url_for("student_dashboard"))
+def load_semester_targets(conn, college_id, branch, sem, student_ids=None):
+    """Fill temp.semester_targets; all active students of sem, or the picked ones."""
+    conn.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS semester_targets (id INTEGER PRIMARY KEY)"
+    )
+    conn.execute("DELETE FROM semester_targets")
+
+    names = [college_id] + dept_names(branch)
+    dept_filter = (
+        f"role='student' AND college_id = ? "
+        f"AND department IN ({in_params(names[1:])})"
+    )
+
+    if student_ids is None:
+        conn.execute(f"""
+            INSERT INTO semester_targets (id)
+            SELECT id FROM users
+            WHERE {dept_filter}
+              AND semester = ?
+              AND COALESCE(status,'active') = 'active'
+        """, names + [sem])
+    else:
+        # picked ids still have to be students of this admin's college + branch
+        conn.execute(f"""
+            INSERT INTO semester_targets (id)
+            SELECT id FROM users
+            WHERE {dept_filter}
+              AND id IN (SELECT value FROM json_each(?))
+        """, names + [json.dumps([int(i) for i in student_ids])])
+
+    return conn.execute("SELECT COUNT(*) FROM semester_targets").fetchone()[0]
+
+
+def run_semester_action(conn, admin_id, college_id, branch, action, sem,
+                        student_ids=None, dry_run=False):
+    """
+    Apply action to the target students in one transaction.
+    Returns {"log_id", "matched", "changed"}; with dry_run nothing is
+    written and log_id is None.
+    """
+    new_sem, new_status = SEMESTER_ACTIONS[action]
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN" if dry_run else "BEGIN IMMEDIATE")
+
+    try:
+        matched = load_semester_targets(conn, college_id, branch, sem, student_ids)
+
+        changed = conn.execute(f"""
+            SELECT COUNT(*) FROM users
+            WHERE id IN (SELECT id FROM semester_targets)
+              AND (semester IS NOT {new_sem} OR status IS NOT {new_status})
+        """).fetchone()[0]
+
+        if dry_run or not matched:
+            conn.rollback()
+            return {"log_id": None, "matched": matched, "changed": changed}
+
+        to_sem = conn.execute(f"""
+            SELECT GROUP_CONCAT(DISTINCT {new_sem}) FROM users
+            WHERE id IN (SELECT id FROM semester_targets)
+        """).fetchone()[0]
+
+        log_id = conn.execute("""
+            INSERT INTO semester_logs (admin_id, action, from_sem, to_sem)
+            VALUES (?, ?, ?, ?)
+            RETURNING id
+        """, (admin_id, action, sem, to_sem)).fetchone()[0]
+
+        conn.execute(f"""
+            INSERT INTO semester_log_items
+            (log_id, student_id, old_semester, new_semester, old_status, new_status)
+            SELECT ?, id, semester, {new_sem}, status, {new_status}
+            FROM users
+            WHERE id IN (SELECT id FROM semester_targets)
+        """, (log_id,))
+
+        conn.execute(f"""
+            UPDATE users
+            SET semester = {new_sem}, status = {new_status}
+            WHERE id IN (SELECT id FROM semester_targets)
+        """)
+
+        conn.commit()
+        invalidate_profiles()
+        return {"log_id": log_id, "matched": matched, "changed": changed}
+
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+def undo_semester_action(conn, admin_id):
+    """
+    Revert this admin's latest action that is not undone yet.
+    Students changed again since then are left alone.
+    Returns (log row, restored, skipped) or None.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+
+    try:
+        log = conn.execute("""
+            SELECT id, action, from_sem
+            FROM semester_logs
+            WHERE admin_id = ?
+              AND undone_at IS NULL
+              AND EXISTS (SELECT 1 FROM semester_log_items WHERE log_id = semester_logs.id)
+            ORDER BY id DESC
+            LIMIT 1
+        """, (admin_id,)).fetchone()
+
+        if not log:
+            conn.rollback()
+            return None
+
+        total = conn.execute(
+            "SELECT COUNT(*) FROM semester_log_items WHERE log_id=?", (log["id"],)
+        ).fetchone()[0]
+
+        restored = conn.execute("""
+            UPDATE users
+            SET (semester, status) = (
+                SELECT old_semester, old_status
+                FROM semester_log_items
+                WHERE log_id = ? AND student_id = users.id
+            )
+            WHERE id IN (
+                SELECT i.student_id
+                FROM semester_log_items i
+                WHERE i.log_id = ?
+                  AND i.student_id = users.id
+                  AND users.semester IS i.new_semester
+                  AND users.status IS i.new_status
+            )
+        """, (log["id"], log["id"])).rowcount
+
+        conn.execute(
+            "UPDATE semester_logs SET undone_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (log["id"],)
+        )
+
+        conn.commit()
+        invalidate_profiles()
+        return log, restored, total - restored
+
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
 
 @app.route("/admin/semester-control", methods=["GET", "POST"])
 @login_required(role="admin")
@@ -1862,6 +4461,25 @@ def semester_control():
 
     conn = get_db()
     branch = session.get("admin_branch")
+    college_id = current_college_id()
+    names = dept_names(branch or "")
+
+    # ================= UNDO =================
+    if request.args.get("undo"):
+
+        undone = undo_semester_action(conn, session["user_id"])
+        conn.close()
+
+        if not undone:
+            flash("Nothing to undo", "warning")
+            return redirect(url_for("semester_control"))
+
+        log, restored, skipped = undone
+        msg = f"Undid {log['action']}: {restored} students restored"
+        if skipped:
+            msg += f", {skipped} skipped (changed since)"
+        flash(msg, "success")
+        return redirect(url_for("semester_control", semester=log["from_sem"]))
 
     # ================= APPLY =================
     if request.method == "POST":
@@ -1870,72 +4488,39 @@ def semester_control():
         action = request.form.get("action")
         target = request.form.get("target")
         selected_ids = request.form.getlist("student_ids")
+        dry_run = bool(request.form.get("dry_run"))
 
-        # ---- target students ----
-        if target == "all":
-            students = conn.execute("""
-                SELECT id, semester
-                FROM users
-                WHERE role='student'
-                AND semester=?
-                AND department LIKE ?
-                AND COALESCE(status,'active')='active'
-            """, (sem, f"%{branch}%")).fetchall()
-
-        else:  # selected
-            if not selected_ids:
-                flash("No students selected", "danger")
-                return redirect(url_for("semester_control", semester=sem))
-
-            q = ",".join(["?"] * len(selected_ids))
-            students = conn.execute(f"""
-                SELECT id, semester
-                FROM users
-                WHERE id IN ({q})
-            """, selected_ids).fetchall()
-
-        if not students:
-            flash("No students found", "danger")
+        if action not in SEMESTER_ACTIONS:
+            flash("Choose an action", "danger")
             return redirect(url_for("semester_control", semester=sem))
 
-        affected_ids = []
-
-        # ---- apply action ----
-        for s in students:
-            sid = s["id"]
-            cur = int(s["semester"])
-
-            if action == "promote":
-                new_sem = cur + 1
-                conn.execute("UPDATE users SET semester=? WHERE id=?", (new_sem, sid))
-
-            elif action == "reset":
-                new_sem = max(1, cur - 1)
-                conn.execute("UPDATE users SET semester=? WHERE id=?", (new_sem, sid))
-
-            elif action == "yearback":
-                pass  # semester same
-
-            elif action == "passout":
-                conn.execute("UPDATE users SET status='passout' WHERE id=?", (sid,))
-
-            affected_ids.append(str(sid))
+        if target != "all" and not selected_ids:
+            flash("No students selected", "danger")
+            return redirect(url_for("semester_control", semester=sem))
 
-        # ---- log ----
-        conn.execute("""
-            INSERT INTO semester_logs
-            (admin_id, action, from_sem, to_sem, affected_ids)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
+        result = run_semester_action(
+            conn,
             session["user_id"],
+            college_id,
+            branch or "",
             action,
             sem,
-            "",
-            ",".join(affected_ids)
-        ))
+            None if target == "all" else selected_ids,
+            dry_run
+        )
+        conn.close()
+
+        if not result["matched"]:
+            flash("No students found", "danger")
+        elif dry_run:
+            flash(
+                f"Dry run ({action}): {result['matched']} students matched, "
+                f"{result['changed']} would change. Nothing was saved.",
+                "info"
+            )
+        else:
+            flash(f"{result['matched']} students updated", "success")
 
-        conn.commit()
-        flash(f"{len(affected_ids)} students updated", "success")
         return redirect(url_for("semester_control", semester=sem))
 
     # ================= PREVIEW =================
@@ -1944,39 +4529,48 @@ def semester_control():
     counts = None
 
     if sem:
-        students = conn.execute("""
+        students = conn.execute(f"""
             SELECT id, name, roll_no, registration_no, semester,
                    COALESCE(status,'active') as status
             FROM users
             WHERE role='student'
+            AND college_id=?
             AND semester=?
-            AND department LIKE ?
+            AND department IN ({in_params(names)})
             ORDER BY roll_no
-        """, (sem, f"%{branch}%")).fetchall()
+        """, [college_id, sem] + names).fetchall()
 
         counts = {
             "total": len(students),
-            "active": conn.execute("""
+            "active": conn.execute(f"""
                 SELECT COUNT(*) FROM users
-                WHERE semester=? AND department LIKE ?
+                WHERE college_id=? AND semester=?
+                AND department IN ({in_params(names)})
                 AND COALESCE(status,'active')='active'
-            """, (sem, f"%{branch}%")).fetchone()[0],
+            """, [college_id, sem] + names).fetchone()[0],
 
-            "passout": conn.execute("""
+            "passout": conn.execute(f"""
                 SELECT COUNT(*) FROM users
-                WHERE status='passout'
-                AND department LIKE ?
-            """, (f"%{branch}%",)).fetchone()[0],
-
-            "promoted": conn.execute("""
-                SELECT COUNT(*) FROM semester_logs
-                WHERE action='promote' AND from_sem=?
-            """, (sem,)).fetchone()[0],
-
-            "yearback": conn.execute("""
-                SELECT COUNT(*) FROM semester_logs
-                WHERE action='yearback' AND from_sem=?
-            """, (sem,)).fetchone()[0],
+                WHERE college_id=? AND status='passout'
+                AND department IN ({in_params(names)})
+            """, [college_id] + names).fetchone()[0],
+
+            # students (not actions) still promoted / held back from sem
+            "promoted": conn.execute(f"""
+                SELECT COUNT(*) FROM semester_log_items i
+                JOIN semester_logs l ON l.id = i.log_id
+                JOIN users u ON u.id = i.student_id
+                WHERE l.action='promote' AND l.from_sem=? AND l.undone_at IS NULL
+                  AND u.college_id=? AND u.department IN ({in_params(names)})
+            """, [sem, college_id] + names).fetchone()[0],
+
+            "yearback": conn.execute(f"""
+                SELECT COUNT(*) FROM semester_log_items i
+                JOIN semester_logs l ON l.id = i.log_id
+                JOIN users u ON u.id = i.student_id
+                WHERE l.action='yearback' AND l.from_sem=? AND l.undone_at IS NULL
+                  AND u.college_id=? AND u.department IN ({in_params(names)})
+            """, [sem, college_id] + names).fetchone()[0],
         }
 
     conn.close()
@@ -1988,24 +4582,149 @@ def semester_control():
         counts=counts
     )
 
+# ---------------- PDF REPORTS ----------------
+# Reports are drawn straight off the cursor (REPORT_CHUNK_ROWS rows per
+# fetch) as a paginated table with the header repeated on every page.
+# reportlab writes the cross-reference table on save(), so the document
+# goes to an anonymous TemporaryFile (unlinked on creation, gone when
+# closed) and send_file streams it out in blocks.
+
+REPORT_CHUNK_ROWS = int(os.environ.get("REPORT_CHUNK_ROWS", "500"))
+
+
+def iter_rows(cursor, chunk=REPORT_CHUNK_ROWS):
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+            return
+        yield from rows
+
+
+def fit_text(text, width, font, size):
+    """Cut text to fit width points, ending in '...' when cut."""
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+
+    text = "" if text is None else str(text)
+    # no Helvetica glyph is wider than ~1 em → short strings always fit
+    if len(text) * size * 1.02 <= width or stringWidth(text, font, size) <= width:
+        return text
+    while text and stringWidth(text + "...", font, size) > width:
+        text = text[:-1]
+    return text + "..."
+
+
+def pdf_table_report(title, columns, rows, download_name, as_attachment=True):
+    """
+    columns: [(heading, width in points, row -> value)].
+    rows can be any iterable; it is read once, row by row.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    page_w, page_h = A4
+    margin = 40
+    row_h = 16
+    font, bold, size = "Helvetica", "Helvetica-Bold", 9
+    table_w = sum(w for _, w, _ in columns)
+
+    tmp = tempfile.TemporaryFile(suffix=".pdf")
+    c = canvas.Canvas(tmp, pagesize=A4)
+    page = 0
+    text = None     # one text object per page for all cells
+    rules = []      # row separators, drawn once per page
+
+    def end_page():
+        c.drawText(text)
+        c.lines(rules)
+        rules.clear()
+
+    def start_page():
+        nonlocal page, text
+        page += 1
+        y = page_h - margin
+
+        c.setFont(bold, 13)
+        c.drawString(margin, y, title)
+        c.setFont(font, 8)
+        c.drawRightString(page_w - margin, y, f"Page {page}")
+        y -= 28
+
+        # header row
+        c.setFillColorRGB(0.86, 0.90, 0.96)
+        c.rect(margin, y - 5, table_w, row_h, stroke=0, fill=1)
+        c.setFillColorRGB(0, 0, 0)
+        c.setFont(bold, size)
+        x = margin
+        for heading, w, _ in columns:
+            c.drawString(x + 3, y, fit_text(heading, w - 6, bold, size))
+            x += w
+
+        c.setStrokeColorRGB(0.8, 0.8, 0.8)
+        text = c.beginText()
+        text.setFont(font, size)
+        return y - row_h
+
+    try:
+        y = start_page()
+        count = 0
+
+        for row in rows:
+            if y < margin:
+                end_page()
+                c.showPage()
+                y = start_page()
+
+            x = margin
+            for _, w, value in columns:
+                text.setTextOrigin(x + 3, y)
+                text.textOut(fit_text(value(row), w - 6, font, size))
+                x += w
+            rules.append((margin, y - 5, margin + table_w, y - 5))
+
+            y -= row_h
+            count += 1
+
+        end_page()
+        if y < margin:
+            c.showPage()
+            y = start_page()
+        c.setFont(bold, size)
+        c.drawString(margin + 3, y - 4, f"Total: {count}" if count else "No records")
+
+        c.save()
+        tmp.seek(0)
+
+    except BaseException:
+        tmp.close()
+        raise
+
+    return send_file(
+        tmp,
+        mimetype="application/pdf",
+        as_attachment=as_attachment,
+        download_name=download_name
+    )
+
+
 @app.route("/admin/semester/report")
 @login_required(role="admin")
 def semester_report_pdf():
 
     sem = request.args.get("semester")
     rtype = request.args.get("type", "all")
-    branch = session.get("admin_branch")
+    names = dept_names(session.get("admin_branch") or "")
 
     conn = get_db()
 
-    query = """
-        SELECT name, roll_no, registration_no,
+    query = f"""
+        SELECT name, roll_no, registration_no, semester,
                COALESCE(status,'active') as status
         FROM users
         WHERE role='student'
-        AND department LIKE ?
+        AND college_id = ?
+        AND department IN ({in_params(names)})
     """
-    params = [f"%{branch}%"]
+    params = [current_college_id()] + names
 
     if rtype == "active":
         query += " AND semester=? AND COALESCE(status,'active')='active'"
@@ -2014,45 +4733,260 @@ def semester_report_pdf():
     elif rtype == "passout":
         query += " AND status='passout'"
 
-    elif rtype == "all":
+    elif rtype in ("promoted", "yearback"):
+        # students moved out of / held back in sem by an action not undone
+        query += """
+            AND id IN (
+                SELECT i.student_id
+                FROM semester_log_items i
+                JOIN semester_logs l ON l.id = i.log_id
+                WHERE l.action=? AND l.from_sem=? AND l.undone_at IS NULL
+            )
+        """
+        params += ["promote" if rtype == "promoted" else "yearback", sem]
+
+    else:
+        rtype = "all"
         query += " AND semester=?"
         params.append(sem)
 
-    students = conn.execute(query, params).fetchall()
-    conn.close()
+    query += " ORDER BY roll_no"
 
-    # ---- PDF ----
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas
-    import tempfile
+    try:
+        return pdf_table_report(
+            f"Semester {sem} {rtype.upper()} Students",
+            [
+                ("Name", 190, lambda r: r["name"]),
+                ("Roll No", 70, lambda r: r["roll_no"]),
+                ("Registration No", 120, lambda r: r["registration_no"]),
+                ("Semester", 50, lambda r: r["semester"]),
+                ("Status", 85, lambda r: r["status"]),
+            ],
+            iter_rows(conn.execute(query, params)),
+            f"{rtype}_semester_{sem}.pdf"
+        )
+    finally:
+        conn.close()
 
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    c = canvas.Canvas(tmp.name, pagesize=A4)
 
-    y = 800
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y, f"Semester {sem} {rtype.upper()} Students")
-    y -= 30
+# ----------------- SUPPORT CHAT -----------------
+# A thread is all support_messages of one student. Pages render once and
+# then follow an SSE stream that only sends messages after the last id
+# the browser has (EventSource resends it as Last-Event-ID). Read state
+# is one cursor row per thread (support_read_cursors) and is only
+# written when it moves.
+#
+# An open stream holds its worker thread for up to SUPPORT_STREAM_TIMEOUT
+# and the browser reconnects right after, so on gunicorn's default sync
+# worker one chat tab pins one worker. At most SUPPORT_MAX_STREAMS stay
+# open per process; any other stream sends what is new and ends at once
+# with a SUPPORT_FALLBACK_RETRY hint → the page short-polls. The default
+# 0 is right for sync workers. For live streams run a threaded worker,
+# e.g. `gunicorn -k gthread --threads 8 app:app`, and keep
+# SUPPORT_MAX_STREAMS well below --threads.
+SUPPORT_STREAM_TIMEOUT = int(os.environ.get("SUPPORT_STREAM_TIMEOUT", "25"))
+SUPPORT_POLL_INTERVAL = float(os.environ.get("SUPPORT_POLL_INTERVAL", "1"))
+SUPPORT_MAX_STREAMS = int(os.environ.get("SUPPORT_MAX_STREAMS", "0"))
+SUPPORT_FALLBACK_RETRY = float(os.environ.get("SUPPORT_FALLBACK_RETRY", "5"))
+SUPPORT_SENDERS = ("student", "admin")
+
+# wakes streams in this worker at once; other workers see it on next poll
+support_events = threading.Condition()
+support_stream_slots = threading.BoundedSemaphore(max(SUPPORT_MAX_STREAMS, 1))
+
+
+def support_read_ids(conn, student_id):
+    """(student_read_id, admin_read_id) of a thread."""
+    row = conn.execute("""
+        SELECT student_read_id, admin_read_id
+        FROM support_read_cursors
+        WHERE student_id = ?
+    """, (student_id,)).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
 
-    c.setFont("Helvetica", 10)
 
-    for s in students:
-        c.drawString(50, y, s["name"])
-        c.drawString(200, y, s["roll_no"])
-        c.drawString(280, y, s["registration_no"] or "")
-        c.drawString(420, y, s["status"])
-        y -= 15
-        if y < 50:
-            c.showPage()
-            y = 800
+def support_messages_after(conn, student_id, after_id=0):
+    return conn.execute("""
+        SELECT id, sender, message, created_at
+        FROM support_messages
+        WHERE student_id = ? AND id > ?
+        ORDER BY id
+    """, (student_id, after_id)).fetchall()
 
-    c.save()
 
-    return send_file(
-        tmp.name,
-        as_attachment=True,
-        download_name=f"{rtype}_semester_{sem}.pdf"
+def support_message_json(m, read_ids):
+    # seen = the other side's cursor has passed this message
+    other_read = read_ids[1] if m["sender"] == "student" else read_ids[0]
+    return {
+        "id": m["id"],
+        "sender": m["sender"],
+        "message": m["message"],
+        "created_at": m["created_at"],
+        "seen": 1 if m["id"] <= other_read else 0
+    }
+
+
+def mark_support_read(conn, student_id, reader, messages, read_ids):
+    """Move reader's cursor past the other side's messages, if it moved."""
+    last = max(
+        (m["id"] for m in messages if m["sender"] != reader),
+        default=0
+    )
+    current = read_ids[0] if reader == "student" else read_ids[1]
+    if last <= current:
+        return read_ids
+
+    column = f"{reader}_read_id"   # reader is one of SUPPORT_SENDERS
+    conn.execute(f"""
+        INSERT INTO support_read_cursors (student_id, {column})
+        VALUES (?, ?)
+        ON CONFLICT(student_id)
+        DO UPDATE SET {column} = MAX({column}, excluded.{column})
+    """, (student_id, last))
+
+    if reader == "admin":
+        # recount rather than zero: a message may have landed after `last`
+        conn.execute("""
+            UPDATE support_conversations
+            SET unread_by_admin = (
+                SELECT COUNT(*)
+                FROM support_messages
+                WHERE student_id = ? AND sender = 'student' AND id > ?
+            )
+            WHERE student_id = ?
+        """, (student_id, last, student_id))
+
+    conn.commit()
+
+    with support_events:
+        support_events.notify_all()
+
+    return (last, read_ids[1]) if reader == "student" else (read_ids[0], last)
+
+
+def post_support_message(conn, student_id, sender, message):
+    row = conn.execute("""
+        INSERT INTO support_messages (student_id, college_id, sender, message)
+        VALUES (?1, (SELECT college_id FROM users WHERE id = ?1), ?2, ?3)
+        RETURNING id, sender, message, created_at
+    """, (student_id, sender, message)).fetchone()
+
+    # inbox row: latest message + unread counter, same transaction
+    conn.execute("""
+        INSERT INTO support_conversations
+        (student_id, college, college_id, department, last_message_id,
+         last_message_at, last_preview, last_sender, unread_by_admin)
+        SELECT id, college, college_id, department, ?, ?, ?, ?, ?
+        FROM users
+        WHERE id = ?
+        ON CONFLICT(student_id) DO UPDATE SET
+            college = excluded.college,
+            college_id = excluded.college_id,
+            department = excluded.department,
+            last_message_id = excluded.last_message_id,
+            last_message_at = excluded.last_message_at,
+            last_preview = excluded.last_preview,
+            last_sender = excluded.last_sender,
+            unread_by_admin = unread_by_admin + excluded.unread_by_admin
+    """, (
+        row["id"],
+        row["created_at"],
+        row["message"][:SUPPORT_PREVIEW_CHARS],
+        sender,
+        1 if sender == "student" else 0,
+        student_id
+    ))
+    conn.commit()
+
+    with support_events:
+        support_events.notify_all()
+
+    return row
+
+
+def support_thread(conn, student_id, reader):
+    """Whole thread for a page render; marks it read for reader."""
+    messages = support_messages_after(conn, student_id)
+    read_ids = mark_support_read(
+        conn, student_id, reader, messages, support_read_ids(conn, student_id)
+    )
+    return [support_message_json(m, read_ids) for m in messages]
+
+
+def support_stream(pool, student_id, reader, after_id):
+    """SSE body: new messages as `message` events, cursor moves as `read`."""
+    # taken on first iteration → released in finally even on disconnect
+    live = SUPPORT_MAX_STREAMS > 0 and support_stream_slots.acquire(blocking=False)
+    retry = SUPPORT_POLL_INTERVAL if live else SUPPORT_FALLBACK_RETRY
+    conn = pool.acquire()
+    deadline = time.monotonic() + (SUPPORT_STREAM_TIMEOUT if live else 0)
+    sent_read_ids = None
+
+    try:
+        yield f"retry: {int(retry * 1000)}\n\n"
+
+        while True:
+            messages = support_messages_after(conn, student_id, after_id)
+            read_ids = support_read_ids(conn, student_id)
+
+            if messages:
+                # the page is open → whatever reaches it is read
+                read_ids = mark_support_read(
+                    conn, student_id, reader, messages, read_ids
+                )
+                for m in messages:
+                    data = json.dumps(support_message_json(m, read_ids))
+                    yield f"id: {m['id']}\nevent: message\ndata: {data}\n\n"
+                after_id = messages[-1]["id"]
+
+            if read_ids != sent_read_ids:
+                data = json.dumps({
+                    "student_read_id": read_ids[0],
+                    "admin_read_id": read_ids[1]
+                })
+                yield f"event: read\ndata: {data}\n\n"
+                sent_read_ids = read_ids
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            with support_events:
+                support_events.wait(min(SUPPORT_POLL_INTERVAL, remaining))
+    finally:
+        pool.release(conn)
+        if live:
+            support_stream_slots.release()
+
+
+def support_stream_response(student_id, reader):
+    after_id = (
+        request.headers.get("Last-Event-ID", type=int)
+        or request.args.get("after", 0, type=int)
     )
+    response = app.response_class(
+        support_stream(get_pool(request_shard()), student_id, reader, after_id),
+        mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"   # nginx: do not buffer
+    return response
+
+
+def support_send_json(student_id, sender, field):
+    data = request.get_json(silent=True) or request.form
+    msg = (data.get(field) or "").strip()
+    if not msg:
+        return jsonify({"success": False, "error": "Message cannot be empty"}), 400
+
+    conn = get_db()
+    row = post_support_message(conn, student_id, sender, msg)
+    conn.close()
+
+    return jsonify({
+        "success": True,
+        "message": support_message_json(row, (0, 0))
+    })
 
 
 # ----------------- STUDENT SUPPORT (SEND MESSAGE + VIEW REPLY) -----------------
@@ -2063,61 +4997,73 @@ def student_support():
     conn = get_db()
     student_id = session["user_id"]
 
-    # mark admin messages as seen
-    conn.execute("""
-        UPDATE support_messages
-        SET seen = 1
-        WHERE student_id = ? AND sender = 'admin'
-    """, (student_id,))
-    conn.commit()
-
+    # plain form post (no JS) → same insert as the JSON endpoint
     if request.method == "POST":
         msg = request.form.get("content", "").strip()
         if not msg:
             flash("Message cannot be empty", "danger")
             return redirect(url_for("student_support"))
 
-        conn.execute("""
-            INSERT INTO support_messages (student_id, sender, message)
-            VALUES (?, 'student', ?)
-        """, (student_id, msg))
-        conn.commit()
-
+        post_support_message(conn, student_id, "student", msg)
         return redirect(url_for("student_support"))
 
-    messages = conn.execute("""
-        SELECT * FROM support_messages
-        WHERE student_id = ?
-        ORDER BY created_at ASC
-    """, (student_id,)).fetchall()
+    messages = support_thread(conn, student_id, "student")
 
     conn.close()
     return render_template("student_support.html", messages=messages)
 
 
+@app.route("/student/support/send", methods=["POST"])
+@login_required(role="student")
+def student_support_send():
+    return support_send_json(session["user_id"], "student", "content")
+
+
+@app.route("/student/support/stream")
+@login_required(role="student")
+def student_support_stream():
+    return support_stream_response(session["user_id"], "student")
+
+
 # ----------------- ADMIN SUPPORT (VIEW + REPLY) -----------------
 @app.route("/admin/support")
 @login_required(role="admin")
 def admin_support():
     conn = get_db()
 
-    students = conn.execute("""
+    # 📥 inbox of this admin's college + branch, newest thread first
+    branch_names = dept_names(session.get("admin_branch", "") or "")
+
+    students = conn.execute(f"""
         SELECT
             u.id,
             u.name,
             u.semester,
             u.registration_no,
-            COUNT(sm.id) AS unread
-        FROM users u
-        JOIN support_messages sm ON sm.student_id = u.id
-        WHERE u.role='student'
-        GROUP BY u.id
-        ORDER BY MAX(sm.created_at) DESC
-    """).fetchall()
+            sc.unread_by_admin AS unread,
+            sc.last_preview,
+            sc.last_sender,
+            sc.last_message_at
+        FROM support_conversations sc
+        JOIN users u ON u.id = sc.student_id
+        WHERE sc.college_id = ?
+          AND sc.department IN ({in_params(branch_names)})
+        ORDER BY sc.last_message_id DESC
+    """, [current_college_id()] + branch_names).fetchall()
 
     conn.close()
     return render_template("admin_support.html", students=students)
 
+def college_student(conn, student_id):
+    """The student if they belong to the admin's college, else None."""
+    scope, params = college_scope()
+    return conn.execute(f"""
+        SELECT id, name, semester, registration_no
+        FROM users
+        WHERE id = ? AND role = 'student' AND {scope}
+    """, [student_id] + params).fetchone()
+
+
 @app.route("/admin/support/reply/<int:student_id>", methods=["POST"])
 @login_required(role="admin")
 def admin_support_reply(student_id):
@@ -2126,46 +5072,43 @@ def admin_support_reply(student_id):
         return redirect(url_for("admin_support_chat", student_id=student_id))
 
     conn = get_db()
-    conn.execute("""
-        INSERT INTO support_messages (student_id, sender, message)
-        VALUES (?, 'admin', ?)
-    """, (student_id, reply))
-    conn.commit()
+    if college_student(conn, student_id):
+        post_support_message(conn, student_id, "admin", reply)
     conn.close()
 
     return redirect(url_for("admin_support_chat", student_id=student_id))
 
 
+@app.route("/admin/support/<int:student_id>/send", methods=["POST"])
+@login_required(role="admin")
+def admin_support_send(student_id):
+    if not college_student(get_db(), student_id):
+        return jsonify({"success": False, "error": "Student not found"}), 404
+    return support_send_json(student_id, "admin", "reply")
+
+
+@app.route("/admin/support/<int:student_id>/stream")
+@login_required(role="admin")
+def admin_support_stream(student_id):
+    if not college_student(get_db(), student_id):
+        return "Student not found", 404
+    return support_stream_response(student_id, "admin")
+
+
 # ----------------- ADMIN SEND REPLY -----------------
 @app.route("/admin/support/<int:student_id>")
 @login_required(role="admin")
 def admin_support_chat(student_id):
     conn = get_db()
 
-    student = conn.execute("""
-        SELECT id, name, semester, registration_no
-        FROM users
-        WHERE id = ? AND role = 'student'
-    """, (student_id,)).fetchone()
+    student = college_student(conn, student_id)
 
     if not student:
         conn.close()
         flash("Student not found", "danger")
         return redirect(url_for("admin_support"))
 
-    messages = conn.execute("""
-        SELECT * FROM support_messages
-        WHERE student_id = ?
-        ORDER BY created_at ASC
-    """, (student_id,)).fetchall()
-
-    # mark student messages seen
-    conn.execute("""
-        UPDATE support_messages
-        SET seen = 1
-        WHERE student_id = ? AND sender = 'student'
-    """, (student_id,))
-    conn.commit()
+    messages = support_thread(conn, student_id, "admin")
 
     conn.close()
     return render_template(
@@ -2180,9 +5123,10 @@ def admin_support_chat(student_id):
 @app.route("/admin/users")
 @login_required(role="admin")
 def admin_users():
-    branch = session.get("admin_branch", "") or ""
+    names = dept_names(session.get("admin_branch") or "")
+    scope, params = college_scope()
     conn = get_db()
-    users = conn.execute("""
+    users = conn.execute(f"""
     SELECT 
         id,
         name,
@@ -2194,17 +5138,19 @@ def admin_users():
         parent_email
     FROM users
     WHERE role='student'
-      AND department LIKE ?
+      AND {scope}
+      AND department IN ({in_params(names)})
     ORDER BY id DESC
-""", (f"{branch}%",)).fetchall()
+""", params + names).fetchall()
 
     return render_template("admin_users.html", users=users)
 
 @app.route("/admin/user/<int:uid>/edit", methods=["GET", "POST"])
 @login_required(role="admin")
 def edit_user(uid):
+    scope, params = college_scope()
     conn = get_db()
-    user = conn.execute("SELECT * FROM users WHERE id=?", (uid,)).fetchone()
+    user = conn.execute(f"SELECT * FROM users WHERE id=? AND {scope}", [uid] + params).fetchone()
     if not user:
         conn.close()
         flash("User not found!", "danger")
@@ -2216,66 +5162,495 @@ def edit_user(uid):
         department = request.form.get("department", "")
         roll_no = request.form.get("roll_no", "")
         conn.execute("UPDATE users SET name=?, email=?, department=?, roll_no=? WHERE id=?", (name, email, department, roll_no, uid))
+        conn.execute("UPDATE support_conversations SET department=? WHERE student_id=?", (department, uid))
+        invalidate_leave_stats(conn)
         conn.commit()
         conn.close()
+        invalidate_profiles()
         flash("User Updated Successfully!", "success")
         return redirect(url_for("admin_users"))
 
-    conn.close()
-    return render_template("edit_user.html", user=user)
+    conn.close()
+    return render_template("edit_user.html", user=user)
+
+@app.route("/admin/user/<int:uid>/delete")
+@login_required(role="admin")
+def admin_delete_user(uid):
+    scope, params = college_scope()
+    conn = get_db()
+    conn.execute(f"DELETE FROM users WHERE id=? AND {scope}", [uid] + params)
+    invalidate_leave_stats(conn)
+    conn.commit()
+    conn.close()
+    invalidate_profiles()
+    flash("Student Deleted!", "warning")
+    return redirect(url_for("admin_users"))
+
+
+@app.route("/admin/user/<int:uid>/reset-password")
+@login_required(role="admin")
+def admin_reset_password(uid):
+    scope, params = college_scope()
+    conn = get_db()
+    user = conn.execute(f"SELECT * FROM users WHERE id=? AND {scope}", [uid] + params).fetchone()
+    if not user:
+        conn.close()
+        flash("User not found!", "danger")
+        return redirect(url_for("admin_users"))
+
+    new_pass = new_password()
+    try:
+        set_password(conn, uid, new_pass)
+    except FutureTimeout:
+        conn.close()
+        flash("Server busy, please try again in a moment.", "warning")
+        return redirect(url_for("admin_users"))
+    conn.commit()
+    conn.close()
+
+    flash(f"New password for {user['name']} is: {new_pass}", "success")
+    return redirect(url_for("admin_users"))
+
+
+# ---------------- ADMIN ATTENDANCE / EXPORT ----------------
+# Subjects department mapping
+SUBJECT_DEPT_MAP = {
+    "CSE": "CSE",
+    "CSE (Network)": "CSE",
+    "CSE (Cyber Security)": "CSE",
+    "CSE (Cybersecurity)": "CSE",
+
+    "Civil": "Civil",
+    "Civil Engineering": "Civil",
+    "CE": "Civil",
+
+   "Mechanical": "Mechanical",
+    "Mechanical Engineering": "Mechanical",
+    "ME": "Mechanical",
+
+    "Electrical": "EE",
+    "EE": "EE",
+
+    "Electronics": "ECE",
+    "ECE": "ECE"
+}
+import re
+
+
+def attendance_report_rows(conn, college_id, branch, semester=None, subject_id=None,
+                           date=None, month=None):
+    """
+    Attendance rows for a college's branch with each student's overall %
+    in that subject. Totals are aggregated once per (student, subject) in
+    a CTE instead of two correlated COUNT(*) subqueries per output row.
+    """
+    params = [college_id, branch]
+    totals_filter = ""
+    if subject_id:
+        totals_filter = " AND a.subject_id = ?"
+        params.append(int(subject_id))
+
+    query = f"""
+        WITH totals AS (
+            SELECT
+                a.student_id,
+                a.subject_id,
+                SUM(CASE WHEN a.status='Present' THEN 1 ELSE 0 END) AS present,
+                COUNT(*) AS total
+            FROM users u
+            JOIN attendance a ON a.student_id = u.id
+            WHERE u.college_id = ? AND u.department = ?{totals_filter}
+            GROUP BY a.student_id, a.subject_id
+        )
+        SELECT
+            u.name,
+            u.roll_no,
+            u.registration_no,
+            s.name AS subject,
+            a.date,
+            a.status,
+            ROUND(t.present * 100.0 / t.total, 2) AS percentage
+
+        FROM attendance a
+        JOIN users u ON u.id = a.student_id
+        JOIN subjects s ON s.id = a.subject_id
+        JOIN totals t
+          ON t.student_id = a.student_id
+         AND t.subject_id = a.subject_id
+        WHERE u.college_id = ? AND u.department = ?
+    """
+    params += [college_id, branch]
+
+    if semester:
+        query += " AND a.semester = ?"
+        params.append(int(semester))
+
+    if subject_id:
+        query += " AND a.subject_id = ?"
+        params.append(int(subject_id))
+
+    if date:
+        query += " AND a.date = ?"
+        params.append(date)
+
+    if month:
+        query += " AND a.date >= ? AND a.date < ?"
+        params += month_bounds(month)
+
+    query += " ORDER BY u.roll_no, a.date"
+
+    return conn.execute(query, params)
+
+
+ATTENDANCE_STATUSES = ("Present", "Absent")
+
+
+def build_attendance_batch(form, students, subject_id, semester):
+    """
+    Validate the whole attendance form before anything is written.
+    Returns (records, error); records are rows for save_attendance().
+    """
+    date = (form.get("date") or "").strip()
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        return [], "Please select a valid date!"
+
+    if not semester:
+        return [], "Please select semester first!"
+
+    records = []
+    for s in students:
+        status = form.get(f"status_{s['id']}")
+        if not status:
+            continue
+        if status not in ATTENDANCE_STATUSES:
+            return [], f"Invalid status for {s['name']}!"
+        records.append((s["id"], subject_id, semester, date, status))
+
+    if not records:
+        return [], "No attendance marked!"
+
+    return records, None
+
+
+def save_attendance(conn, records):
+    """
+    Write (student_id, subject_id, semester, date, status) rows in one
+    transaction. Saving the same student/subject/date again updates
+    the status instead of inserting a duplicate.
+    Anything already pending on conn is committed with it.
+    attendance_summary is moved by the same rows in the same transaction.
+    """
+    records = list(records)
+    try:
+        # the rows being replaced must not change under us before the
+        # upsert → take the write lock before reading them
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+
+        deltas = attendance_summary_deltas(conn, records)
+
+        conn.executemany("""
+            INSERT INTO attendance
+            (student_id, college_id, subject_id, semester, date, status)
+            VALUES (?1, (SELECT college_id FROM users WHERE id = ?1), ?2, ?3, ?4, ?5)
+            ON CONFLICT(student_id, subject_id, date)
+            DO UPDATE SET status = excluded.status,
+                          semester = excluded.semester
+        """, records)
+        apply_attendance_summary_deltas(conn, deltas)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+# ---------------- ATTENDANCE SUMMARY ----------------
+# attendance_summary holds total/present per (student, subject, semester)
+# so dashboards and reports read one row per subject instead of
+# aggregating the whole attendance history on every request.
+
+def attendance_summary_deltas(conn, records):
+    """
+    {(student_id, subject_id, semester): [total, present]} change that
+    upserting records makes, from the attendance rows they replace.
+    Must run before the upsert, inside the same write transaction.
+    """
+    current = {}
+    deltas = {}
+
+    def move(student_id, subject_id, semester, status, sign):
+        d = deltas.setdefault((student_id, subject_id, semester), [0, 0])
+        d[0] += sign
+        d[1] += sign if status == "Present" else 0
+
+    for student_id, subject_id, semester, date, status in records:
+        key = (student_id, subject_id, date)
+        if key not in current:
+            current[key] = conn.execute("""
+                SELECT semester, status
+                FROM attendance
+                WHERE student_id=? AND subject_id=? AND date=?
+            """, key).fetchone()
+
+        old = current[key]
+        if old:
+            move(student_id, subject_id, old[0], old[1], -1)
+        move(student_id, subject_id, semester, status, +1)
+
+        # same student/subject/date twice in one batch → last one wins
+        current[key] = (semester, status)
+
+    return {k: d for k, d in deltas.items() if d != [0, 0]}
+
+
+def apply_attendance_summary_deltas(conn, deltas):
+    conn.executemany("""
+        INSERT INTO attendance_summary
+        (student_id, subject_id, semester, total, present)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(student_id, subject_id, semester)
+        DO UPDATE SET total = total + excluded.total,
+                      present = present + excluded.present
+    """, [key + tuple(d) for key, d in deltas.items()])
+
+    # a re-save that moved the last row to another semester
+    conn.executemany("""
+        DELETE FROM attendance_summary
+        WHERE student_id=? AND subject_id=? AND semester=? AND total=0
+    """, [key for key, d in deltas.items() if d[0] < 0])
+
+
+def diff_attendance_summary(conn):
+    """
+    Compare attendance_summary with a full recount.
+    Returns [(kind, student_id, subject_id, semester, total, present)]:
+    "expected" rows are missing or wrong in the summary, "found" rows
+    are what the summary holds instead.
+    """
+    return conn.execute(f"""
+        WITH fresh AS (
+            {ATTENDANCE_COUNTS_SQL}
+            GROUP BY student_id, subject_id, semester
+        ),
+        stored AS (
+            SELECT student_id, subject_id, semester, total, present
+            FROM attendance_summary
+        )
+        SELECT 'expected', * FROM (SELECT * FROM fresh EXCEPT SELECT * FROM stored)
+        UNION ALL
+        SELECT 'found', * FROM (SELECT * FROM stored EXCEPT SELECT * FROM fresh)
+        ORDER BY 2, 3, 4, 1
+    """).fetchall()
+
+
+@app.cli.command("rebuild-attendance-summary")
+def rebuild_attendance_summary_command():
+    """Recompute attendance_summary from the raw attendance rows."""
+    conn = get_db()
+    rebuild_attendance_summary(conn)
+    conn.commit()
+    count = conn.execute("SELECT COUNT(*) FROM attendance_summary").fetchone()[0]
+    conn.close()
+    print(f"attendance_summary rebuilt: {count} row(s)")
+
+
+@app.cli.command("check-attendance-summary")
+def check_attendance_summary_command():
+    """Diff attendance_summary against a full recount (exit 1 on drift)."""
+    conn = get_db()
+    diff = diff_attendance_summary(conn)
+    conn.close()
+
+    for kind, student_id, subject_id, semester, total, present in diff:
+        print(f"{kind:8}  student={student_id} subject={subject_id} "
+              f"semester={semester} total={total} present={present}")
+
+    if diff:
+        print("Run `flask rebuild-attendance-summary` to repair")
+        raise SystemExit(1)
+    print("attendance_summary matches the attendance table")
+
+
+# ---------------- STUDENT IMPORT ----------------
+# Roll lists are parsed page by page (PDF) or row by row (XLSX) into
+# (registration_no, name) records and staged in student_imports. The
+# preview diffs them against users in one join on idx_reg_college;
+# confirm writes new and changed students with one upsert.
+
+IMPORT_RECORD_RE = re.compile(r"(\d{10,})\s+([A-Za-z][A-Za-z .]*)")
+IMPORT_EMAIL_DOMAIN = os.environ.get("IMPORT_EMAIL_DOMAIN", "students.invalid")
+IMPORT_PREVIEW_ROWS = int(os.environ.get("IMPORT_PREVIEW_ROWS", "200"))
+IMPORT_STAGING_HOURS = 24
+
+
+def clean_import_name(name):
+    """' MD  FAIYAJ ALAM. ' → 'MD FAIYAJ ALAM.'"""
+    return " ".join((name or "").split())
 
-@app.route("/admin/user/<int:uid>/delete")
-@login_required(role="admin")
-def admin_delete_user(uid):
-    conn = get_db()
-    conn.execute("DELETE FROM users WHERE id=?", (uid,))
-    conn.commit()
-    conn.close()
-    flash("Student Deleted!", "warning")
-    return redirect(url_for("admin_users"))
 
+def import_records_from_text(text):
+    for reg, name in IMPORT_RECORD_RE.findall(text):
+        name = clean_import_name(name)
+        if name:
+            yield reg, name
 
-@app.route("/admin/user/<int:uid>/reset-password")
-@login_required(role="admin")
-def admin_reset_password(uid):
-    conn = get_db()
-    user = conn.execute("SELECT * FROM users WHERE id=?", (uid,)).fetchone()
-    if not user:
-        conn.close()
-        flash("User not found!", "danger")
-        return redirect(url_for("admin_users"))
 
-    new_pass = "pass" + str(random.randint(1000, 9999))
-    conn.execute("UPDATE users SET password=? WHERE id=?", (new_pass, uid))
+def iter_roll_pdf(file):
+    import pdfplumber
+
+    with pdfplumber.open(file) as pdf:
+        for page in pdf.pages:
+            yield from import_records_from_text(page.extract_text() or "")
+            # pdfplumber keeps every parsed page's objects otherwise
+            page.close()
+
+
+def iter_roll_xlsx(file):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            for row in ws.iter_rows(values_only=True):
+                cells = [
+                    str(int(v)) if isinstance(v, float) and v.is_integer() else str(v)
+                    for v in row if v is not None
+                ]
+                yield from import_records_from_text(" ".join(cells))
+    finally:
+        wb.close()
+
+
+def stage_student_import(conn, admin_id, college, department, semester,
+                         filename, records):
+    """Dedupe records by reg number (first one wins) and stage them."""
+    seen = {}
+    duplicates = 0
+    for reg, name in records:
+        if reg in seen:
+            duplicates += 1
+        else:
+            seen[reg] = name
+
+    conn.execute(
+        "DELETE FROM student_imports WHERE created_at < datetime('now', ?)",
+        (f"-{IMPORT_STAGING_HOURS} hours",)
+    )
+    import_id = conn.execute("""
+        INSERT INTO student_imports
+        (admin_id, college, department, semester, filename, records, duplicates)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        RETURNING id
+    """, (
+        admin_id, college, department, semester, filename,
+        json.dumps(list(seen.items())), duplicates
+    )).fetchone()[0]
     conn.commit()
-    conn.close()
+    return import_id
 
-    flash(f"New password for {user['name']} is: {new_pass}", "success")
-    return redirect(url_for("admin_users"))
 
+def get_student_import(conn, import_id, admin_id):
+    return conn.execute(
+        "SELECT * FROM student_imports WHERE id=? AND admin_id=?",
+        (import_id, admin_id)
+    ).fetchone()
 
-# ---------------- ADMIN ATTENDANCE / EXPORT ----------------
-# Subjects department mapping
-SUBJECT_DEPT_MAP = {
-    "CSE": "CSE",
-    "CSE (Network)": "CSE",
-    "CSE (Cyber Security)": "CSE",
 
-    "Civil": "Civil",
-    "CE": "Civil",
+def student_import_diff(conn, imp):
+    """
+    Split staged records into new / unchanged / update / conflict.
+    conflict: the reg number belongs to someone with another name or to a
+    non-student, or a new student's placeholder email is already taken.
+    """
+    rows = conn.execute("""
+        WITH incoming AS (
+            SELECT json_extract(value, '$[0]') AS reg,
+                   json_extract(value, '$[1]') AS name
+            FROM json_each(?)
+        )
+        SELECT i.reg, i.name,
+               u.id AS user_id, u.name AS current_name, u.role,
+               u.department, u.semester,
+               e.id AS email_owner
+        FROM incoming i
+        LEFT JOIN users u
+          ON u.college_id = ? AND u.registration_no = i.reg
+        LEFT JOIN users e
+          ON u.id IS NULL AND e.email = i.reg || '@' || ? AND e.college = ?
+        ORDER BY i.reg
+    """, (
+        imp["records"], college_id_for(conn, imp["college"]),
+        IMPORT_EMAIL_DOMAIN, imp["college"]
+    )).fetchall()
 
-   "Mechanical": "Mechanical",
-    "Mechanical Engineering": "Mechanical",
-    "ME": "Mechanical",
+    diff = {"new": [], "unchanged": [], "update": [], "conflict": []}
+
+    for r in rows:
+        if r["user_id"] is None:
+            kind = "conflict" if r["email_owner"] else "new"
+        elif (
+            r["role"] != "student"
+            or clean_import_name(r["current_name"]).upper() != r["name"].upper()
+        ):
+            kind = "conflict"
+        elif (
+            r["department"] == imp["department"]
+            # users.semester is TEXT in init_db.py schemas, INTEGER here
+            and str(r["semester"]) == str(imp["semester"])
+        ):
+            kind = "unchanged"
+        else:
+            kind = "update"
+        diff[kind].append(r)
 
-    "Electrical": "EE",
-    "EE": "EE",
+    return diff
+
+
+def apply_student_import(conn, imp):
+    """Write new and update rows in one upsert; conflicts are left alone."""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+
+    try:
+        # users may have changed since the preview → diff again under the lock
+        diff = student_import_diff(conn, imp)
+        payload = json.dumps([
+            [r["reg"], r["name"]] for r in diff["new"] + diff["update"]
+        ])
+
+        conn.execute("""
+            INSERT INTO users
+            (name, email, password, role, department, semester,
+             registration_no, college, college_id)
+            SELECT json_extract(value, '$[1]'),
+                   json_extract(value, '$[0]') || '@' || ?,
+                   '!' || lower(hex(randomblob(8))),
+                   'student', ?, ?,
+                   json_extract(value, '$[0]'),
+                   ?, ?
+            FROM json_each(?)
+            WHERE 1
+            ON CONFLICT (college_id, registration_no) DO UPDATE
+            SET department = excluded.department,
+                semester = excluded.semester
+            WHERE users.role = 'student'
+        """, (
+            IMPORT_EMAIL_DOMAIN, imp["department"], imp["semester"],
+            imp["college"], college_id_for(conn, imp["college"]), payload
+        ))
+
+        conn.execute("DELETE FROM student_imports WHERE id=?", (imp["id"],))
+        conn.commit()
+        invalidate_profiles()
+        return {k: len(v) for k, v in diff.items()}
+
+    except sqlite3.Error:
+        conn.rollback()
+        raise
 
-    "Electronics": "ECE",
-    "ECE": "ECE"
-}
-import pdfplumber
-import re
 
 @app.route("/admin/attendance-upload", methods=["GET","POST"])
 @login_required(role="admin")
@@ -2283,62 +5658,88 @@ def admin_attendance_upload():
 
     if request.method == "POST":
 
-        semester = request.form.get("semester")
+        semester = request.form.get("semester", type=int)
         branch = request.form.get("branch")
         file = request.files.get("file")
+        college = session.get("college")
 
         if not file:
             flash("No file uploaded", "danger")
             return redirect(url_for("admin_attendance_upload"))
 
-        text = ""
+        if not college:
+            flash("Select your college again before importing", "danger")
+            return redirect(url_for("admin_attendance_upload"))
+
+        if (
+            not semester or not branch
+            or dept_key(branch) != dept_key(session.get("admin_branch") or "")
+        ):
+            flash("Choose a branch and semester of your department", "danger")
+            return redirect(url_for("admin_attendance_upload"))
 
-        if file.filename.endswith(".pdf"):
-            with pdfplumber.open(file) as pdf:
-                for page in pdf.pages:
-                    t = page.extract_text()
-                    if t:
-                        text += "\n" + t
+        if file.filename.lower().endswith(".pdf"):
+            records = iter_roll_pdf(file)
 
-        elif file.filename.endswith(".xlsx"):
-            import pandas as pd
-            df = pd.read_excel(file)
-            text = df.to_string()
+        elif file.filename.lower().endswith(".xlsx"):
+            records = iter_roll_xlsx(file)
 
         else:
             flash("Only PDF or Excel allowed", "danger")
             return redirect(url_for("admin_attendance_upload"))
 
-        # ---------- EXTRACT REG + NAME ----------
-        pattern = r"(\\d{10,})\\s+([A-Za-z .]+)"
-        matches = re.findall(pattern, text)
-
         conn = get_db()
+        import_id = stage_student_import(
+            conn, session["user_id"], college, branch, semester,
+            file.filename, records
+        )
+        conn.close()
 
-        count = 0
+        return redirect(url_for("admin_import_preview", import_id=import_id))
 
-        for reg, name in matches:
+    return render_template("admin_attendance_upload.html")
 
-            exists = conn.execute("""
-                SELECT id FROM users
-                WHERE registration_no=?
-            """, (reg,)).fetchone()
 
-            if not exists:
-                conn.execute("""
-                    INSERT INTO users
-                    (name, registration_no, role, department, semester)
-                    VALUES (?, ?, 'student', ?, ?)
-                """, (name.strip(), reg, branch, semester))
-                count += 1
+@app.route("/admin/attendance-upload/<int:import_id>", methods=["GET", "POST"])
+@login_required(role="admin")
+def admin_import_preview(import_id):
 
-        conn.commit()
+    conn = get_db()
+    imp = get_student_import(conn, import_id, session["user_id"])
+
+    if not imp:
+        conn.close()
+        flash("Import not found or already applied", "warning")
+        return redirect(url_for("admin_attendance_upload"))
+
+    if request.method == "POST":
+
+        if request.form.get("action") == "cancel":
+            conn.execute("DELETE FROM student_imports WHERE id=?", (import_id,))
+            conn.commit()
+            conn.close()
+            flash("Import discarded", "info")
+            return redirect(url_for("admin_attendance_upload"))
+
+        counts = apply_student_import(conn, imp)
         conn.close()
 
-        flash(f"{count} students imported successfully", "success")
+        msg = f"{counts['new']} students imported, {counts['update']} updated"
+        if counts["conflict"]:
+            msg += f", {counts['conflict']} conflicts skipped"
+        flash(msg, "success")
         return redirect(url_for("admin_users"))
 
-    return render_template("admin_attendance_upload.html")
+    diff = student_import_diff(conn, imp)
+    conn.close()
+
+    return render_template(
+        "admin_attendance_upload.html",
+        imp=imp,
+        counts={k: len(v) for k, v in diff.items()},
+        preview={k: v[:IMPORT_PREVIEW_ROWS] for k, v in diff.items()},
+        preview_limit=IMPORT_PREVIEW_ROWS
+    )
 
 
 @app.route("/admin/attendance", methods=["GET", "POST"])
@@ -2399,10 +5800,11 @@ def admin_attendance():
             SELECT id, name, roll_no, registration_no
             FROM users
             WHERE role='student'
+              AND college_id = ?
               AND department = ?
               AND semester = ?
            ORDER BY CAST(registration_no AS INTEGER) ASC
-        """, (student_dept, semester)).fetchall()
+        """, (current_college_id(), student_dept, semester)).fetchall()
 
     # ---------------- SAVE ATTENDANCE ----------------
     if request.method == "POST":
@@ -2412,24 +5814,20 @@ def admin_attendance():
             conn.close()
             return redirect(url_for("admin_attendance", semester=semester))
 
-        date = request.form.get("date")
-
-        for s in students:
-            status = request.form.get(f"status_{s['id']}")
-            if status:
-                conn.execute("""
-                    INSERT INTO attendance
-                    (student_id, subject_id, semester, date, status)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    s["id"],
-                    subject_id,
-                    semester,
-                    date,
-                    status
-                ))
+        records, error = build_attendance_batch(
+            request.form, students, subject_id, semester
+        )
 
-        conn.commit()
+        if error:
+            flash(error, "danger")
+            conn.close()
+            return redirect(url_for("admin_attendance",
+                semester=semester,
+                subject_id=subject_id,
+                sub_branch=sub_branch
+            ))
+
+        save_attendance(conn, records)
         conn.close()
         flash("Attendance saved successfully", "success")
         return redirect(url_for(  "admin_attendance",
@@ -2461,6 +5859,8 @@ def admin_attendance_records():
     semester = request.args.get("semester")
     subject_id = request.args.get("subject_id")
     date = request.args.get("date")
+    view = request.args.get("view", "list")     # list / register
+    month = request.args.get("month")
 
     # ---------- FINAL BRANCH ----------
     if admin_branch == "CSE":
@@ -2473,11 +5873,13 @@ def admin_attendance_records():
         return render_template(
             "admin_attendance_records.html",
             admin_branch=admin_branch,
+            view=view,
             records=[],
             subjects=[]
         )
 
     subject_dept = SUBJECT_DEPT_MAP.get(final_branch)
+    college_id = current_college_id()
 
     # ---------- SUBJECT LIST ----------
     subjects = []
@@ -2489,78 +5891,263 @@ def admin_attendance_records():
             ORDER BY name
         """, (subject_dept, semester)).fetchall()
 
-    # ---------- ATTENDANCE RECORDS WITH % ----------
-    query = """
-        SELECT
-            u.name,
-            u.roll_no,
-            u.registration_no,
-            s.name AS subject,
-            a.date,
-            a.status,
+    records = []
+    register_dates = []
+    register = []
 
-            ROUND(
-                (
-                    SELECT COUNT(*)
-                    FROM attendance a2
-                    WHERE a2.student_id = u.id
-                      AND a2.subject_id = a.subject_id
-                      AND a2.status = 'Present'
-                ) * 100.0
-                /
-                (
-                    SELECT COUNT(*)
-                    FROM attendance a3
-                    WHERE a3.student_id = u.id
-                      AND a3.subject_id = a.subject_id
-                ),
-            2) AS percentage
+    if view == "register":
+        # ---------- REGISTER: student × date for one month ----------
+        if not (month and MONTH_RE.match(month)):
+            month = attendance_last_month(
+                conn, college_id, final_branch, semester, subject_id
+            )
+        register_dates, rows = attendance_register(
+            conn, college_id, final_branch, semester, subject_id, None, month
+        )
+        register = list(rows)
+    else:
+        # ---------- ATTENDANCE RECORDS WITH % ----------
+        view = "list"
+        month = None
+        records = attendance_report_rows(
+            conn, college_id, final_branch, semester, subject_id, date
+        ).fetchall()
+    conn.close()
 
-        FROM attendance a
-        JOIN users u ON u.id = a.student_id
-        JOIN subjects s ON s.id = a.subject_id
-        WHERE u.department = ?
-    """
-    params = [final_branch]
+    return render_template(
+        "admin_attendance_records.html",
+        admin_branch=admin_branch,
+        sub_branch=sub_branch,
+        semester=semester,
+        subject_id=subject_id,
+        date=date,
+        subjects=subjects,
+        records=records,
+        view=view,
+        month=month,
+        prev_month=month and shift_month(month, -1),
+        next_month=month and shift_month(month, 1),
+        register_dates=register_dates,
+        register=register
+    )
+
+
+
+# ---------------- ATTENDANCE EXPORT ----------------
+# Rows go from the cursor straight into the file: an openpyxl write_only
+# sheet (each row is serialized on append, no cell objects are kept)
+# saved to an anonymous TemporaryFile, or a CSV body generated in
+# EXPORT_CSV_CHUNK sized pieces. layout=pivot is the register: one row
+# per student and subject, one P/A column per date, built by
+# attendance_register() which also feeds the register page.
+import csv
+import io
+import itertools
+
+EXPORT_CSV_CHUNK = int(os.environ.get("EXPORT_CSV_CHUNK", "65536"))
+EXPORT_FORMATS = ("xlsx", "csv")
+EXPORT_LAYOUTS = ("rows", "pivot")
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+MONTH_RE = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+
+def shift_month(month, delta):
+    """'2026-01', -1 → '2025-12'"""
+    y, m = divmod(int(month[:4]) * 12 + int(month[5:7]) - 1 + delta, 12)
+    return f"{y:04d}-{m + 1:02d}"
+
+
+def month_bounds(month):
+    """[first day, first day of next month) as ISO dates."""
+    return [f"{month}-01", f"{shift_month(month, 1)}-01"]
+
+
+def attendance_export_filter(college_id, branch, semester=None, subject_id=None,
+                             date=None, month=None):
+    """WHERE clause (over attendance a JOIN users u) and its params."""
+    where = ["u.college_id = ?", "u.department = ?"]
+    params = [college_id, branch]
 
     if semester:
-        query += " AND a.semester = ?"
+        where.append("a.semester = ?")
         params.append(int(semester))
 
     if subject_id:
-        query += " AND a.subject_id = ?"
+        where.append("a.subject_id = ?")
         params.append(int(subject_id))
 
     if date:
-        query += " AND a.date = ?"
+        where.append("a.date = ?")
         params.append(date)
 
-    query += " ORDER BY u.roll_no, a.date"
+    if month:
+        where.append("a.date >= ? AND a.date < ?")
+        params += month_bounds(month)
 
-    records = conn.execute(query, params).fetchall()
-    conn.close()
+    return " AND ".join(where), params
 
-    return render_template(
-        "admin_attendance_records.html",
-        admin_branch=admin_branch,
-        sub_branch=sub_branch,
-        semester=semester,
-        subject_id=subject_id,
-        date=date,
-        subjects=subjects,
-        records=records
+
+def attendance_export_exists(conn, *filters):
+    where, params = attendance_export_filter(*filters)
+    return conn.execute(f"""
+        SELECT 1
+        FROM attendance a
+        JOIN users u ON u.id = a.student_id
+        WHERE {where}
+        LIMIT 1
+    """, params).fetchone() is not None
+
+
+def attendance_last_month(conn, *filters):
+    """Latest month with attendance for the filters, else this month."""
+    where, params = attendance_export_filter(*filters)
+    last = conn.execute(f"""
+        SELECT MAX(a.date)
+        FROM attendance a
+        JOIN users u ON u.id = a.student_id
+        WHERE {where}
+    """, params).fetchone()[0]
+    return last[:7] if last else datetime.now().strftime("%Y-%m")
+
+
+def attendance_register(conn, *filters):
+    """
+    Student × date matrix in one ordered scan → (dates, rows).
+    rows lazily yields one dict per (student, subject); its marks string
+    has one char per date: P, A or " " (no class that day).
+    """
+    where, params = attendance_export_filter(*filters)
+
+    dates = [r[0] for r in conn.execute(f"""
+        SELECT DISTINCT a.date
+        FROM attendance a
+        JOIN users u ON u.id = a.student_id
+        WHERE {where}
+        ORDER BY a.date
+    """, params)]
+    column = {d: i for i, d in enumerate(dates)}
+
+    def rows():
+        cursor = conn.execute(f"""
+            SELECT u.id AS student_id, u.name, u.roll_no, u.registration_no,
+                   a.subject_id, s.name AS subject, a.date, a.status
+            FROM attendance a
+            JOIN users u ON u.id = a.student_id
+            JOIN subjects s ON s.id = a.subject_id
+            WHERE {where}
+            ORDER BY u.roll_no, u.id, s.name, a.subject_id
+        """, params)
+
+        for _, marks in itertools.groupby(
+            iter_rows(cursor), key=lambda r: (r["student_id"], r["subject_id"])
+        ):
+            cells = bytearray(b" " * len(dates))
+            present = total = 0
+
+            for r in marks:
+                is_present = r["status"] == "Present"
+                cells[column[r["date"]]] = ord("P") if is_present else ord("A")
+                present += is_present
+                total += 1
+
+            yield {
+                "name": r["name"],
+                "roll_no": r["roll_no"],
+                "registration_no": r["registration_no"],
+                "subject": r["subject"],
+                "marks": cells.decode(),
+                "present": present,
+                "total": total,
+                "percentage": round(present * 100 / total, 2)
+            }
+
+    return dates, rows()
+
+
+def attendance_pivot_rows(conn, *filters):
+    """Header, then one row per (student, subject): name..., P/A per date, totals."""
+    dates, rows = attendance_register(conn, *filters)
+
+    yield ["Student", "Roll", "Registration", "Subject"] + dates + [
+        "Present", "Total", "Percentage"
+    ]
+    for r in rows:
+        yield [r["name"], r["roll_no"], r["registration_no"], r["subject"]] + [
+            m.strip() for m in r["marks"]
+        ] + [r["present"], r["total"], r["percentage"]]
+
+
+def attendance_export_rows(conn, layout, *filters):
+    if layout == "pivot":
+        yield from attendance_pivot_rows(conn, *filters)
+        return
+
+    yield [
+        "Student", "Roll", "Registration", "Subject",
+        "Date", "Status", "Percentage"
+    ]
+    for r in iter_rows(attendance_report_rows(conn, *filters)):
+        yield tuple(r)
+
+
+def xlsx_response(sheet_title, rows, download_name):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    for row in rows:
+        ws.append(row)
+
+    tmp = tempfile.TemporaryFile(suffix=".xlsx")
+    try:
+        wb.save(tmp)
+        tmp.seek(0)
+    except BaseException:
+        tmp.close()
+        raise
+
+    return send_file(
+        tmp,
+        mimetype=XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=download_name
     )
 
 
+def csv_response(make_rows, download_name):
+    """make_rows(conn) is read on its own pooled connection while the body streams."""
+    pool = get_pool(request_shard())     # the body runs after the request
+
+    def generate():
+        conn = pool.acquire()
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+
+        try:
+            yield "\ufeff"     # BOM → Excel opens it as UTF-8
+            for row in make_rows(conn):
+                writer.writerow(row)
+                if buf.tell() >= EXPORT_CSV_CHUNK:
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+            yield buf.getvalue()
+        finally:
+            pool.release(conn)
+
+    return app.response_class(
+        generate(),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={download_name}"}
+    )
+
 
 @app.route("/admin/export/attendance/excel")
 @login_required(role="admin")
 def export_attendance_excel():
 
-    import pandas as pd
-    import tempfile
-    from flask import send_file, redirect, url_for, flash
-
     conn = get_db()
 
     admin_branch = session.get("admin_branch")
@@ -2569,6 +6156,16 @@ def export_attendance_excel():
     subject_id = request.args.get("subject_id")
     date = request.args.get("date")
     all_dates = request.args.get("all_dates")   # "1" or None
+    month = request.args.get("month")
+    fmt = request.args.get("format", "xlsx")
+    layout = request.args.get("layout", "rows")
+
+    if fmt not in EXPORT_FORMATS:
+        fmt = "xlsx"
+    if layout not in EXPORT_LAYOUTS:
+        layout = "rows"
+    if not (month and MONTH_RE.match(month)):
+        month = None
 
     # ---------- FINAL BRANCH ----------
     if admin_branch == "CSE":
@@ -2580,128 +6177,102 @@ def export_attendance_excel():
         flash("Please select branch", "danger")
         return redirect(url_for("admin_attendance_records"))
 
-    query = """
-        SELECT
-            u.name AS Student,
-            u.roll_no AS Roll,
-            u.registration_no AS Registration,
-            s.name AS Subject,
-            a.date AS Date,
-            a.status AS Status,
-
-            ROUND(
-                (
-                    SELECT COUNT(*)
-                    FROM attendance a2
-                    WHERE a2.student_id = u.id
-                      AND a2.subject_id = a.subject_id
-                      AND a2.status = 'Present'
-                ) * 100.0
-                /
-                (
-                    SELECT COUNT(*)
-                    FROM attendance a3
-                    WHERE a3.student_id = u.id
-                      AND a3.subject_id = a.subject_id
-                ),
-            2) AS Percentage
-
-        FROM attendance a
-        JOIN users u ON u.id = a.student_id
-        JOIN subjects s ON s.id = a.subject_id
-        WHERE u.department = ?
-    """
-    params = [final_branch]
-
-    if semester:
-        query += " AND a.semester = ?"
-        params.append(int(semester))
-
-    if subject_id:
-        query += " AND a.subject_id = ?"
-        params.append(int(subject_id))
-
     # 🔥 DATE FILTER ONLY WHEN NOT ALL_DATES
-    if date and date.strip() != "" and not all_dates:
-       query += " AND a.date = ?"
-       params.append(date)
-
-    query += " ORDER BY u.roll_no, a.date"
+    if not date or date.strip() == "" or all_dates:
+        date = None
 
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
+    filters = (current_college_id(), final_branch, semester, subject_id, date, month)
 
-    if not rows:
+    if not attendance_export_exists(conn, *filters):
+        conn.close()
         flash("No attendance data found", "warning")
         return redirect(url_for("admin_attendance_records"))
 
-    df = pd.DataFrame(rows, columns=rows[0].keys())
+    name = "attendance_register" if layout == "pivot" else "attendance_report"
+    if month:
+        name += f"_{month}"
 
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-    df.to_excel(tmp.name, index=False)
+    if fmt == "csv":
+        conn.close()
+        return csv_response(
+            lambda c: attendance_export_rows(c, layout, *filters),
+            f"{name}.csv"
+        )
 
-    return send_file(
-        tmp.name,
-        as_attachment=True,
-        download_name="attendance_report.xlsx"
-    )
+    try:
+        return xlsx_response(
+            "Register" if layout == "pivot" else "Attendance",
+            attendance_export_rows(conn, layout, *filters),
+            f"{name}.xlsx"
+        )
+    finally:
+        conn.close()
 
 @app.route("/admin/attendance/pdf")
 @login_required(role="admin")
 def admin_attendance_pdf():
 
-    from reportlab.lib.pagesizes import A4
-    from reportlab.pdfgen import canvas
-    import tempfile
-
-    semester = int(request.args.get("semester"))
-    subject_id = int(request.args.get("subject_id"))
-    date = request.args.get("date")
+    semester = request.args.get("semester", type=int)
+    subject_id = request.args.get("subject_id", type=int)
+    sub_branch = request.args.get("sub_branch")
 
     conn = get_db()
 
-    data = conn.execute("""
+    subject = conn.execute(
+        "SELECT name, department FROM subjects WHERE id=?", (subject_id,)
+    ).fetchone()
+
+    # only subjects of the admin's own branch
+    if (
+        not semester or not subject
+        or dept_key(subject["department"]) != dept_key(session.get("admin_branch") or "")
+    ):
+        conn.close()
+        flash("Select a subject of your branch", "danger")
+        return redirect(url_for("admin_attendance"))
+
+    names = dept_names(subject["department"])
+    if sub_branch in names:
+        names = [sub_branch]
+
+    # students of the semester, plus anyone promoted since who has
+    # attendance in it
+    cursor = conn.execute(f"""
         SELECT
             u.name,
             u.roll_no,
-            COUNT(a.id) AS total,
-            SUM(CASE WHEN a.status='Present' THEN 1 ELSE 0 END) AS present
+            COALESCE(sm.total, 0) AS total,
+            COALESCE(sm.present, 0) AS present
         FROM users u
-        LEFT JOIN attendance a
-          ON a.student_id=u.id
-         AND a.subject_id=?
-         AND a.semester=?
-        GROUP BY u.id
+        LEFT JOIN attendance_summary sm
+          ON sm.student_id=u.id
+         AND sm.subject_id=?
+         AND sm.semester=?
+        WHERE u.role='student'
+          AND u.college_id=?
+          AND u.department IN ({in_params(names)})
+          AND (u.semester=? OR sm.student_id IS NOT NULL)
         ORDER BY u.roll_no
-    """, (subject_id, semester)).fetchall()
-
-    conn.close()
-
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    c = canvas.Canvas(tmp.name, pagesize=A4)
-
-    y = 800
-    c.setFont("Helvetica", 10)
-    c.drawString(50, y, "Attendance Report")
-    y -= 30
+    """, [subject_id, semester, current_college_id()] + names + [semester])
 
-    for r in data:
-        percent = (r["present"]/r["total"]*100) if r["total"] else 0
-        c.drawString(
-            50, y,
-            f"{r['roll_no']} | {r['name']} | {percent:.1f}%"
+    try:
+        return pdf_table_report(
+            f"Attendance Report - {subject['name']} (Semester {semester})",
+            [
+                ("Roll No", 80, lambda r: r["roll_no"]),
+                ("Name", 215, lambda r: r["name"]),
+                ("Present", 70, lambda r: r["present"]),
+                ("Total", 70, lambda r: r["total"]),
+                ("%", 80, lambda r: f"{r['present'] / r['total'] * 100:.1f}%"
+                                    if r["total"] else "0.0%"),
+            ],
+            iter_rows(cursor),
+            f"attendance_{subject_id}_sem_{semester}.pdf",
+            as_attachment=False
         )
-        y -= 18
-        if y < 50:
-            c.showPage()
-            y = 800
-
-    c.save()
-
-    return send_file(tmp.name, as_attachment=False)
+    finally:
+        conn.close()
 
-from fpdf import FPDF
-from fpdf import FPDF
 from flask import send_file
 import tempfile
 
@@ -2734,20 +6305,28 @@ def developer_logout():
 def developer_panel():
     if not session.get("developer"):
         return redirect(url_for("developer_login"))
-    conn = get_db()
-    users = conn.execute("SELECT id, name, email, role, department FROM users ORDER BY id DESC").fetchall()
-    conn.close()
+    users = unsharded_rows(fan_out(lambda conn: conn.execute(
+        "SELECT id, name, email, role, department, college_id FROM users"
+    ).fetchall()))
+    users.sort(key=lambda u: u["id"], reverse=True)
     return render_template("developer_panel.html", users=users)
 
 
+def clear_everywhere(*statements):
+    """Run the DELETEs on the main database and on every shard."""
+    def run(conn):
+        for sql in statements:
+            conn.execute(sql)
+        invalidate_leave_stats(conn)
+        conn.commit()
+    fan_out(run)
+
+
 @app.route("/developer/clear/students")
 def dev_clear_students():
     if not session.get("developer"):
         return redirect(url_for("developer_login"))
-    conn = get_db()
-    conn.execute("DELETE FROM users WHERE role='student'")
-    conn.commit()
-    conn.close()
+    clear_everywhere("DELETE FROM users WHERE role='student'")
     flash("All students deleted!", "danger")
     return redirect(url_for("developer_panel"))
 
@@ -2756,10 +6335,7 @@ def dev_clear_students():
 def dev_clear_leaves():
     if not session.get("developer"):
         return redirect(url_for("developer_login"))
-    conn = get_db()
-    conn.execute("DELETE FROM leaves")
-    conn.commit()
-    conn.close()
+    clear_everywhere("DELETE FROM leaves")
     flash("All leaves deleted!", "danger")
     return redirect(url_for("developer_panel"))
 
@@ -2768,10 +6344,7 @@ def dev_clear_leaves():
 def dev_clear_attendance():
     if not session.get("developer"):
         return redirect(url_for("developer_login"))
-    conn = get_db()
-    conn.execute("DELETE FROM attendance")
-    conn.commit()
-    conn.close()
+    clear_everywhere("DELETE FROM attendance", "DELETE FROM attendance_summary")
     flash("All attendance deleted!", "danger")
     return redirect(url_for("developer_panel"))
 
@@ -2780,10 +6353,7 @@ def dev_clear_attendance():
 def dev_clear_admins():
     if not session.get("developer"):
         return redirect(url_for("developer_login"))
-    conn = get_db()
-    conn.execute("DELETE FROM users WHERE role='admin'")
-    conn.commit()
-    conn.close()
+    clear_everywhere("DELETE FROM users WHERE role='admin'")
     flash("All admins deleted!", "danger")
     return redirect(url_for("developer_panel"))
 
@@ -2792,9 +6362,25 @@ def dev_clear_admins():
 def dev_reset_db():
     if not session.get("developer"):
         return redirect(url_for("developer_login"))
-    if os.path.exists(DB_NAME):
-        os.remove(DB_NAME)
-    create_tables()
+
+    # drop every pooled handle before deleting the files
+    conn = g.pop("db", None)
+    if conn is not None:
+        g.pop("db_pool", None)
+        conn.really_close()
+    shards = [shard_path(cid) for cid in shard_ids()]
+    clear_pools()
+
+    for db in [DB_NAME] + shards:
+        for path in (db, db + "-wal", db + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+    conn = get_pool().connect()
+    upgrade_db(conn)
+    conn.close()
+    leave_stats_cache.clear()
+    login_cache.clear()
+    profile_cache.clear()
     flash("Database reset!", "success")
     return redirect(url_for("developer_panel"))
 
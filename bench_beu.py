@@ -0,0 +1,231 @@
+# bench_beu.py - BEU result fetch job against a local fake result server
+#
+#   python bench_beu.py                                  # 40 students, app defaults
+#   python bench_beu.py --regs 100 --workers 8 --interval 0.1 --latency 0.3
+#   python bench_beu.py --flaky 7                        # every 7th reg: 503 once
+#
+# Starts a stub of the BEU result site on 127.0.0.1 (GET = form page +
+# session cookie, POST regNo = result page after --latency seconds; every
+# --missing'th reg has no result), points BEU_RESULT_URL at it and runs
+# run_beu_job on a temporary copy of leave.db. The stub records every
+# request, so the script can check that:
+#   - at most BEU_MAX_WORKERS POSTs were in flight at once
+#   - requests were spaced at least BEU_MIN_INTERVAL apart
+#   - the job stored exactly the students that have results
+#   - a second run is served from beu_raw_cache (POSTs only for the
+#     students that had no result)
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COLLEGE = "GOVERNMENT ENGINEERING COLLEGE KAIMUR"
+SUBJECTS = ["Mathematics", "Physics", "Programming", "Electronics", "Workshop"]
+
+
+class FakeBeu:
+    """What the stub saw: request start times and peak POSTs in flight."""
+
+    def __init__(self, latency, missing, flaky):
+        self.latency = latency
+        self.missing = missing
+        self.flaky = flaky
+        self.starts = []      # (monotonic, method)
+        self.in_flight = 0
+        self.peak = 0
+        self.failed_once = set()
+        self.lock = threading.Lock()
+
+    def has_result(self, reg):
+        return not (self.missing and int(reg[-3:]) % self.missing == 0)
+
+    def page(self, reg):
+        if not self.has_result(reg):
+            return "<html><body>No Record Found</body></html>"
+        n = int(reg[-3:])
+        rows = "".join(
+            f"<tr><td>{name}</td><td>100</td><td>{(n * 7 + i * 13) % 60 + 40}</td></tr>"
+            for i, name in enumerate(SUBJECTS)
+        )
+        return (f"<html><body><p>Student Name: Bench {n}</p>"
+                f"<p>Registration No: {reg}</p><table>{rows}</table></body></html>")
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"   # keep-alive, like the real site
+
+            def reply(self, status, body):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Set-Cookie", "beu_session=bench; Path=/")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.starts.append((time.monotonic(), "GET"))
+                self.reply(200, "<form method='post'><input name='regNo'></form>")
+
+            def do_POST(self):
+                size = int(self.headers.get("Content-Length", 0))
+                reg = parse_qs(self.rfile.read(size).decode()).get("regNo", [""])[0]
+                with fake.lock:
+                    fake.starts.append((time.monotonic(), "POST"))
+                    fake.in_flight += 1
+                    fake.peak = max(fake.peak, fake.in_flight)
+                    fail = (fake.flaky and int(reg[-3:]) % fake.flaky == 0
+                            and reg not in fake.failed_once)
+                    if fail:
+                        fake.failed_once.add(reg)
+                try:
+                    time.sleep(fake.latency)
+                    if fail:
+                        self.reply(503, "busy")
+                    else:
+                        self.reply(200, fake.page(reg))
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def reset(self):
+        with self.lock:
+            self.starts = []
+            self.peak = 0
+
+
+def setup(args):
+    """Start the stub, then import app against it on a temp copy of leave.db."""
+    fake = FakeBeu(args.latency, args.missing, args.flaky)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), fake.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # read by app.py at import time
+    os.environ["BEU_RESULT_URL"] = f"http://127.0.0.1:{server.server_port}/result-one/"
+    if args.workers:
+        os.environ["BEU_MAX_WORKERS"] = str(args.workers)
+    if args.interval is not None:
+        os.environ["BEU_MIN_INTERVAL"] = str(args.interval)
+
+    workdir = tempfile.mkdtemp(prefix="bench_beu_")
+    shutil.copy(os.path.join(HERE, "leave.db"), workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+
+    import app as A
+    return A, fake, server, workdir
+
+
+def run_job(A, college_id, regs, sem, refetch=False):
+    conn = A.get_pool().connect()
+    job_id = conn.execute("""
+        INSERT INTO beu_fetch_jobs (admin_id, college_id, branch, semester, total)
+        VALUES (?, ?, ?, ?, ?)
+    """, (0, college_id, "CSE", sem, len(regs))).lastrowid
+    conn.commit()
+
+    t = time.perf_counter()
+    A.run_beu_job(job_id, regs, sem, college_id, refetch=refetch)
+    wall = time.perf_counter() - t
+
+    job = conn.execute("SELECT * FROM beu_fetch_jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return job, wall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regs", type=int, default=40)
+    parser.add_argument("--sem", default="3")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="BEU_MAX_WORKERS (default: app default)")
+    parser.add_argument("--interval", type=float, default=None,
+                        help="BEU_MIN_INTERVAL seconds (default: app default)")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="seconds the stub takes per result page")
+    parser.add_argument("--missing", type=int, default=10,
+                        help="every Nth reg has no result (0 = none)")
+    parser.add_argument("--flaky", type=int, default=0,
+                        help="every Nth reg answers 503 once (0 = none)")
+    parser.add_argument("--keep", action="store_true", help="keep the temp DB")
+    args = parser.parse_args()
+
+    A, fake, server, workdir = setup(args)
+    try:
+        conn = A.get_pool().connect()
+        college_id = A.college_id_for(conn, COLLEGE)
+        conn.close()
+
+        regs = [f"22105129{i:03d}" for i in range(1, args.regs + 1)]
+        expect = sum(fake.has_result(r) for r in regs)
+
+        job, wall = run_job(A, college_id, regs, args.sem, refetch=True)
+        posts = [t for t, method in fake.starts if method == "POST"]
+        starts = sorted(t for t, _ in fake.starts)
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        mean_gap = (starts[-1] - starts[0]) / max(len(starts) - 1, 1)
+        floor = max(len(posts) * A.BEU_MIN_INTERVAL,
+                    len(posts) * args.latency / A.BEU_MAX_WORKERS)
+
+        print(f"{args.regs} regs, BEU_MAX_WORKERS {A.BEU_MAX_WORKERS}, "
+              f"BEU_MIN_INTERVAL {A.BEU_MIN_INTERVAL}s, latency {args.latency}s")
+        print(f"fetch run   : {job['status']}  fetched {job['fetched']}  "
+              f"failed {job['failed']}  {len(posts)} POSTs  wall {wall:.2f} s "
+              f"(limits allow >= {floor:.2f} s)")
+        print(f"concurrency : peak {fake.peak} in flight")
+        print(f"spacing     : mean gap {mean_gap * 1000:.0f} ms, "
+              f"min gap {min(gaps, default=0) * 1000:.0f} ms")
+
+        conn = A.get_pool().connect()
+        stored = conn.execute("""
+            SELECT COUNT(DISTINCT registration_no) FROM beu_results
+            WHERE college_id IS ? AND semester = ?
+              AND registration_no IN (SELECT value FROM json_each(?))
+        """, (college_id, args.sem, json.dumps(regs))).fetchone()[0]
+        conn.close()
+        print(f"stored      : {stored} students with results (expected {expect})")
+
+        fake.reset()
+        cached_job, cached_wall = run_job(A, college_id, regs, args.sem)
+        cached_posts = sum(1 for _, method in fake.starts if method == "POST")
+        print(f"cached run  : {cached_job['status']}  cached {cached_job['cached']}  "
+              f"{cached_posts} POSTs  wall {cached_wall:.2f} s")
+
+        # single gaps seen by the stub jitter by thread scheduling (allow
+        # 15 ms); the mean spacing must not
+        good = (job["status"] == "done" and cached_job["status"] == "done"
+                and job["fetched"] == stored == expect
+                and fake.peak <= A.BEU_MAX_WORKERS
+                and mean_gap >= A.BEU_MIN_INTERVAL * 0.99
+                and min(gaps, default=1) >= A.BEU_MIN_INTERVAL - 0.015
+                and cached_job["cached"] == expect
+                and cached_posts == args.regs - expect)
+        print("OK" if good else "FAILED")
+        sys.exit(0 if good else 1)
+    finally:
+        server.shutdown()
+        A.clear_pools()
+        if args.keep:
+            print("temp DB:", workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# bench_checkin.py - burst of QR check-ins on one projected token
+#
+#   python bench_checkin.py                      # 500 scans, one process
+#   python bench_checkin.py --scans 500 --processes 4
+#
+# Runs on a temporary copy of leave.db. Every scan is a JSON POST to
+# /student/submit-token from its own logged-in student on its own
+# thread, all released at once by a barrier (--processes splits them
+# over forked workers, like gunicorn); then every student scans again
+# (must be 409).
+# Checks that the token counted each student once and that no duplicate
+# attendance rows were written.
+import argparse
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+COLLEGE = "GOVERNMENT ENGINEERING COLLEGE KAIMUR"
+
+
+def setup(scans):
+    """Temp DB with `scans` students, one subject and a live token."""
+    workdir = tempfile.mkdtemp(prefix="bench_checkin_")
+    shutil.copy(os.path.join(HERE, "leave.db"), workdir)
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+
+    import app as A
+
+    conn = A.get_pool().connect()
+    college_id = A.college_id_for(conn, COLLEGE)
+    subject_id = conn.execute(
+        "INSERT INTO subjects (name, department, semester) VALUES (?, ?, ?) RETURNING id",
+        ("Bench Subject", "CSE", 1)
+    ).fetchone()[0]
+    students = [
+        conn.execute("""
+            INSERT INTO users (name, email, password, role, department, semester,
+                               college, college_id)
+            VALUES (?, ?, '!', 'student', 'CSE (Network)', 1, ?, ?)
+            RETURNING id
+        """, (f"bench {i}", f"bench{i}@checkin", COLLEGE, college_id)).fetchone()[0]
+        for i in range(scans)
+    ]
+    conn.commit()
+
+    token = A.issue_qr_token(conn, college_id, subject_id)
+    conn.close()
+    return A, workdir, college_id, subject_id, token["full_token"], students
+
+
+def client_for(A, student_id, college_id):
+    c = A.app.test_client()
+    with c.session_transaction() as s:
+        s["user_id"] = student_id
+        s["user_role"] = "student"
+        s["college"] = COLLEGE
+        s["college_id"] = college_id
+    return c
+
+
+def scan(client, token):
+    t = time.perf_counter()
+    r = client.post("/student/submit-token", json={"token": token})
+    return r.status_code, time.perf_counter() - t
+
+
+def burst(clients, token, barrier=None):
+    """
+    All clients scan once, released together → ([(status, seconds)], wall).
+    barrier lines up the forked workers before their threads start.
+    """
+    gate = threading.Barrier(len(clients))
+
+    def one(client):
+        gate.wait()
+        return scan(client, token)
+
+    if barrier is not None:
+        barrier.wait()
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as ex:
+        results = list(ex.map(one, clients))
+    return results, time.perf_counter() - t
+
+
+def run_threads(A, college_id, token, students):
+    clients = [client_for(A, sid, college_id) for sid in students]
+    first, wall = burst(clients, token)
+    again, _ = burst(clients, token)
+    return first, again, wall
+
+
+def _child(args):
+    A, college_id, token, students, barrier, out = args
+    A.clear_pools()   # never reuse the parent's handles after fork
+    clients = [client_for(A, sid, college_id) for sid in students]
+    first, wall = burst(clients, token, barrier)
+    again, _ = burst(clients, token)
+    out.put((first, again, wall))
+
+
+def run_processes(A, college_id, token, students, processes):
+    ctx = multiprocessing.get_context("fork")
+    barrier = ctx.Barrier(processes)
+    out = ctx.Queue()
+    chunks = [students[i::processes] for i in range(processes)]
+
+    procs = [
+        ctx.Process(target=_child, args=((A, college_id, token, chunk, barrier, out),))
+        for chunk in chunks
+    ]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    first = [r for f, _, _ in results for r in f]
+    again = [r for _, a, _ in results for r in a]
+    return first, again, max(w for _, _, w in results)
+
+
+def summary(label, results):
+    codes = {}
+    for code, _ in results:
+        codes[code] = codes.get(code, 0) + 1
+    secs = sorted(s * 1000 for _, s in results)
+    p99 = secs[min(len(secs) - 1, int(len(secs) * 0.99))]
+    print(f"{label:12}: {dict(sorted(codes.items()))}  "
+          f"median {statistics.median(secs):.0f} ms  p99 {p99:.0f} ms")
+    return codes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scans", type=int, default=500)
+    parser.add_argument("--processes", type=int, default=0,
+                        help="fork N workers (gunicorn-like) instead of threads")
+    parser.add_argument("--keep", action="store_true", help="keep the temp DB")
+    args = parser.parse_args()
+
+    A, workdir, college_id, subject_id, token, students = setup(args.scans)
+    try:
+        if args.processes:
+            first, again, wall = run_processes(
+                A, college_id, token, students, args.processes
+            )
+        else:
+            first, again, wall = run_threads(A, college_id, token, students)
+
+        print(f"{args.scans} scans, {args.processes or 1} process(es), "
+              f"first burst wall {wall:.2f} s")
+        ok = summary("first scan", first)
+        dup = summary("repeat scan", again)
+
+        conn = A.get_pool().connect()
+        uses = conn.execute(
+            "SELECT uses FROM qr_tokens WHERE full_token = ?", (token,)
+        ).fetchone()[0]
+        rows, distinct = conn.execute("""
+            SELECT COUNT(*), COUNT(DISTINCT student_id) FROM attendance
+            WHERE subject_id = ?
+        """, (subject_id,)).fetchone()
+        conn.close()
+        print(f"token uses {uses}, attendance rows {rows} ({distinct} students)")
+
+        good = (ok.get(200) == args.scans and dup.get(409) == args.scans
+                and uses == rows == distinct == args.scans)
+        print("OK" if good else "FAILED")
+        sys.exit(0 if good else 1)
+    finally:
+        if args.keep:
+            print("temp DB:", workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
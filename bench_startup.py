@@ -0,0 +1,97 @@
+# bench_startup.py - cold start + memory of one app worker
+#
+#   python bench_startup.py            # 5 runs, summary
+#   python bench_startup.py --runs 10 --top 20
+#
+# Every run is a fresh interpreter (what a gunicorn worker pays):
+#   - import time of app.py from `python -X importtime`
+#   - RSS right after `import app`
+#   - which heavy libraries got loaded at import
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+
+# should only load on first use (tools / export / upload / report)
+HEAVY_MODULES = [
+    "fitz", "pdf2docx", "pdfplumber", "pandas", "pytesseract", "docx",
+    "reportlab", "fpdf", "openpyxl", "qrcode", "PIL"
+]
+
+PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import app
+elapsed = time.perf_counter() - t
+rss = 0
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1]) // 1024
+print(json.dumps({
+    "seconds": elapsed,
+    "rss_mb": rss,
+    "heavy": [m for m in %r if m in sys.modules]
+}))
+""" % (HEAVY_MODULES,)
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def probe():
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def importtime(top):
+    """Cumulative import time (ms) of the packages app.py pulls in."""
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        capture_output=True, text=True, check=True
+    ).stderr
+
+    total = 0
+    children = {}
+    for line in err.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if not m:
+            continue
+        depth = len(m.group(3))
+        if depth == 1 and m.group(4) == "app":
+            total = int(m.group(2))
+        elif depth == 3:
+            children[m.group(4)] = int(m.group(2))
+
+    ranked = sorted(children.items(), key=lambda x: -x[1])[:top]
+    return total / 1000, [(name, us / 1000) for name, us in ranked]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12)
+    args = parser.parse_args()
+
+    runs = [probe() for _ in range(args.runs)]
+    secs = [r["seconds"] * 1000 for r in runs]
+    rss = [r["rss_mb"] for r in runs]
+
+    total, ranked = importtime(args.top)
+
+    print(f"import app   : median {statistics.median(secs):.0f} ms "
+          f"(min {min(secs):.0f}, max {max(secs):.0f}, {args.runs} runs)")
+    print(f"worker RSS   : median {statistics.median(rss)} MB")
+    print(f"heavy loaded : {', '.join(runs[-1]['heavy']) or 'none'}")
+    print()
+    print(f"-X importtime (app total {total:.0f} ms), slowest imports:")
+    for name, ms in ranked:
+        print(f"  {ms:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -41,6 +41,7 @@ CREATE TABLE IF NOT EXISTS colleges (
         parent_phone TEXT,
         parent_email TEXT,
         admin_branch TEXT,
+        college TEXT,
         photo TEXT,
         created_at TEXT DEFAULT CURRENT_TIMESTAMP
     );
@@ -381,6 +382,9 @@ CREATE TABLE IF NOT EXISTS colleges (
         subjects
     )
 
+    # tables were recreated → let app.py re-run its migrations (indexes)
+    c.execute("PRAGMA user_version=0")
+
     conn.commit()
     conn.close()
     print("✅ Database + Subjects initialized successfully")